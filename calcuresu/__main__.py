@@ -9,12 +9,23 @@ import sys
 import importlib
 import threading
 
+from calcuresu.agenda import Agenda, print_agenda
+from calcuresu.backup import backup_workspaces, restore_workspace
 from calcuresu.base_view import View
+from calcuresu.configuration import COMMAND_LINE_OPTIONS
 from calcuresu.consts import AppState
 from calcuresu.screen import Screen
 from calcuresu.colors import initialize_colors
 from calcuresu.data import *
+from calcuresu.events import Event, EventLoop
+from calcuresu.export import export_workspace
+from calcuresu.importer import import_tasks
+from calcuresu.report import TimeReports, report_workspace
 from calcuresu.controls import *
+from calcuresu.singletons import tracer
+from calcuresu.search import search_workspaces
+from calcuresu.server import serve_workspaces
+from calcuresu.workspace_cache import WorkspaceCache
 
 
 
@@ -25,16 +36,38 @@ from calcuresu.views.fragments.error import ErrorView
 from calcuresu.views.fragments.footer import FooterView
 from calcuresu.views.screens.archive import ArchiveScreenView
 from calcuresu.views.screens.colors import ColorScreenView
+from calcuresu.views.screens.search import SearchScreenView
+from calcuresu.views.screens.agenda import AgendaScreenView
 from calcuresu.views.screens.help import HelpScreenView
 from calcuresu.views.screens.journal import JournalScreenView
+from calcuresu.views.screens.report import ReportScreenView
 from calcuresu.views.screens.welcome import WelcomeScreenView
 from calcuresu.views.screens.wizard import WorkspaceManagerScreenView
 
 
+def next_wake_up(screen: Screen):
+    """Seconds the main loop may sleep without input. The workspace screens look for changes of their files
+    (and the journal redraws its running timers) on every refresh interval, the others only react to keys"""
+    if screen.state in [AppState.JOURNAL, AppState.ARCHIVE, AppState.WIZARD, AppState.AGENDA, AppState.REPORT]:
+        return global_config.REFRESH_INTERVAL.value
+    return None
+
+
+def wait_for_next_frame(screen: Screen):
+    """Keep to the maximal frame rate. The keys pressed in the meantime are handled as one batch"""
+    max_frame_rate = global_config.MAX_FRAME_RATE.value
+    if max_frame_rate > 0:
+        time_left = screen.last_frame_time + 1 / max_frame_rate - time.monotonic()
+        if time_left > 0:
+            time.sleep(time_left)
+    screen.last_frame_time = time.monotonic()
+
+
 def main(stdscr) -> None:
     """Main function that runs and switches screens"""
 
     screen = Screen(stdscr, global_config)
+    events = EventLoop(sys.stdin.fileno())
 
     # Initialise terminal screen:
     stdscr = curses.initscr()
@@ -48,6 +81,11 @@ def main(stdscr) -> None:
     user_tasks: Tasks|None = None
     workspaces = Workspaces(global_config.WORKSPACES_FILE.value, global_config.WORKSPACES_LOCK_FILE.value)
     workspaces.initialize(stdscr, screen)
+    workspace_cache = WorkspaceCache(global_config.WORKSPACE_CACHE_SIZE.value,
+                                     global_config.WORKSPACE_CACHE_MEMORY.value * 1024 * 1024,
+                                     global_config.recent_workspaces_file)
+    if global_config.PRELOAD_WORKSPACES.value:
+        workspace_cache.start_preloading(workspaces)
 
     # Initialise screen views:
     app_view = View(stdscr, 0, 0)
@@ -59,6 +97,11 @@ def main(stdscr) -> None:
     archive_view: ArchiveScreenView|None = None
     workspaces_view = WorkspaceManagerScreenView(stdscr, 0, 0, screen, workspaces)
     color_view = ColorScreenView(stdscr, 0, 0, screen)
+    search_view = SearchScreenView(stdscr, 0, 0, screen)
+    agenda = Agenda(workspaces)
+    agenda_view = AgendaScreenView(stdscr, 0, 0, screen, agenda)
+    time_reports = TimeReports()
+    report_view: ReportScreenView|None = None
     try:
         # Show welcome screen on the first run:
         if global_config.is_first_run:
@@ -66,6 +109,22 @@ def main(stdscr) -> None:
 
         # Running different screens depending on the state:
         while screen.state != AppState.EXIT:
+            # Sleep until a key is pressed, the terminal is resized or it is time to look for changes:
+            if screen.input_idle and not screen.next_need_refresh:
+                woken_by = events.wait(next_wake_up(screen))
+                if Event.TIMEOUT in woken_by and screen.state == AppState.JOURNAL \
+                        and user_tasks is not None and user_tasks.has_active_timer:
+                    screen.next_need_refresh = True
+                if Event.SEARCH_RESULTS in woken_by and screen.state == AppState.SEARCH:
+                    screen.next_need_refresh = True
+                if Event.TIMEOUT in woken_by and screen.state == AppState.AGENDA and agenda.timers:
+                    screen.next_need_refresh = True  # Counts the running timers up
+                if Event.TIMEOUT in woken_by and screen.state == AppState.REPORT \
+                        and report_view is not None and report_view.has_running_timers:
+                    screen.next_need_refresh = True
+            screen.input_idle = False
+            opened_tasks: Tasks|None = None  # Set when a workspace was loaded, from the workspace manager or a search
+
             if screen.resized:
                 screen.current_size = stdscr.getmaxyx()
                 screen.next_need_refresh = True
@@ -73,14 +132,10 @@ def main(stdscr) -> None:
             screen.need_refresh = screen.next_need_refresh
             screen.next_need_refresh = False
             if screen.need_refresh:
+                wait_for_next_frame(screen)
                 stdscr.clear()
                 app_view.fill_background()
                 stdscr.keypad(True)  # This is used for us to be able to use KEY_* again
-            
-            # Calculate screen refresh rate:
-            curses.halfdelay(1)
-            if user_tasks is not None and user_tasks.has_active_timer and screen.state == AppState.JOURNAL:
-                curses.halfdelay(global_config.REFRESH_INTERVAL.value * 10)
 
             # Journal screen:
             if screen.state == AppState.JOURNAL:
@@ -140,21 +195,58 @@ def main(stdscr) -> None:
                 if workspaces.reopen_shelve_if_needed_locked(stdscr, screen):
                     continue
                 
-                temp_user_tasks = control_workspaces_screen(stdscr, screen, workspaces)
-                if temp_user_tasks is not None:
-                    user_tasks = temp_user_tasks
-                    journal_screen_view = JournalScreenView(stdscr, 0, 0, user_tasks, screen)
-                    archive_view = ArchiveScreenView(stdscr, 0, 0, user_tasks, screen)
-                    screen.next_need_refresh = True
+                opened_tasks = control_workspaces_screen(stdscr, screen, workspaces, workspace_cache)
             elif screen.state == AppState.COLOR:
                 control_color_screen(stdscr, screen)
                 color_view.render()
                 footer_view.render()
                 stdscr.refresh()
+            elif screen.state == AppState.SEARCH:
+                search_view.render()
+                footer_view.render()
+                error_view.render()
+                opened_tasks = control_search_screen(stdscr, screen, workspaces, workspace_cache,
+                                                     events.notify_search_results)
+            elif screen.state == AppState.AGENDA:
+                if agenda.refresh():
+                    screen.next_need_refresh = True
+                    continue
+                agenda_view.render()
+                footer_view.render()
+                error_view.render()
+                control_agenda_screen(stdscr, screen)
+            elif screen.state == AppState.REPORT:
+                if report_view is not None:
+                    report_view.render()
+                else:
+                    logging.error("Must load a workspace before going to the time report. Going back to workspace manager...")
+                    screen.state = AppState.WIZARD
+                    screen.next_need_refresh = True
+
+                footer_view.render()
+                error_view.render()
+                if user_tasks is not None and screen.state == AppState.REPORT:
+                    if user_tasks.reopen_shelve_if_needed_locked(stdscr, screen):
+                        continue
+
+                    control_report_screen(stdscr, screen)
+                else:
+                    # let the error be seen
+                    stdscr.refresh()
+                    time.sleep(0.5)
 
             else:
                 break
 
+            if opened_tasks is not None:
+                # The previous workspace stays open in the cache (which writes what it has pending once it closes it)
+                user_tasks = opened_tasks
+                user_tasks.watch_changes(events.notify_file_changed)
+                journal_screen_view = JournalScreenView(stdscr, 0, 0, user_tasks, screen)
+                archive_view = ArchiveScreenView(stdscr, 0, 0, user_tasks, screen)
+                report_view = ReportScreenView(stdscr, 0, 0, screen, user_tasks, time_reports)
+                screen.next_need_refresh = True
+
     except Exception as e:
         raise
     else:
@@ -163,17 +255,79 @@ def main(stdscr) -> None:
         curses.curs_set(True)
         curses.endwin()
     finally:
-        if user_tasks is not None:
-            # Save shelve file
-            user_tasks.cleanup()
+        if screen.search is not None:
+            screen.search.cancel()
+
+        # Save the shelve files of every open workspace
+        workspace_cache.close()
 
         if workspaces is not None:
             # Save shelve file
             workspaces.cleanup()
 
+        events.close()
+        tracer.flush()
+
+
+
+def compact_workspaces(workspace_paths: list[str]) -> int:
+    """Apply the archive retention policy and compact the given workspaces (all of them by default)"""
+    workspaces = Workspaces(global_config.WORKSPACES_FILE.value, global_config.WORKSPACES_LOCK_FILE.value)
+    if not workspace_paths:
+        workspace_paths = [workspace.workspace_path for workspace in workspaces.read_shelve_key_readonly("workspaces", [])]
+
+    exit_code = 0
+    for workspace_path in workspace_paths:
+        if not Path(workspace_path).is_file():
+            print(f"{workspace_path}: no such workspace")
+            exit_code = 1
+            continue
+
+        user_tasks = Tasks.from_workspace(Workspace(workspace_path))
+        user_tasks.registry = workspaces  # Keeps the statistics in the workspace manager up to date
+        try:
+            user_tasks.lock(timeout=None)
+        except TimeOutError:
+            print(f"{workspace_path}: another user is editing it, skipped")
+            exit_code = 1
+            continue
+
+        try:
+            size_before, size_after = user_tasks.compact_nolock()
+            print(f"{workspace_path}: {size_before} -> {size_after} bytes")
+        finally:
+            user_tasks.cleanup()  # Closes the shelf, so its cache isn't written back without the lock later
+
+    return exit_code
 
 
 def cli() -> None:
+    try:
+        options, arguments = getopt.gnu_getopt(sys.argv[1:], "", COMMAND_LINE_OPTIONS)
+    except getopt.GetoptError as e:
+        print(f"calcuresu: {e}", file=sys.stderr)
+        sys.exit(2)
+
+    if arguments and arguments[0] == "compact":
+        sys.exit(compact_workspaces(arguments[1:]))
+    if arguments and arguments[0] == "serve":
+        sys.exit(serve_workspaces(arguments[1:]))
+    if arguments and arguments[0] == "agenda":
+        sys.exit(print_agenda())
+    if arguments and arguments[0] == "search":
+        sys.exit(search_workspaces(arguments[1:], dict(options).get("--field", "name")))
+    if arguments and arguments[0] == "export":
+        sys.exit(export_workspace(arguments[1:], dict(options).get("--format"), dict(options).get("--output")))
+    if arguments and arguments[0] == "backup":
+        sys.exit(backup_workspaces(arguments[1:]))
+    if arguments and arguments[0] == "restore":
+        sys.exit(restore_workspace(arguments[1:]))
+    if arguments and arguments[0] == "import":
+        sys.exit(import_tasks(arguments[1:], dict(options).get("--format")))
+    if arguments and arguments[0] == "report":
+        sys.exit(report_workspace(arguments[1:], dict(options).get("--period"), dict(options).get("--format"),
+                                  dict(options).get("--output")))
+
     try:
         curses.wrapper(main)
     except (KeyboardInterrupt, curses.error): # Hides strange curses quitting error
@@ -0,0 +1,120 @@
+"""Module with the agenda: the deadlines and running timers of every workspace, merged from the manifests
+in the list of workspaces, so no workspace file is opened to build it"""
+
+from datetime import date
+import os
+from pathlib import Path
+from typing import List
+
+from calcuresu.classes.manifest import IndexedDeadline, IndexedTimer, WorkspaceManifest
+from calcuresu.data import MANIFESTS_KEY, Workspaces
+
+
+class AgendaDeadline:
+    def __init__(self, workspace_path: str, indexed: IndexedDeadline) -> None:
+        self.workspace_path = workspace_path
+        self.indexed = indexed
+
+    def days_left(self, today: date):
+        return (self.indexed.deadline - today).days
+
+
+class AgendaTimer:
+    def __init__(self, workspace_path: str, indexed: IndexedTimer) -> None:
+        self.workspace_path = workspace_path
+        self.indexed = indexed
+
+
+class Agenda:
+    """Deadlines (soonest first) and running timers of every workspace. Refreshing only reads the manifests
+    when the list of workspaces changed, and only rebuilds the part of a workspace whose generation changed"""
+
+    def __init__(self, workspaces: Workspaces) -> None:
+        self.workspaces = workspaces
+        self.deadlines: List[AgendaDeadline] = []
+        self.timers: List[AgendaTimer] = []
+        self.unindexed: List[str] = []  # Workspaces without a manifest (not saved since the agenda existed)
+        self._by_workspace: dict[str, tuple[int, List[AgendaDeadline], List[AgendaTimer]]] = {}
+        self._file_state: tuple|None = None
+
+    def _read_file_state(self):
+        """Changes whenever the list of workspaces is written (sqlite writes to the WAL file first)"""
+        state = []
+        for path in [Path(self.workspaces._shelve_filename), Path(f"{self.workspaces._shelve_filename}-wal")]:
+            try:
+                stat = os.stat(path)
+                state.append((stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                state.append(None)
+        return tuple(state)
+
+    def refresh(self):
+        """Pick up the manifests that changed. Returns whether the agenda changed"""
+        file_state = self._read_file_state()
+        if file_state == self._file_state:
+            return False
+        self._file_state = file_state
+
+        listed = [str(workspace.workspace_path) for workspace in self.workspaces.read_shelve_key_readonly("workspaces", [])]
+        manifests: dict[str, WorkspaceManifest] = self.workspaces.read_shelve_key_readonly(MANIFESTS_KEY, {})
+
+        changed = False
+        for workspace_path in set(self._by_workspace) - set(listed):
+            del self._by_workspace[workspace_path]
+            changed = True
+
+        self.unindexed = []
+        for workspace_path in listed:
+            manifest = manifests.get(workspace_path)
+            if manifest is None:
+                self.unindexed.append(workspace_path)
+                changed |= self._by_workspace.pop(workspace_path, None) is not None
+                continue
+
+            cached = self._by_workspace.get(workspace_path)
+            if cached is not None and cached[0] == manifest.generation:
+                continue
+
+            self._by_workspace[workspace_path] = (
+                manifest.generation,
+                [AgendaDeadline(workspace_path, indexed) for indexed in manifest.deadline_index],
+                [AgendaTimer(workspace_path, indexed) for indexed in manifest.timer_index],
+            )
+            changed = True
+
+        if changed:
+            self.deadlines = sorted((deadline for _, deadlines, _ in self._by_workspace.values() for deadline in deadlines),
+                                    key=lambda deadline: (deadline.indexed.deadline, deadline.workspace_path))
+            self.timers = sorted((timer for _, _, timers in self._by_workspace.values() for timer in timers),
+                                 key=lambda timer: float(timer.indexed.timer.stamps[-1]))
+        return changed
+
+
+def print_agenda() -> int:
+    """Print the agenda of every workspace (calcuresu agenda)"""
+    from calcuresu.singletons import global_config
+
+    agenda = Agenda(Workspaces(global_config.WORKSPACES_FILE.value, global_config.WORKSPACES_LOCK_FILE.value))
+    agenda.refresh()
+    today = date.today()
+
+    print(f"Running timers ({len(agenda.timers)}):")
+    for timer in agenda.timers:
+        print(f"  {timer.indexed.timer.passed_time:>12}  {timer.workspace_path}: {timer.indexed.name}")
+
+    print(f"Deadlines ({len(agenda.deadlines)}):")
+    for deadline in agenda.deadlines:
+        print(f"  {deadline.indexed.deadline.strftime('%Y/%m/%d')} ({describe_days_left(deadline.days_left(today))})  "
+              f"{deadline.workspace_path}: {deadline.indexed.name} ({deadline.indexed.status.name})")
+
+    if agenda.unindexed:
+        print(f"Not indexed yet, since they weren't saved since the agenda was added: {', '.join(agenda.unindexed)}")
+    return 0
+
+
+def describe_days_left(days: int):
+    if days < 0:
+        return f"{-days} days overdue" if days < -1 else "1 day overdue"
+    if days == 0:
+        return "today"
+    return f"in {days} days" if days > 1 else "tomorrow"
@@ -0,0 +1,144 @@
+"""Module that keeps totals of the descendants of tasks (task counts, tracked time, earliest deadline),
+so collapsed rows of the journal can show them without walking their subtree on every render.
+
+The totals of a task are computed the first time a row asks for them, from the totals of its children,
+and kept until something below it changes. A change of a task (a timer stamp, its status, deadline or
+archive date) or of its place in the tree only drops the totals of its ancestors, which are found through
+the parent ids recorded while computing. Totals are kept by id, so they stay valid when the workspace is
+loaded again after our own save, and are dropped when someone else saved it (see Tasks.subtree_aggregate).
+"""
+
+from typing import TYPE_CHECKING, Iterable
+
+from calcuresu.classes.task import RootTask, Task
+from calcuresu.consts import Status
+
+if TYPE_CHECKING:
+    from calcuresu.snapshot import Snapshot
+
+
+class SubtreeAggregate:
+    """Totals of the descendants of a task that aren't archived"""
+
+    __slots__ = ("count", "done", "seconds", "running", "running_since", "deadline")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.done = 0
+        self.seconds = 0.0  # Closed intervals of the timers
+        self.running = 0  # Running timers, and the sum of their starts, so their time can be read at any moment
+        self.running_since = 0.0
+        self.deadline = None  # Earliest deadline of the descendants that aren't done (a date ordinal)
+
+    def seconds_at(self, now: float):
+        return self.seconds + self.running * now - self.running_since
+
+    def add(self, other: "SubtreeAggregate"):
+        self.count += other.count
+        self.done += other.done
+        self.seconds += other.seconds
+        self.running += other.running
+        self.running_since += other.running_since
+        if other.deadline is not None and (self.deadline is None or other.deadline < self.deadline):
+            self.deadline = other.deadline
+
+    def add_task(self, is_archived: bool, status: Status, deadline: int|None, stamps: Iterable):
+        if is_archived:
+            return
+        self.count += 1
+        if status == Status.DONE:
+            self.done += 1
+        elif deadline is not None and (self.deadline is None or deadline < self.deadline):
+            self.deadline = deadline
+
+        stamps = list(stamps)
+        for index in range(1, len(stamps), 2):
+            self.seconds += float(stamps[index]) - float(stamps[index - 1])
+        if len(stamps) % 2 == 1:
+            self.running += 1
+            self.running_since += float(stamps[-1])
+
+
+class SubtreeAggregates:
+    """Totals of the descendants of tasks, by id. generation is the version of the workspace they were
+    computed from"""
+
+    def __init__(self) -> None:
+        self.generation: int|None = None
+        self._by_id: dict[int, SubtreeAggregate] = {}
+        self._parent_ids: dict[int, int] = {}  # Recorded while computing, updated when tasks move
+
+    def clear(self, generation: int|None = None):
+        self.generation = generation
+        self._by_id = {}
+        self._parent_ids = {}
+
+    def get(self, task: Task|RootTask) -> SubtreeAggregate:
+        """Totals of a task of the loaded tree. The missing totals of its descendants are computed on the way"""
+        aggregate = self._by_id.get(task.item_id)
+        if aggregate is not None:
+            return aggregate
+
+        stack = [(task, False)]
+        while stack:
+            node, children_done = stack.pop()
+            if node.item_id in self._by_id:
+                continue
+            if not children_done:
+                stack.append((node, True))
+                for child in node.children:
+                    self._parent_ids[child.item_id] = node.item_id
+                    if child.item_id not in self._by_id:
+                        stack.append((child, False))
+                continue
+
+            aggregate = SubtreeAggregate()
+            for child in node.children:
+                aggregate.add(self._by_id[child.item_id])
+                aggregate.add_task(child.is_archived, child.status,
+                                   child.deadline.toordinal() if child.deadline is not None else None, child.timer.stamps)
+            self._by_id[node.item_id] = aggregate
+        return self._by_id[task.item_id]
+
+    def get_from_snapshot(self, snapshot: "Snapshot", task: Task) -> SubtreeAggregate:
+        """Totals of a task of a snapshot, whose descendants are the rows after it that are deeper"""
+        aggregate = self._by_id.get(task.item_id)
+        if aggregate is not None:
+            return aggregate
+
+        row = snapshot.row_of_id(task.item_id)
+        item_ids, parent_ids, depths = snapshot.column("item_id"), snapshot.column("parent_id"), snapshot.column("depth")
+        statuses, deadlines, archive_dates = snapshot.column("status"), snapshot.column("deadline"), snapshot.column("archive_date")
+        stamps, stamps_offset, stamps_count = snapshot.column("stamps"), snapshot.column("stamps_offset"), snapshot.column("stamps_count")
+
+        aggregate = SubtreeAggregate()
+        depth = depths[row]
+        descendant = row + 1
+        while descendant < snapshot.row_count and depths[descendant] > depth:
+            self._parent_ids[item_ids[descendant]] = parent_ids[descendant]
+            offset = stamps_offset[descendant]
+            aggregate.add_task(bool(archive_dates[descendant]), Status(statuses[descendant]), deadlines[descendant] or None,
+                               stamps[offset:offset + stamps_count[descendant]])
+            descendant += 1
+        self._by_id[task.item_id] = aggregate
+        return aggregate
+
+    def _drop_from(self, item_id: int):
+        """Drop the totals of a task and of all of its ancestors"""
+        for _ in range(len(self._parent_ids) + 1):  # Bounded, in case the recorded parents are out of date
+            self._by_id.pop(item_id, None)
+            if item_id == 0 or item_id not in self._parent_ids:
+                return
+            item_id = self._parent_ids[item_id]
+
+    def task_changed(self, task: Task):
+        """A field that counts towards the totals changed"""
+        self._drop_from(self._parent_ids.get(task.item_id, task.parent_id))
+
+    def task_detached(self, task: Task):
+        """The task (and its subtree) is about to be taken out of its parent"""
+        self._drop_from(self._parent_ids.pop(task.item_id, task.parent_id))
+
+    def task_attached(self, task: Task, parent: Task|RootTask):
+        self._parent_ids[task.item_id] = parent.item_id
+        self._drop_from(parent.item_id)
@@ -0,0 +1,328 @@
+"""Module that takes and restores point-in-time backups of a workspace.
+
+The backups of a workspace live in `<workspace>.backups`. Every backup (a "point") is a small JSON file
+that lists the chunks it is made of, and chunks are stored once, named after the hash of their content:
+- The task tree is stored as flat records (a task without its children, plus its depth) in display order.
+  A chunk starts at every task whose id hashes to a boundary, so editing a task only changes its own
+  chunk, and the chunks of the unchanged parts of the tree are shared with the previous backups.
+- Every other key of the shelf (notes, archive chunks, ...) is stored as its pickled value.
+
+Backups are taken by a separate process that opens the workspace read-only, so saving never waits for them.
+"""
+
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import hashlib
+import json
+import multiprocessing
+import os
+from pathlib import Path
+import pickle
+import shelve
+import sys
+import time
+from typing import List
+import zlib
+
+from flufl.lock import LockState, TimeOutError
+
+from calcuresu.classes.task import Task
+from calcuresu.classes.workspace import Workspace
+from calcuresu.locks import LeaseHeartbeat, create_lock_backend
+from calcuresu.singletons import global_config
+
+
+BACKUP_VERSION = 1
+BACKUP_SUFFIX = ".backups"
+BACKUP_LOCK_NAME = "lock"
+TREE_KEY = "task_tree"
+CHUNK_BOUNDARY = 64  # A task starts a new chunk when the hash of its id is divisible by this (chunks of ~64 tasks)
+MAX_CHUNK_RECORDS = 4096  # ... or when the chunk has grown this much
+
+
+def backup_folder_for(shelve_filename: Path | str):
+    return Path(f"{shelve_filename}{BACKUP_SUFFIX}")
+
+
+class BackupStore:
+    """The chunks and points of the backups of one workspace"""
+
+    def __init__(self, shelve_filename: Path | str) -> None:
+        self.folder = backup_folder_for(shelve_filename)
+        self.chunks_folder = self.folder / "chunks"
+        self.points_folder = self.folder / "points"
+
+    @contextmanager
+    def locked(self):
+        """Hold the lock of the backups of the workspace. A backup skips the chunks that exist already, so
+        a prune running at the same time could delete them before its point is written. Raises TimeOutError"""
+        self.folder.mkdir(parents=True, exist_ok=True)
+        lifetime = timedelta(seconds=global_config.LOCK_LIFETIME.value)
+        lock = create_lock_backend(self.folder / BACKUP_LOCK_NAME, lifetime,
+                                   timedelta(seconds=global_config.LOCK_ACQUIRE_TIMEOUT.value), global_config.LOCK_BACKEND.value)
+
+        def refresh():
+            if lock.state != LockState.ours:
+                return False
+            lock.refresh()
+            return True
+
+        # Backing up a large workspace may take longer than the lifetime of the lock
+        heartbeat = LeaseHeartbeat(refresh, lambda: lock.expiration, max(1.0, lifetime.total_seconds() / 3),
+                                   name="backup heartbeat")
+        lock.lock()
+        try:
+            with heartbeat.running():
+                yield
+        finally:
+            lock.unlock()
+
+    def _chunk_path(self, digest: str):
+        return self.chunks_folder / digest[:2] / digest
+
+    def put_chunk(self, data: bytes):
+        """Store a chunk unless it is there already. Returns its name"""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._chunk_path(digest)
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = path.with_name(f"{digest}.tmp")
+            temp_path.write_bytes(zlib.compress(data))
+            os.replace(temp_path, path)
+        return digest
+
+    def get_chunk(self, digest: str):
+        data = zlib.decompress(self._chunk_path(digest).read_bytes())
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise ValueError(f"The backup chunk {digest} is corrupted")
+        return data
+
+    def points(self) -> List[str]:
+        """Names of the points, oldest first"""
+        if not self.points_folder.is_dir():
+            return []
+        return sorted(path.stem for path in self.points_folder.glob("*.json"))
+
+    def read_point(self, name: str) -> dict:
+        return json.loads((self.points_folder / f"{name}.json").read_text(encoding="utf-8"))
+
+    def write_point(self, point: dict):
+        name = f"{datetime.fromtimestamp(point['created']):%Y%m%d-%H%M%S}-{point['generation']}"
+        self.points_folder.mkdir(parents=True, exist_ok=True)
+        temp_path = self.points_folder / f"{name}.tmp"
+        temp_path.write_text(json.dumps(point), encoding="utf-8")
+        os.replace(temp_path, self.points_folder / f"{name}.json")
+        return name
+
+    def last_backup_time(self):
+        points = self.points()
+        if not points:
+            return None
+        return os.stat(self.points_folder / f"{points[-1]}.json").st_mtime
+
+    def prune(self, keep: int):
+        """Delete the oldest points beyond `keep`, and the chunks that no point uses anymore"""
+        points = self.points()
+        if keep <= 0 or len(points) <= keep:
+            return
+        for name in points[:-keep]:
+            (self.points_folder / f"{name}.json").unlink(missing_ok=True)
+
+        used = set()
+        for name in points[-keep:]:
+            point = self.read_point(name)
+            used.update(point["tree"])
+            used.update(point["entries"].values())
+        for path in self.chunks_folder.glob("*/*"):
+            if path.name not in used:
+                path.unlink(missing_ok=True)
+
+
+def _tree_records(task_tree: List[Task]):
+    """Chunks of (depth, task state without the children), in display order"""
+    chunk: list = []
+    stack = [(task, 0) for task in reversed(task_tree)]
+    while stack:
+        task, depth = stack.pop()
+        # The multiplication spreads consecutive ids over the boundaries
+        if chunk and ((task.item_id * 2654435761) % 2**32 % CHUNK_BOUNDARY == 0 or len(chunk) >= MAX_CHUNK_RECORDS):
+            yield chunk
+            chunk = []
+        chunk.append((depth, task.__getstate__()[:-1]))
+        if task.children:
+            stack.extend([(child, depth + 1) for child in reversed(task.children)])
+    if chunk:
+        yield chunk
+
+
+def _tree_from_records(records) -> List[Task]:
+    roots: List[Task] = []
+    path: List[Task] = []  # Ancestors of the current record
+    for depth, state in records:
+        task = Task.__new__(Task)
+        task.__setstate__((*state, []))
+        del path[depth:]
+        (path[-1].children if path else roots).append(task)
+        path.append(task)
+    return roots
+
+
+def take_backup(shelve_filename: Path | str, keep: int):
+    """Back up the workspace as it is in the file. Returns the name of the new point, or None if the
+    workspace was saved in the middle (the next backup will get it). Raises TimeOutError if another
+    backup of the workspace is being taken"""
+    store = BackupStore(shelve_filename)
+    with store.locked():
+        return _take_backup_locked(store, shelve_filename, keep)
+
+
+def _take_backup_locked(store: BackupStore, shelve_filename: Path | str, keep: int):
+    points = store.points()
+    last_point = store.read_point(points[-1]) if points else None
+
+    with shelve.open(str(shelve_filename), flag="r", protocol=4) as shelf:
+        generation = shelf.get("generation", 0)
+
+        raw_tree = shelf.dict.get(TREE_KEY.encode(shelf.keyencoding), None)
+        tree_digest = hashlib.sha256(raw_tree).hexdigest() if raw_tree is not None else ""
+        if last_point is not None and last_point.get("tree_digest") == tree_digest:
+            tree = last_point["tree"]  # Only other keys changed, no need to unpickle the tree
+        else:
+            task_tree = pickle.loads(raw_tree) if raw_tree is not None else []
+            tree = [store.put_chunk(pickle.dumps(chunk, protocol=4)) for chunk in _tree_records(task_tree)]
+            del task_tree, raw_tree
+
+        entries = {}
+        for raw_key in shelf.dict.keys():
+            key = raw_key.decode(shelf.keyencoding)
+            if key != TREE_KEY:
+                entries[key] = store.put_chunk(shelf.dict[raw_key])
+
+        if shelf.get("generation", 0) != generation:
+            return None
+
+    name = store.write_point({"version": BACKUP_VERSION, "created": time.time(), "generation": generation,
+                              "tree": tree, "tree_digest": tree_digest, "entries": entries})
+    store.prune(keep)
+    return name
+
+
+def _take_backup_in_background(shelve_filename: str, keep: int):
+    if hasattr(os, "nice"):
+        os.nice(10)  # Leaves the processor to the interface when there is only one
+    try:
+        take_backup(shelve_filename, keep)
+    except TimeOutError:
+        pass  # Another backup is being taken, so this one isn't needed
+    except Exception:
+        sys.exit(1)  # Reported by the next save, see Tasks._start_backup_if_due
+
+
+def start_backup(shelve_filename: Path | str, keep: int):
+    """Take a backup from another process. It is killed if the program exits first, which only leaves
+    unused chunks behind (a point is written after all of its chunks)"""
+    # Spawned instead of forked, since the UI has threads (savers, heartbeats) that a fork would copy mid-work
+    process = multiprocessing.get_context("spawn").Process(target=_take_backup_in_background,
+                                                           args=(str(shelve_filename), keep), daemon=True)
+    process.start()
+    return process
+
+
+def read_backup(shelve_filename: Path | str, name: str) -> dict:
+    """All the keys of the shelf as they were at a point"""
+    store = BackupStore(shelve_filename)
+    point = store.read_point(name)
+    if point["version"] != BACKUP_VERSION:
+        raise ValueError(f"The backup {name} has an unsupported version")
+
+    entries = {key: pickle.loads(store.get_chunk(digest)) for key, digest in point["entries"].items()}
+    entries[TREE_KEY] = _tree_from_records(record for digest in point["tree"]
+                                           for record in pickle.loads(store.get_chunk(digest)))
+    return entries
+
+
+def backup_workspaces(workspace_paths: List[str]) -> int:
+    """Back up the given workspaces right away (calcuresu backup), all of them by default"""
+    from calcuresu.data import Workspaces  # data.py starts the backups, so it can't be imported on top
+
+    if not workspace_paths:
+        workspaces = Workspaces(global_config.WORKSPACES_FILE.value, global_config.WORKSPACES_LOCK_FILE.value)
+        workspace_paths = [workspace.workspace_path for workspace in workspaces.read_shelve_key_readonly("workspaces", [])]
+
+    exit_code = 0
+    for workspace_path in workspace_paths:
+        if not Path(workspace_path).is_file():
+            print(f"{workspace_path}: no such workspace")
+            exit_code = 1
+            continue
+
+        try:
+            name = take_backup(workspace_path, global_config.BACKUP_KEEP.value)
+        except (OSError, pickle.PickleError) as e:
+            print(f"{workspace_path}: could not back it up: {e}")
+            exit_code = 1
+            continue
+        except TimeOutError:
+            print(f"{workspace_path}: another backup of it is being taken, try again later")
+            exit_code = 1
+            continue
+        if name is None:
+            print(f"{workspace_path}: it was saved during the backup, try again")
+            exit_code = 1
+        else:
+            print(f"{workspace_path}: backed up as {name}")
+    return exit_code
+
+
+def restore_workspace(arguments: List[str]) -> int:
+    """List the backups of a workspace, or restore one of them (calcuresu restore <workspace> [<point>|latest]).
+    The current state is backed up first, so a restore can be undone"""
+    from calcuresu.data import Tasks, Workspaces  # data.py starts the backups, so it can't be imported on top
+
+    if len(arguments) not in [1, 2]:
+        print("Usage: calcuresu restore <workspace_path> [<backup>|latest]")
+        return 1
+
+    workspace_path = arguments[0]
+    store = BackupStore(workspace_path)
+    points = store.points()
+    if len(arguments) == 1:
+        for name in points:
+            point = store.read_point(name)
+            print(f"{name}  {datetime.fromtimestamp(point['created']):%Y/%m/%d %H:%M:%S}  generation {point['generation']}")
+        if not points:
+            print(f"{workspace_path} has no backups")
+        return 0
+
+    name = points[-1] if arguments[1] == "latest" and points else arguments[1]
+    if name not in points:
+        print(f"{workspace_path} has no backup named {name}")
+        return 1
+
+    try:
+        entries = read_backup(workspace_path, name)
+    except (OSError, ValueError, pickle.UnpicklingError, zlib.error) as e:
+        print(f"Could not read the backup {name}: {e}")
+        return 1
+
+    user_tasks = Tasks.from_workspace(Workspace(workspace_path))
+    user_tasks.registry = Workspaces(global_config.WORKSPACES_FILE.value, global_config.WORKSPACES_LOCK_FILE.value)
+    try:
+        user_tasks.lock(timeout=None)
+    except TimeOutError:
+        print(f"{workspace_path}: another user is editing it, try again later")
+        return 1
+
+    try:
+        if Path(workspace_path).is_file():
+            before = take_backup(workspace_path, keep=0)  # Nobody can save while we hold the lock
+            print(f"{workspace_path}: the current state was backed up as {before}")
+        user_tasks.restore_nolock(entries)
+    except TimeOutError:
+        print(f"{workspace_path}: another backup of it is being taken, try again later")
+        return 1
+    finally:
+        user_tasks.cleanup()
+
+    print(f"{workspace_path}: restored {name}")
+    return 0
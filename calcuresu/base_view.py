@@ -2,6 +2,7 @@ import curses
 import logging
 
 from calcuresu.colors import Color
+from calcuresu.singletons import tracer
 
 
 class View:
@@ -12,6 +13,13 @@ class View:
         self.y = y
         self.x = x
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+
+        # Every view's render shows up as its own span in the trace
+        if "render" in cls.__dict__:
+            cls.render = tracer.traced(f"{cls.__name__}.render", category="render")(cls.render)
+
     def fill_background(self):
         """Fill the screen background with background color"""
         y_max, x_max = self.stdscr.getmaxyx()
@@ -0,0 +1,74 @@
+from datetime import date, datetime
+from typing import List
+
+from calcuresu.classes.timer import Timer
+from calcuresu.consts import Status
+
+
+class IndexedDeadline:
+    """A deadline of a task that isn't done, as recorded in the manifest of its workspace"""
+
+    def __init__(self, item_id: int, name: str, deadline: date, status: Status) -> None:
+        self.item_id = item_id
+        self.name = name
+        self.deadline = deadline
+        self.status = status
+
+
+class IndexedTimer:
+    """A running timer, as recorded in the manifest of its workspace"""
+
+    def __init__(self, item_id: int, name: str, timer: Timer) -> None:
+        self.item_id = item_id
+        self.name = name
+        self.timer = timer  # A copy, so the time that passed since the save can still be counted
+
+
+class WorkspaceManifest:
+    """Statistics of a workspace as of its last save. Kept in the workspaces shelf, so the workspace
+    manager can show them without opening the workspace itself"""
+
+    # Manifests stored before the agenda existed don't have its indexes
+    deadline_index: List[IndexedDeadline] = []
+    timer_index: List[IndexedTimer] = []
+
+    def __init__(self, workspace_path: str, status_counts: dict[int, int], running_timers: int, next_deadline: date | None,
+                 size: int, writer: str, saved_at: datetime, generation: int,
+                 deadline_index: List[IndexedDeadline], timer_index: List[IndexedTimer]) -> None:
+        self.workspace_path = workspace_path
+        self.status_counts = status_counts  # Status value -> number of tasks in the journal
+        self.running_timers = running_timers
+        self.next_deadline = next_deadline  # Earliest deadline of the tasks that aren't done
+        self.size = size  # Bytes on disk
+        self.writer = writer  # user@host that saved it last
+        self.saved_at = saved_at
+        self.generation = generation
+        self.deadline_index = deadline_index
+        self.timer_index = timer_index
+
+    @property
+    def open_tasks(self):
+        return sum(count for status, count in self.status_counts.items() if status != Status.DONE.value)
+
+    @property
+    def done_tasks(self):
+        return self.status_counts.get(Status.DONE.value, 0)
+
+    def summary(self):
+        """One line for the workspace manager"""
+        parts = [f"{self.open_tasks} open", f"{self.done_tasks} done"]
+        if self.running_timers:
+            parts.append(f"{self.running_timers} running")
+        if self.next_deadline is not None:
+            parts.append(f"due {self.next_deadline.strftime('%Y/%m/%d')}")
+        parts.append(format_size(self.size))
+        parts.append(f"saved {self.saved_at.strftime('%Y/%m/%d %H:%M')} by {self.writer}")
+        return " · ".join(parts)
+
+
+def format_size(size: int):
+    for unit in ["B", "KB", "MB"]:
+        if size < 1024:
+            return f"{size} {unit}"
+        size //= 1024
+    return f"{size} GB"
@@ -1,4 +1,4 @@
-from datetime import date
+from datetime import date, datetime
 import re
 from typing import Any, List
 
@@ -22,9 +22,21 @@ class TaskFilter:
         raise NotImplementedError()
 
 
+# Version tag of the tuple returned by Task.__getstate__. Bump it and add a branch to
+# Task._migrate_state whenever the layout changes, so that older shelves can still be opened.
+TASK_STATE_VERSION = 3
+
+# Direct lookups are much cheaper than calling the enum for every unpickled task
+_STATUS_BY_VALUE = {status.value: status for status in Status}
+_IMPORTANCE_BY_VALUE = {importance.value: importance for importance in Importance}
+
+
 class Task:
     """Tasks created by the user"""
 
+    __slots__ = ("item_id", "parent_id", "name", "status", "privacy", "collapse", "importance",
+                 "extra_info_length", "legacy_extra_info", "timer", "deadline", "children", "archive_date", "revision")
+
     def __init__(self, item_id, name, status, timestamps: List[str], privacy, parent_id, importance=Importance.UNDECIDED, collapse=False, year=0, month=0, day=0):
         """
         Node Management
@@ -40,7 +52,13 @@ class Task:
         self.privacy: bool = privacy
         self.collapse: bool = collapse
         self.importance: Importance = importance
-        self.extra_info: str = ""
+
+        """
+        Extra info - the note itself is kept in a separate store (see Tasks.get_extra_info),
+        the task only knows how long it is
+        """
+        self.extra_info_length: int = 0
+        self.legacy_extra_info: str|None = None  # Inline note of a task pickled before notes were split out
 
         """
         Task Timer
@@ -56,7 +74,122 @@ class Task:
         """
         Archive variables
         """
-        self.archive_date: date|None = None
+        self.archive_date: datetime|None = None
+
+        """
+        Revision - bumped whenever an edit made without the lock is merged into the task (see calcuresu.merge)
+        """
+        self.revision: int = 0
+
+    def __getstate__(self):
+        """Compact pickle state: enums are stored by value, the deadline as an ordinal
+        and the archive date as a timestamp (0 means not set)"""
+        return (
+            TASK_STATE_VERSION,
+            self.item_id,
+            self.parent_id,
+            self.name,
+            self.status.value,
+            self.privacy,
+            self.collapse,
+            self.importance.value,
+            self.extra_info_length,
+            self.timer.stamps,
+            self.deadline.toordinal() if self.deadline is not None else 0,
+            self.archive_date.timestamp() if self.archive_date is not None else 0,
+            self.revision,
+            self.children,
+        )
+
+    def __setstate__(self, state):
+        self.legacy_extra_info = None
+        if not isinstance(state, tuple) or state[0] != TASK_STATE_VERSION:
+            state = self._migrate_state(state)
+
+        (_, self.item_id, self.parent_id, self.name, status, self.privacy, self.collapse, importance,
+         self.extra_info_length, stamps, deadline, archive_date, self.revision, self.children) = state
+
+        self.status = _STATUS_BY_VALUE[status]
+        self.importance = _IMPORTANCE_BY_VALUE[importance]
+        self.timer = Timer(stamps)
+        self.deadline = date.fromordinal(deadline) if deadline else None
+        self.archive_date = datetime.fromtimestamp(archive_date) if archive_date else None
+
+    def _migrate_state(self, state):
+        """Convert the pickle state of older versions to the current one"""
+        if isinstance(state, dict):
+            # Pickled before slots were introduced: the plain __dict__ of the task
+            deadline = state.get("deadline")
+            archive_date = state.get("archive_date")
+            if archive_date is not None and not isinstance(archive_date, datetime):
+                archive_date = datetime.combine(archive_date, datetime.min.time())
+
+            state = (
+                1,
+                state["item_id"],
+                state["parent_id"],
+                state["name"],
+                state["status"].value,
+                state["privacy"],
+                state.get("collapse", False),
+                state.get("importance", Importance.UNDECIDED).value,
+                state.get("extra_info", ""),
+                state["timer"].stamps,
+                deadline.toordinal() if deadline is not None else 0,
+                archive_date.timestamp() if archive_date is not None else 0,
+                state.get("children", []),
+            )
+
+        if state[0] == 1:
+            # Version 1 kept the note inline. Tasks moves it to the note store after loading
+            # Whitespace-only notes were never shown, so they are dropped
+            extra_info = state[8] if state[8].strip() else ""
+            self.legacy_extra_info = extra_info or None
+            state = (2, *state[1:8], len(extra_info), *state[9:])
+
+        if state[0] == 2:
+            # Version 2 had no revision
+            state = (3, *state[1:12], 0, state[12])
+
+        if state[0] != TASK_STATE_VERSION:
+            raise ValueError(f"Unsupported task state version: {state[0]!r}")
+
+        return state
+
+    def to_dict(self, with_children: bool = True) -> dict:
+        """JSON-friendly form of the task (and its subtree), e.g. for the workspace server"""
+        data = {
+            "id": self.item_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "status": self.status.value,
+            "privacy": self.privacy,
+            "collapse": self.collapse,
+            "importance": self.importance.value,
+            "extra_info_length": self.extra_info_length,
+            "stamps": list(self.timer.stamps),  # A copy, so a revision base doesn't change along with the task
+            "deadline": self.deadline.toordinal() if self.deadline is not None else 0,
+            "archive_date": self.archive_date.timestamp() if self.archive_date is not None else 0,
+            "revision": self.revision,
+        }
+        if with_children:
+            data["children"] = [child.to_dict() for child in self.children]
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Task":
+        task = cls(data["id"], data["name"], _STATUS_BY_VALUE[data["status"]], list(data["stamps"]), data["privacy"],
+                   data["parent_id"], _IMPORTANCE_BY_VALUE[data["importance"]], data["collapse"])
+        task.extra_info_length = data["extra_info_length"]
+        task.deadline = date.fromordinal(data["deadline"]) if data["deadline"] else None
+        task.archive_date = datetime.fromtimestamp(data["archive_date"]) if data["archive_date"] else None
+        task.revision = data["revision"]
+        task.children = [cls.from_dict(child) for child in data.get("children", [])]
+        return task
+
+    @property
+    def has_extra_info(self):
+        return self.extra_info_length > 0
 
     @property
     def has_deadline(self):
@@ -73,17 +206,12 @@ class Task:
         raise NotImplementedError()
     
     def __contains__(self, user_filter):
+        """Check if the task matches the filter. Extra info filters are checked by Tasks,
+        since the note itself is not kept on the task"""
         if isinstance(user_filter, TaskFilter):
             match user_filter.filter_type:
-                case Filters.NAME | Filters.EXTRA_INFO:
-                    if user_filter.filter_type == Filters.NAME:
-                        filter_field = self.name
-                    elif user_filter.filter_type == Filters.EXTRA_INFO:
-                        filter_field = self.extra_info
-                    else:
-                        raise Exception("Invalid filter type")
-                    
-                    return re.match(user_filter.filter_content, filter_field) is not None
+                case Filters.NAME:
+                    return re.match(user_filter.filter_content, self.name) is not None
                 case Filters.STATUS | Filters.IMPORTANCE:
                     if user_filter.filter_type == Filters.STATUS:
                         filter_field = self.status
@@ -4,9 +4,20 @@ import time
 class Timer:
     """Timer for tasks"""
 
+    __slots__ = ("stamps",)
+
     def __init__(self, stamps):
         self.stamps = stamps
 
+    def __getstate__(self):
+        return self.stamps
+
+    def __setstate__(self, state):
+        if isinstance(state, dict):
+            # Pickled before slots were introduced
+            state = state["stamps"]
+        self.stamps = state
+
     @property
     def is_counting(self):
         """Evaluate if the timer is currently running"""
@@ -18,9 +29,9 @@ class Timer:
         return True if self.stamps else False
 
     @property
-    def passed_time(self):
+    def total_seconds(self):
         """Calculate how much time has passed in the un-paused intervals"""
-        time_passed = 0
+        time_passed = 0.0
 
         # Calculate passed time, assuming that even timestamps are pauses:
         for index, _ in enumerate(self.stamps):
@@ -30,6 +41,12 @@ class Timer:
         # Add time passed during the current run:
         if self.is_counting:
             time_passed += time.time() - float(self.stamps[-1])
+        return time_passed
+
+    @property
+    def passed_time(self):
+        """How much time has passed in the un-paused intervals, formatted for display"""
+        time_passed = self.total_seconds
 
         # Depending on how much time has passed, show in different formats:
         one_hour = 60*60.0
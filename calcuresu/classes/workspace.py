@@ -8,6 +8,10 @@ class Workspace:
         # Note: this could be a property but it's nice if we ever want to change it ad-hoc
         self.workspace_lock = f"{self.workspace_path}.lock" 
 
+    @property
+    def workspace_snapshot(self):
+        return f"{self.workspace_path}.snap"
+
     def __eq__(self, other):
         if isinstance(other, Workspace):
             return self.workspace_path == other.workspace_path and self.workspace_lock == other.workspace_lock
@@ -0,0 +1,238 @@
+"""Module with the client mode of the TUI: workspaces that are served by `calcuresu serve` are edited through the
+server instead of the file"""
+
+import curses
+import itertools
+import json
+import logging
+import os
+import socket
+import threading
+from contextlib import contextmanager
+from typing import Callable, Iterable, List
+
+from calcuresu.classes.task import RootTask, Task
+from calcuresu.classes.workspace import Workspace
+from calcuresu.data import Tasks
+from calcuresu.merge import collect_changes
+from calcuresu.screen import Screen
+from calcuresu.server import socket_path_for
+from calcuresu.undo import UndoHistory
+
+
+NOTES_BATCH_SIZE = 1000  # Notes fetched with a single request
+
+class WorkspaceServerError(Exception):
+    pass
+
+
+class WorkspaceClient:
+    """Connection to a workspace server. Requests go over one connection, and the change notifications
+    are read from a second one by a background thread"""
+
+    def __init__(self, socket_path: str):
+        self.socket_path = socket_path
+        self._request_ids = itertools.count(1)
+        self._mutex = threading.Lock()
+        self._connection = self._connect()
+        self._requests = self._connection.makefile("rwb")
+
+        self.server_generation: int|None = None
+        self.connected = True
+        self.on_change: Callable[[], None]|None = None  # Called from the notification thread
+        self._notifications = self._connect()
+        self._notification_thread = threading.Thread(target=self._read_notifications, name="workspace notifications", daemon=True)
+        self._notification_thread.start()
+
+    def _connect(self):
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            connection.connect(self.socket_path)
+        except OSError:
+            connection.close()
+            raise
+        return connection
+
+    def call(self, method: str, **params):
+        request = {"jsonrpc": "2.0", "id": next(self._request_ids), "method": method, "params": params}
+        with self._mutex:
+            try:
+                self._requests.write(json.dumps(request).encode() + b"\n")
+                self._requests.flush()
+                line = self._requests.readline()
+            except OSError as e:
+                raise WorkspaceServerError(f"The workspace server is not reachable: {e}")
+        if not line:
+            raise WorkspaceServerError("The workspace server stopped")
+
+        response = json.loads(line)
+        if "error" in response:
+            raise WorkspaceServerError(response["error"]["message"])
+        return response["result"]
+
+    def _read_notifications(self):
+        try:
+            with self._notifications.makefile("rwb") as stream:
+                stream.write(json.dumps({"jsonrpc": "2.0", "id": 0, "method": "subscribe"}).encode() + b"\n")
+                stream.flush()
+                for line in stream:
+                    message = json.loads(line)
+                    if "result" in message:
+                        self.server_generation = message["result"]["generation"]
+                    elif message.get("method") == "changed":
+                        self.server_generation = message["params"]["generation"]
+                    else:
+                        continue
+                    if self.on_change is not None:
+                        self.on_change()
+        except (OSError, ValueError):
+            pass
+        self.connected = False
+        if self.on_change is not None:
+            self.on_change()
+
+    def close(self):
+        for connection in (self._connection, self._notifications):
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            connection.close()
+
+
+class RemoteTasks(Tasks):
+    """Tasks of a served workspace. The tree is a copy of the server's, every edit is sent to the server
+    as a changeset, and the copy is refreshed when the server says the workspace changed"""
+
+    is_remote = True
+
+    def __init__(self, workspace: Workspace, client: WorkspaceClient):
+        super().__init__(workspace.workspace_path, workspace.workspace_lock)
+        if self.saver is not None:
+            self.saver.stop()
+            self.saver = None
+        self.history = UndoHistory(0)  # Undo needs the file itself, so it isn't available (and nothing is recorded)
+        self.client = client
+        self._disconnection_reported = False
+
+    def initialize(self, stdscr: curses.window, screen: Screen):
+        try:
+            self._fetch_tree()
+        except WorkspaceServerError as e:
+            logging.error(str(e))
+            return False
+        return True
+
+    def _fetch_tree(self):
+        tree = self.client.call("tree")
+        self.generation = tree["generation"]
+        self.archive_index = tree["archive_index"]
+        self.task_tree = [Task.from_dict(task) for task in tree["tasks"]]
+        self.root_task = RootTask(self.task_tree)
+        self._unload_archive_segment()
+
+    def load_shelve_if_needed_nolock(self):
+        pass  # The copy of the tree is always loaded
+
+    def reopen_shelve_if_needed_locked(self, stdscr: curses.window, screen: Screen):
+        if not self.client.connected:
+            if not self._disconnection_reported:
+                logging.error("The workspace server stopped. Load the workspace again to edit it")
+                self._disconnection_reported = True
+            return False
+
+        if self.client.server_generation is None or self.client.server_generation == self.generation:
+            return False
+
+        try:
+            self._fetch_tree()
+        except WorkspaceServerError as e:
+            logging.error(str(e))
+            return False
+        screen.next_need_refresh = True
+        return True
+
+    @contextmanager
+    def _note_reader(self, tasks: Iterable[Task] = ()):
+        fetched: dict[int, str] = {}
+
+        def fetch(item_ids: List[int]):
+            try:
+                for start in range(0, len(item_ids), NOTES_BATCH_SIZE):
+                    batch = item_ids[start:start + NOTES_BATCH_SIZE]
+                    notes = self.client.call("notes", ids=batch)
+                    fetched.update({item_id: notes.get(str(item_id), "") for item_id in batch})
+            except WorkspaceServerError as e:
+                logging.error(str(e))
+                fetched.update(dict.fromkeys(item_ids, ""))
+
+        # The notes of the given tasks are fetched together, instead of with one request per task
+        fetch([task.item_id for task in tasks if task.has_extra_info and task.item_id not in self._pending_notes])
+
+        def read_note(task: Task) -> str:
+            if task.item_id in self._pending_notes:
+                return self._pending_notes[task.item_id] or ""
+            if not task.has_extra_info:
+                return ""
+            if task.item_id not in fetched:
+                fetch([task.item_id])
+            return fetched[task.item_id]
+
+        yield read_note
+
+    def commit_optimistic_edit(self, stdscr: curses.window, screen: Screen):
+        base, self._edit_base = self._edit_base, None
+        pending_notes, self._pending_notes = self._pending_notes, {}
+        if not self.changed or base is None:
+            return
+        self.changed = False
+
+        changes = collect_changes(base, self.root_task, set(pending_notes))
+        try:
+            result = self.client.call("commit", changes=changes.to_json(),
+                                      notes={str(item_id): note for item_id, note in pending_notes.items()})
+        except WorkspaceServerError as e:
+            logging.error(f"{e}. Your changes were not saved")
+            result = None
+
+        if result is not None and result["conflicts"]:
+            logging.error(f"Not saved, since another user changed them at the same time: {', '.join(result['conflicts'])}")
+
+        if result is not None and result["generation"] == self.generation + 1 \
+                and not result["conflicts"] and not result["id_changes"]:
+            # Only our edit went in, so the copy already matches the server (once the revisions are bumped)
+            for task in base.changed_tasks(self.root_task, set(pending_notes)):
+                task.revision += 1
+            self.generation = result["generation"]
+            return
+
+        try:
+            self._fetch_tree()
+        except WorkspaceServerError as e:
+            logging.error(str(e))
+
+    def discard_optimistic_edit(self):
+        self._edit_base = None
+        self._pending_notes = {}
+        self.changed = False
+        try:
+            self._fetch_tree()
+        except WorkspaceServerError as e:
+            logging.error(str(e))
+
+    def watch_changes(self, callback: Callable[[], None]):
+        self.client.on_change = callback
+
+    def cleanup(self):
+        self.client.close()
+
+
+def open_workspace_tasks(workspace: Workspace) -> Tasks:
+    """The tasks of the workspace - through its server if one is serving it, otherwise straight from the file"""
+    socket_path = socket_path_for(workspace.workspace_path)
+    if os.path.exists(socket_path):
+        try:
+            return RemoteTasks(workspace, WorkspaceClient(socket_path))
+        except OSError:
+            pass  # Left behind by a server that crashed
+    return Tasks.from_workspace(workspace)
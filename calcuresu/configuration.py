@@ -12,6 +12,10 @@ from typing import Any
 from calcuresu.consts import AppState, CursesColor
 from calcuresu.prompt import IconCompleter
 
+# Long options of calcuresu and its commands, e.g. "--format=csv"
+COMMAND_LINE_OPTIONS = ["config=", "field=", "format=", "output=", "period="]
+
+
 class ConfigType(Enum):
     BOOL = 0
     STRING = 1
@@ -57,6 +61,7 @@ class Config:
         self.config_folder = self.home_path / ".config" / "calcuresu"
         self.config_file = self.config_folder / "config.ini"
         self.log_file = self.config_folder / "info.log"
+        self.recent_workspaces_file = self.config_folder / "recent_workspaces.json"
         self.is_first_run= True
 
         # Create config folder:
@@ -124,10 +129,14 @@ class Config:
         self.REFRESH_INTERVAL          = ConfigItem.from_config(conf, "Parameters", "refresh_interval", ConfigType.INT, 1)
         self.SHOW_NOTHING_PLANNED      = ConfigItem.from_config(conf, "Parameters", "show_nothing_planned", ConfigType.BOOL, True)
         self.LOG_FILE                  = ConfigItem.from_config(conf, "Parameters", "log_file", ConfigType.PATH, self.log_file)
+        self.TRACE_FILE                = ConfigItem.from_config(conf, "Parameters", "trace_file", ConfigType.STRING, "") # empty = tracing disabled
+        self.MAX_FRAME_RATE            = ConfigItem.from_config(conf, "Parameters", "max_frame_rate", ConfigType.INT, 60) # redraws per second at most, 0 = no limit
 
         # Archive settings
         self.ADD_TO_ARCHIVE_ON_DELETE  = ConfigItem.from_config(conf, "Parameters", "add_to_archive_on_delete", ConfigType.BOOL, True)
         self.ARCHIVE_HEADER        = ConfigItem.from_config(conf, "Parameters", "archive_header", ConfigType.STRING, "ARCHIVE")
+        self.ARCHIVE_RETENTION_DAYS = ConfigItem.from_config(conf, "Parameters", "archive_retention_days", ConfigType.INT, 0) # 0 = keep archived tasks in the workspace forever
+        self.ARCHIVE_RETENTION_INTERVAL = ConfigItem.from_config(conf, "Parameters", "archive_retention_interval", ConfigType.INT, 24) # hours between retention passes (done when saving)
 
         # Journal settings
         self.JOURNAL_HEADER        = ConfigItem.from_config(conf, "Parameters", "journal_header", ConfigType.STRING, "JOURNAL")
@@ -149,6 +158,19 @@ class Config:
         # File save settings
         self.LOCK_ACQUIRE_TIMEOUT      = ConfigItem.from_config(conf, "Parameters", "lock_acquire_timeout", ConfigType.INT, 30) # try to capture lock for 30 seconds
         self.LOCK_LIFETIME             = ConfigItem.from_config(conf, "Parameters", "lock_lifetime", ConfigType.INT, 30) # half a minute minute max for capturing lock
+        self.LOCK_BACKEND              = ConfigItem.from_config(conf, "Parameters", "lock_backend", ConfigType.STRING, "flufl") # auto, flufl (NFS-safe) or fcntl (local file systems)
+        self.OPTIMISTIC_EDITS          = ConfigItem.from_config(conf, "Parameters", "optimistic_edits", ConfigType.BOOL, False) # edit without the lock, and only lock to merge the edit into the file
+        self.WORKSPACE_SNAPSHOTS       = ConfigItem.from_config(conf, "Parameters", "workspace_snapshots", ConfigType.BOOL, False) # open workspaces from a memory-mapped snapshot
+        self.BACKGROUND_SAVE           = ConfigItem.from_config(conf, "Parameters", "background_save", ConfigType.BOOL, False) # save from a background thread instead of after every edit
+        self.SAVE_DEBOUNCE             = ConfigItem.from_config(conf, "Parameters", "save_debounce", ConfigType.FLOAT, 1.0) # seconds without edits before a background save
+        self.WORKSPACE_CACHE_SIZE      = ConfigItem.from_config(conf, "Parameters", "workspace_cache_size", ConfigType.INT, 5) # workspaces kept open, including the current one
+        self.WORKSPACE_CACHE_MEMORY    = ConfigItem.from_config(conf, "Parameters", "workspace_cache_memory", ConfigType.INT, 512) # megabytes the open workspaces may take
+        self.PRELOAD_WORKSPACES        = ConfigItem.from_config(conf, "Parameters", "preload_workspaces", ConfigType.BOOL, True) # read the recently used workspaces in the background at startup
+        self.SEARCH_PROCESSES          = ConfigItem.from_config(conf, "Parameters", "search_processes", ConfigType.INT, 0) # processes searching the workspaces at the same time, 0 = one per core
+        self.BACKUP_INTERVAL           = ConfigItem.from_config(conf, "Parameters", "backup_interval", ConfigType.INT, 0) # minutes between backups of a workspace (taken when saving), 0 = no backups
+        self.BACKUP_KEEP               = ConfigItem.from_config(conf, "Parameters", "backup_keep", ConfigType.INT, 100) # backups kept per workspace, the oldest are deleted first
+        self.UNDO_MEMORY               = ConfigItem.from_config(conf, "Parameters", "undo_memory", ConfigType.INT, 64) # megabytes of undo history per workspace, the oldest actions are dropped first (0 = no undo)
+        self.SUBTREE_TOTALS            = ConfigItem.from_config(conf, "Parameters", "subtree_totals", ConfigType.BOOL, True) # show the done/total count, tracked time and next deadline of the subtasks of collapsed tasks
         assert self.LOCK_LIFETIME.value <= self.LOCK_ACQUIRE_TIMEOUT.value, "If the lifetime is smaller than the acquiriation timeout then we might not catch the lock"
 
         # Color settings
@@ -190,7 +212,7 @@ class Config:
     def read_config_file_from_user_arguments(self):
         """Read user config.ini location from user arguments"""
         try:
-            opts, _ = getopt.getopt(sys.argv[1:], "", ["config="])
+            opts, _ = getopt.gnu_getopt(sys.argv[1:], "", COMMAND_LINE_OPTIONS)  # Options may come after a command
             for opt, arg in opts:
                 if opt in "--config":
                     self.config_file = Path(arg).expanduser()
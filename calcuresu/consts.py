@@ -6,6 +6,7 @@ VERSION = "1.0.0-beta"
 
 class AppState(enum.Enum):
     """Possible focus states of the application"""
+    REPORT = 0
     JOURNAL = 1
     HELP = 2
     EXIT = 3
@@ -13,6 +14,8 @@ class AppState(enum.Enum):
     ARCHIVE = 5
     WIZARD = 6
     COLOR = 7
+    SEARCH = 8
+    AGENDA = 9
 
 class Filters(enum.Enum):
     """Possible filters"""
@@ -6,6 +6,8 @@ import dbm.sqlite3
 import dbm.sqlite3
 import importlib
 from os import W_OK
+import re
+from typing import Callable
 
 # Modules:
 from calcuresu.classes.task import Task
@@ -13,8 +15,11 @@ from calcuresu.classes.timer import Timer
 from calcuresu.consts import AppState, Status
 from calcuresu.data import *
 from calcuresu.data import Tasks
+from calcuresu.workspace_cache import WorkspaceCache
 from calcuresu.dialogues import *
 from calcuresu.screen import Screen
+from calcuresu.search import WorkspaceSearch
+from calcuresu.singletons import tracer
 
 # Language:
 from calcuresu.translations.en import *
@@ -41,19 +46,19 @@ def safe_run(func):
 
 HEADER_FIELD_COUNT = 2
 
+# Rows each navigation key moves the screen by
+MOVEMENT_STEPS = {"KEY_DOWN": 1, "KEY_UP": -1, "KEY_NPAGE": 6, "KEY_PPAGE": -6}
+
 def handle_screen_movement(screen: Screen, key: str|None):
-    if key in ["KEY_DOWN"]:
-        screen.change_offset_forwards(step_count=1)
-        screen.next_need_refresh = True
-    elif key in ["KEY_UP"]:
-        screen.change_offset_backwards(step_count=1)
-        screen.next_need_refresh = True
-    elif key in ["KEY_PPAGE"]:
-        screen.change_offset_backwards(step_count=6)
-        screen.next_need_refresh = True
-    elif key in ["KEY_NPAGE"]:
-        screen.change_offset_forwards(step_count=6)
-        screen.next_need_refresh = True
+    if key not in MOVEMENT_STEPS:
+        return
+
+    # The key stands for all the navigation keys that were read with it
+    if screen.movement_steps > 0:
+        screen.change_offset_forwards(step_count=screen.movement_steps)
+    elif screen.movement_steps < 0:
+        screen.change_offset_backwards(step_count=-screen.movement_steps)
+    screen.next_need_refresh = True
 
 def handle_screen_transfer_keys(stdscr, screen: Screen, key: str|None, quit_state=AppState.EXIT):
     if key is None:
@@ -100,30 +105,69 @@ def handle_reload_keys(screen: Screen, key: str|None):
 
 
 
-def nonblocking_getkey(stdscr: curses.window):
-    
+def nonblocking_getkey(stdscr: curses.window, screen: Screen):
+    if screen.pending_keys:
+        key = screen.pending_keys.popleft()
+        screen.movement_steps = MOVEMENT_STEPS.get(key, 0)
+        return key
+
     try:
         curses.cbreak()
         stdscr.nodelay(True)
-        return stdscr.getkey()
+        try:
+            key = stdscr.getkey()
+        except curses.error:
+            screen.input_idle = True
+            raise
+
+        # Fold the repeats of a held navigation key into one move, so the whole batch is drawn once
+        screen.movement_steps = MOVEMENT_STEPS.get(key, 0)
+        if key in MOVEMENT_STEPS:
+            while True:
+                try:
+                    next_key = stdscr.getkey()
+                except curses.error:
+                    break
+                if next_key not in MOVEMENT_STEPS:
+                    screen.pending_keys.append(next_key)
+                    break
+                screen.movement_steps += MOVEMENT_STEPS[next_key]
+        return key
     finally:
         curses.halfdelay(20)    
 
+def input_tasks(stdscr: curses.window, screen: Screen, user_tasks: Tasks, question) -> List[Task]:
+    """Ask for the numbers of one or more journal tasks (an empty answer takes the marked tasks)"""
+    viewed_tasks = user_tasks.viewed_ordered_tasks
+    marked_indexes = []
+    if screen.marked_task_ids:
+        marked_indexes = [index for index, task in enumerate(viewed_tasks) if task.item_id in screen.marked_task_ids]
+
+    indexes = input_selection(stdscr, screen, question, len(viewed_tasks), marked_indexes)
+    if indexes is None:
+        return []
+    return [viewed_tasks[index] for index in indexes]
+
 @safe_run
+@tracer.traced(category="input")
 def control_journal_screen(stdscr: curses.window, screen: Screen, user_tasks: Tasks):
     """Process user input on the journal screen"""
         
     # If we previously selected a task, now we perform the action:
     if screen.selection_mode:
+        # Marking only changes what is displayed, so it doesn't need the lock
+        if screen.key == 'v':
+            screen.selection_mode = False
+            for task in input_tasks(stdscr, screen, user_tasks, MSG_TS_MARK):
+                screen.marked_task_ids ^= {task.item_id}
+            return
 
-        with try_to_lock_auto_unlock(stdscr, screen, user_tasks) as lock_successful:
+        with try_to_edit(stdscr, screen, user_tasks) as lock_successful:
             if lock_successful:            
                 # Collapse/Expand
                 if screen.key == 'c':
-                    number = input_integer(stdscr, screen, MSG_TS_COLLAPSE)
-                    if number is not None and user_tasks.is_valid_number(number):
-                        task = user_tasks.viewed_ordered_tasks[number]
-                        user_tasks.toggle_task_collapse(task)
+                    tasks = input_tasks(stdscr, screen, user_tasks, MSG_TS_COLLAPSE)
+                    user_tasks.toggle_tasks_collapse(tasks)
 
                 # Modify extra info
                 if screen.key == 'o':
@@ -140,66 +184,54 @@ def control_journal_screen(stdscr: curses.window, screen: Screen, user_tasks: Ta
                         user_tasks.add_timestamp_for_task(task)
 
                 if screen.key == 'T':
-                    number = input_integer(stdscr, screen, MSG_TM_RESET)
-                    if number is not None and user_tasks.is_valid_number(number):
-                        task = user_tasks.viewed_ordered_tasks[number]
-                        user_tasks.reset_timer_for_task(task)
+                    tasks = input_tasks(stdscr, screen, user_tasks, MSG_TM_RESET)
+                    user_tasks.reset_timers_for_tasks(tasks)
 
                 # Add deadline:
                 if screen.key == "f":
-                    number = input_integer(stdscr, screen, MSG_TS_DEAD_ADD)
-                    if number is not None and user_tasks.is_valid_number(number):
-                        task = user_tasks.viewed_ordered_tasks[number]
+                    tasks = input_tasks(stdscr, screen, user_tasks, MSG_TS_DEAD_ADD)
+                    if tasks:
                         deadline_date = input_date(stdscr, screen, MSG_TS_DEAD_DATE)
-                        user_tasks.change_deadline(task, deadline_date)
+                        user_tasks.change_deadlines(tasks, deadline_date)
 
                 # Remove deadline:
                 if screen.key == "F":
-                    number = input_integer(stdscr, screen, MSG_TS_DEAD_DEL)
-                    if number is not None and user_tasks.is_valid_number(number):
-                        task = user_tasks.viewed_ordered_tasks[number]
-                        user_tasks.change_deadline(task, None)
+                    tasks = input_tasks(stdscr, screen, user_tasks, MSG_TS_DEAD_DEL)
+                    user_tasks.change_deadlines(tasks, None)
 
                 # Change the importance:
                 if screen.key == 'i':
-                    number = input_integer(stdscr, screen, MSG_TS_IMPORTANCE)
-                    if number is not None and user_tasks.is_valid_number(number):
-                        task = user_tasks.viewed_ordered_tasks[number]
+                    tasks = input_tasks(stdscr, screen, user_tasks, MSG_TS_IMPORTANCE)
+                    if tasks:
                         new_importance = input_importance(stdscr, screen)
                         if new_importance is not None:
-                            user_tasks.change_item_importance(task, new_importance)
+                            user_tasks.change_items_importance(tasks, new_importance)
                 
                 # Change the status:
                 if screen.key == 's':
-                    number = input_integer(stdscr, screen, MSG_TS_STATUS)
-                    if number is not None and user_tasks.is_valid_number(number):
-                        task = user_tasks.viewed_ordered_tasks[number]
+                    tasks = input_tasks(stdscr, screen, user_tasks, MSG_TS_STATUS)
+                    if tasks:
                         new_status = input_status(stdscr, screen)
                         if new_status is not None:
-                            user_tasks.change_item_status(task, new_status)
+                            user_tasks.change_items_status(tasks, new_status)
                 
                 if screen.key == 'd':
-                    number = input_integer(stdscr, screen, MSG_TS_DONE)
-                    if number is not None and user_tasks.is_valid_number(number):
-                        task = user_tasks.viewed_ordered_tasks[number]
-                        user_tasks.change_item_status(task, Status.DONE)
+                    tasks = input_tasks(stdscr, screen, user_tasks, MSG_TS_DONE)
+                    user_tasks.change_items_status(tasks, Status.DONE)
 
                 # Toggle task privacy:
                 if screen.key == '.':
-                    number = input_integer(stdscr, screen, MSG_TS_PRIVACY)
-                    if number is not None and user_tasks.is_valid_number(number):
-                        task = user_tasks.viewed_ordered_tasks[number]
-                        user_tasks.toggle_item_privacy(task)
+                    tasks = input_tasks(stdscr, screen, user_tasks, MSG_TS_PRIVACY)
+                    user_tasks.toggle_items_privacy(tasks)
 
                 # Modify the task:
                 if screen.key in ['x']:
                     msg = MSG_TS_DEL
                     if global_config.ADD_TO_ARCHIVE_ON_DELETE.value:
                         msg = MSG_TS_ARCHIVE
-                    number = input_integer(stdscr, screen, msg)
-                    if number is not None and user_tasks.is_valid_number(number):
-                        task: Task = user_tasks.viewed_ordered_tasks[number]
-                        if task.children:
+                    tasks = input_tasks(stdscr, screen, user_tasks, msg)
+                    if tasks:
+                        if any(task.children for task in tasks):
                             msg = MSG_TS_CHILDREN_DEL
                             if global_config.ADD_TO_ARCHIVE_ON_DELETE.value:
                                 msg = MSG_TS_CHILDREN_ARCHIVE
@@ -209,9 +241,9 @@ def control_journal_screen(stdscr: curses.window, screen: Screen, user_tasks: Ta
                             delete_children_as_well = False
                         
                         if global_config.ADD_TO_ARCHIVE_ON_DELETE.value:
-                            user_tasks.archive_task(task.item_id, delete_children_as_well)
+                            user_tasks.archive_tasks(tasks, delete_children_as_well)
                         else:
-                            user_tasks.delete_task(task.item_id, delete_children_as_well)
+                            user_tasks.delete_tasks(tasks, delete_children_as_well)
 
                 if screen.key == 'm':
                     number_from = input_integer(stdscr, screen, MSG_TS_MOVE)
@@ -234,7 +266,7 @@ def control_journal_screen(stdscr: curses.window, screen: Screen, user_tasks: Ta
 
                         new_name = input_string(stdscr, screen, MSG_TS_RENAME_TASK,
                                                 placeholder=MSG_TS_INPUT_TASK,
-                                                default=task.name, autocomplete=global_config.icon_completer)
+                                                default=task.name, autocomplete=global_config.icon_completer, dialog="task name")
                         if new_name:
                             user_tasks.rename_task(task, new_name)
 
@@ -252,12 +284,10 @@ def control_journal_screen(stdscr: curses.window, screen: Screen, user_tasks: Ta
                 if screen.key == 'A':
                     task_number: int|None = input_integer(stdscr, screen, MSG_TS_SUB)
                     if task_number is not None and user_tasks.is_valid_number(task_number):
-                        task_name = input_string(stdscr, screen, MSG_TS_TITLE, placeholder=MSG_TS_INPUT_TASK, autocomplete=global_config.icon_completer)
+                        task_name = input_string(stdscr, screen, MSG_TS_TITLE, placeholder=MSG_TS_INPUT_TASK, autocomplete=global_config.icon_completer, dialog="task name")
                         if task_name:
                             parent_task: Task = user_tasks.viewed_ordered_tasks[task_number]
                             user_tasks.add_subtask(task_name, parent_task)
-
-                user_tasks.save_if_needed_nolock()
         
         screen.selection_mode = False
 
@@ -265,13 +295,13 @@ def control_journal_screen(stdscr: curses.window, screen: Screen, user_tasks: Ta
     else:
         if not screen.delayed_action:
             # Wait for user to press a key:
-            screen.key = nonblocking_getkey(stdscr)
+            screen.key = nonblocking_getkey(stdscr, screen)
             
             if handle_screen_transfer_keys(stdscr, screen, screen.key):
                 return
 
         # If we need to select a task, change to selection mode:
-        selection_keys = ['t', 'T', 'u', 'i', 's', 'd', 'x', 'e', 'r', 'c', 'A', 'm', '.', 'f', 'F', 'o']
+        selection_keys = ['t', 'T', 'i', 's', 'd', 'x', 'e', 'r', 'c', 'A', 'm', '.', 'f', 'F', 'o', 'v']
         if screen.key in selection_keys and user_tasks.viewed_ordered_tasks:
             screen.selection_mode = True
             screen.next_need_refresh = True
@@ -293,13 +323,12 @@ def control_journal_screen(stdscr: curses.window, screen: Screen, user_tasks: Ta
                 screen.delayed_action = True
                 return
 
-            with try_to_lock_auto_unlock(stdscr, screen, user_tasks) as lock_successful:
+            with try_to_edit(stdscr, screen, user_tasks) as lock_successful:
                 if lock_successful:            
-                    task_name = input_string(stdscr, screen, MSG_TS_NEW_TASK, placeholder=MSG_TS_INPUT_TASK, autocomplete=global_config.icon_completer)
+                    task_name = input_string(stdscr, screen, MSG_TS_NEW_TASK, placeholder=MSG_TS_INPUT_TASK, autocomplete=global_config.icon_completer, dialog="task name")
                     if task_name:
                         task_id = user_tasks.generate_id()
                         user_tasks.add_item(Task(task_id, task_name, Status.NOT_STARTED, [], False, parent_id=0))
-                    user_tasks.save_if_needed_nolock()
 
         if screen.key == "/":
             filter_chosen = input_filter_field(stdscr, screen, MSG_TS_FILTER, placeholder="Leave this empty to clear the filter", display_error=True)
@@ -310,6 +339,22 @@ def control_journal_screen(stdscr: curses.window, screen: Screen, user_tasks: Ta
             else:
                 user_tasks.clear_filter()
 
+        if screen.key == "V":
+            screen.marked_task_ids.clear()
+            screen.next_need_refresh = True
+
+        # Undo/redo the last saved action. Always under the lock (even with optimistic edits), since it may
+        # bring back tasks from the archive cold segment, which a merge doesn't know about
+        if screen.key in ["u", "U"]:
+            with try_to_lock_auto_unlock(stdscr, screen, user_tasks) as lock_successful:
+                if lock_successful:
+                    if screen.key == "u":
+                        user_tasks.undo()
+                    else:
+                        user_tasks.redo()
+                    user_tasks.save_if_needed_nolock()
+            screen.next_need_refresh = True
+
         # Bulk operations:
         if screen.key in ["X"]:
             with try_to_lock_auto_unlock(stdscr, screen, user_tasks) as lock_successful:
@@ -325,34 +370,38 @@ def control_journal_screen(stdscr: curses.window, screen: Screen, user_tasks: Ta
         handle_reload_keys(screen, screen.key)
 
 @safe_run
+@tracer.traced(category="input")
 def control_help_screen(stdscr, screen):
     """Process user input on the help screen"""
     # Getting user's input:
-    screen.key = nonblocking_getkey(stdscr)
+    screen.key = nonblocking_getkey(stdscr, screen)
 
     handle_reload_keys(screen, screen.key)
     handle_screen_transfer_keys(stdscr, screen, screen.key, quit_state=AppState.WIZARD)
 
 @safe_run
+@tracer.traced(category="input")
 def control_color_screen(stdscr, screen):
     """Process user input on the help screen"""
     # Getting user's input:
-    screen.key = nonblocking_getkey(stdscr)
+    screen.key = nonblocking_getkey(stdscr, screen)
 
     handle_reload_keys(screen, screen.key)
     handle_screen_transfer_keys(stdscr, screen, screen.key)
 
 
 @safe_run
+@tracer.traced(category="input")
 def control_welcome_screen(stdscr, screen):
     """Process user input on the welcome screen"""
     # Getting user's input:
-    screen.key = nonblocking_getkey(stdscr)
+    screen.key = nonblocking_getkey(stdscr, screen)
 
     handle_reload_keys(screen, screen.key)
     handle_screen_transfer_keys(stdscr, screen, screen.key, quit_state=AppState.WIZARD)
     
 @safe_run
+@tracer.traced(category="input")
 def control_archive_screen(stdscr: curses.window, screen: Screen, user_tasks: Tasks):
     """Process user input on the welcome screen"""
     
@@ -382,13 +431,32 @@ def control_archive_screen(stdscr: curses.window, screen: Screen, user_tasks: Ta
                 user_tasks.save_if_needed_nolock()
     else:
         # Getting user's input:
-        screen.key = nonblocking_getkey(stdscr)
+        screen.key = nonblocking_getkey(stdscr, screen)
 
         if screen.key in ["x", "o"]:
             screen.selection_mode = True
             screen.next_need_refresh = True
             return
 
+        # Yearly rollups of old archived tasks:
+        if screen.key == "y":
+            years = ", ".join(str(year) for year in user_tasks.rollup_years()) or "none"
+            year = input_integer(stdscr, screen, MSG_TS_ROLLUP_YEAR, is_index=False, display_error=False,
+                                 placeholder=MSG_TS_ROLLUP_YEAR_TIP.format(years=years))
+            if year is not None:
+                user_tasks.load_rollup(year)
+            else:
+                user_tasks.unload_rollups()
+            screen.offset = 0
+            screen.next_need_refresh = True
+
+        if screen.key == "C":
+            with try_to_lock_auto_unlock(stdscr, screen, user_tasks) as lock_successful:
+                if lock_successful and ask_confirmation(stdscr, screen, MSG_TS_COMPACT):
+                    size_before, size_after = user_tasks.compact_nolock()
+                    logging.info(f"Compacted workspace from {size_before} to {size_after} bytes")
+            screen.next_need_refresh = True
+
         if screen.key == "/":
             filter_chosen = input_filter_field(stdscr, screen, MSG_TS_FILTER, placeholder="Leave this empty to clear the filter", display_error=True)
             if filter_chosen is not None:
@@ -406,7 +474,9 @@ def control_archive_screen(stdscr: curses.window, screen: Screen, user_tasks: Ta
 
 
 @safe_run
-def control_workspaces_screen(stdscr: curses.window, screen: Screen, workspaces: Workspaces) -> Tasks | None:
+@tracer.traced(category="input")
+def control_workspaces_screen(stdscr: curses.window, screen: Screen, workspaces: Workspaces,
+                              workspace_cache: WorkspaceCache) -> Tasks | None:
     """Process user input on the welcome screen"""
     
     if screen.selection_mode:
@@ -422,6 +492,7 @@ def control_workspaces_screen(stdscr: curses.window, screen: Screen, workspaces:
                         workspace: Workspace = workspaces.workspaces[number]
                         
                         delete_files = ask_confirmation(stdscr, screen, "Delete files? (Warning: this can not be reverted)")
+                        workspace_cache.discard(workspace)
                         workspaces.delete_workspace(workspace, delete_files)
 
                 # Load workspace
@@ -431,10 +502,10 @@ def control_workspaces_screen(stdscr: curses.window, screen: Screen, workspaces:
                         workspace: Workspace = workspaces.workspaces[number]
                         
                         workspaces.workspace_loaded = workspace
+                        screen.marked_task_ids.clear()
                         try:
-                            user_tasks: Tasks | None = Tasks.from_workspace(workspace)
-                            if not user_tasks.initialize(stdscr, screen):
-                                user_tasks: Tasks | None = None
+                            user_tasks: Tasks | None = workspace_cache.open(stdscr, screen, workspace, workspaces)
+                            if user_tasks is None:
                                 logging.warning("Did not acquire the initialization lock. Try again soon")
                                 return    
                             screen.state = AppState.JOURNAL
@@ -447,7 +518,7 @@ def control_workspaces_screen(stdscr: curses.window, screen: Screen, workspaces:
         
     else:
         # Getting user's input:
-        screen.key = nonblocking_getkey(stdscr)
+        screen.key = nonblocking_getkey(stdscr, screen)
 
         if screen.key in ["x", "l"]:
             screen.selection_mode = True
@@ -488,3 +559,89 @@ def control_workspaces_screen(stdscr: curses.window, screen: Screen, workspaces:
 
             screen.next_need_refresh = True
 
+
+
+@safe_run
+@tracer.traced(category="input")
+def control_search_screen(stdscr: curses.window, screen: Screen, workspaces: Workspaces,
+                          workspace_cache: WorkspaceCache, on_results: Callable[[], None]) -> Tasks | None:
+    """Process user input on the search screen. Returns the tasks of the workspace that was opened, if any"""
+    screen.key = nonblocking_getkey(stdscr, screen)
+
+    handle_screen_movement(screen, screen.key)
+    handle_reload_keys(screen, screen.key)
+    handle_screen_transfer_keys(stdscr, screen, screen.key)
+
+    # Search every workspace:
+    if screen.key == "/":
+        filter_chosen = input_filter_field(stdscr, screen, MSG_TS_FILTER, display_error=True)
+        if filter_chosen is None:
+            return None
+
+        filter_content = input_filter_content(stdscr, screen, filter_chosen)
+        if filter_chosen in [Filters.NAME, Filters.EXTRA_INFO]:
+            try:
+                re.compile(filter_content)
+            except re.error as e:
+                logging.error(f"Invalid regular expression: {e}")
+                return None
+
+        if screen.search is not None:
+            screen.search.cancel()
+        workspace_paths = [workspace.workspace_path for workspace in workspaces.workspaces]
+        screen.search = WorkspaceSearch(workspace_paths, TaskFilter(filter_chosen, filter_content),
+                                        global_config.SEARCH_PROCESSES.value, on_hits=lambda hits: on_results())
+        screen.search.start()
+        screen.offset = 0
+        screen.next_need_refresh = True
+
+    # Open the workspace of a result:
+    if screen.key == "l" and screen.search is not None:
+        hits = screen.search.results()
+        number = input_integer(stdscr, screen, MSG_SEARCH_LOAD)
+        screen.next_need_refresh = True
+        if number is None or not 0 <= number < len(hits):
+            return None
+
+        workspace = next((workspace for workspace in workspaces.workspaces
+                          if str(workspace.workspace_path) == hits[number].workspace_path), None)
+        if workspace is None:
+            logging.error(f"{hits[number].workspace_path} is not in the list of workspaces anymore")
+            return None
+
+        workspaces.workspace_loaded = workspace
+        screen.marked_task_ids.clear()
+        try:
+            user_tasks = workspace_cache.open(stdscr, screen, workspace, workspaces)
+        except dbm.error:
+            return None
+        if user_tasks is None:
+            logging.warning("Did not acquire the initialization lock. Try again soon")
+            return None
+
+        screen.state = AppState.JOURNAL
+        return user_tasks
+
+    return None
+
+
+@safe_run
+@tracer.traced(category="input")
+def control_agenda_screen(stdscr: curses.window, screen: Screen):
+    """Process user input on the agenda screen"""
+    screen.key = nonblocking_getkey(stdscr, screen)
+
+    handle_screen_movement(screen, screen.key)
+    handle_reload_keys(screen, screen.key)
+    handle_screen_transfer_keys(stdscr, screen, screen.key)
+
+
+@safe_run
+@tracer.traced(category="input")
+def control_report_screen(stdscr: curses.window, screen: Screen):
+    """Process user input on the time report screen"""
+    screen.key = nonblocking_getkey(stdscr, screen)
+
+    handle_screen_movement(screen, screen.key)
+    handle_reload_keys(screen, screen.key)
+    handle_screen_transfer_keys(stdscr, screen, screen.key)
@@ -1,34 +1,87 @@
 """Module provides datatypes used in the program"""
 
 from abc import abstractmethod
-from contextlib import contextmanager
+from contextlib import closing, contextmanager, nullcontext
 from curses import window
 import curses
 from datetime import date, datetime, timedelta
 import dbm
 import dbm.sqlite3
 import logging
+import multiprocessing
 import os
 from pathlib import Path
+import pickle
 import re
 import shelve
+import sqlite3
+import threading
 import time
 import enum
-from typing import Any, List
+import gc
+import getpass
+from typing import Any, Callable, Iterable, List
 
-import prompt_toolkit
-from flufl.lock import AlreadyLockedError, Lock, LockState, TimeOutError
+from flufl.lock import AlreadyLockedError, LockState, TimeOutError
 
+from calcuresu.aggregates import SubtreeAggregate, SubtreeAggregates
+from calcuresu.backup import BackupStore, start_backup
+from calcuresu.classes.manifest import IndexedDeadline, IndexedTimer, WorkspaceManifest
 from calcuresu.classes.task import RootTask, Task, TaskFilter
 from calcuresu.classes.timer import Timer
 from calcuresu.classes.workspace import Workspace
 from calcuresu.consts import Filters, Importance, Status
-from calcuresu.dialogues import ask_confirmation, move_cursor_to_x_y
+from calcuresu.dialogues import ask_confirmation, dialogs, move_cursor_to_x_y
+from calcuresu.locks import FCNTL_LOCK_SUFFIX, LeaseHeartbeat, create_lock_backend
+from calcuresu.merge import Changeset, MergeResult, RevisionBase, apply_changes, collect_changes
+from calcuresu.rollup import append_to_rollup, read_rollup, rollup_filename_for, rollup_filenames_for, write_rollup
+from calcuresu.saver import BackgroundSaver
 from calcuresu.screen import Screen
-from calcuresu.singletons import error, global_config
+from calcuresu.singletons import error, global_config, tracer
+from calcuresu.snapshot import Snapshot, snapshot_filename_for, write_snapshot
+from calcuresu.undo import Action, InsertTask, MoveTask, RemoveTask, SetNote, SwapTasks, TaskIndex, UndoHistory
+
+
+NOTES_VERSION = 1  # Notes are kept under their own keys instead of inside the task tree
+
+
+def note_key(item_id: int):
+    """Shelf key of the extra info of a task"""
+    return f"note/{item_id}"
+
+
+MANIFESTS_KEY = "manifests"  # Statistics of every workspace, in the list of workspaces
+MANIFEST_LOCK_TIMEOUT = 1  # Seconds to wait for the list of workspaces when storing a manifest
+
+ARCHIVE_INDEX_KEY = "archive_index"  # Chunks of the archive cold segment, and the largest id inside of them
+
+AGGREGATED_FIELDS = {"stamps", "status", "deadline", "archive_date"}  # Fields counted by the subtree aggregates
+
+
+def archive_chunk_key(chunk_number: int):
+    """Shelf key of a chunk of the archive cold segment"""
+    return f"archive/{chunk_number}"
+
+
+def read_shelf_key_nocache(shelf: shelve.Shelf, key: str, default: Any = None):
+    """Read a key straight from the database. Going through a writeback shelf would cache the value,
+    and every following save would pickle it again"""
+    try:
+        return pickle.loads(shelf.dict[key.encode(shelf.keyencoding)])
+    except KeyError:
+        return default
+
+
+def write_shelf_key_nocache(shelf: shelve.Shelf, key: str, value: Any):
+    """Write a key straight to the database, for large values that are written once (notes, archive chunks).
+    Going through a writeback shelf would keep the value cached, and every following save would write it again"""
+    shelf.cache.pop(key, None)
+    shelf.dict[key.encode(shelf.keyencoding)] = pickle.dumps(value, protocol=4)
 
 
 class Shelveable:
+    is_remote = False  # Served by a workspace server (calcuresu serve), so it is never locked or saved from here
+
     def __init__(self, shelve_filename: Path|str, lock_filename: Path|str) -> None:
         """
         Shelf file constants
@@ -41,12 +94,23 @@ class Shelveable:
         """
         lock_acquire_timeout = timedelta(seconds=global_config.LOCK_ACQUIRE_TIMEOUT.value) # Maximum timeout to wait for lock
         lock_lifetime = timedelta(seconds=global_config.LOCK_LIFETIME.value)  # Maximum time to write the file
-        self.tasks_lock = Lock(str(lock_filename), lifetime=lock_lifetime, default_timeout=lock_acquire_timeout)
+        self.tasks_lock = create_lock_backend(lock_filename, lock_lifetime, lock_acquire_timeout, global_config.LOCK_BACKEND.value)
+        self._lock_holders = 0  # The UI and the background saver can hold the lock at the same time
+        self._lock_holders_mutex = threading.Lock()
+        heartbeat_interval = max(1.0, lock_lifetime.total_seconds() / 3)  # Several refreshes before the lease runs out
+        self.heartbeat = LeaseHeartbeat(self._refresh_held_lock, lambda: self.tasks_lock.expiration, heartbeat_interval,
+                                        name=f"heartbeat {Path(shelve_filename).name}")
 
         """
         Shelf file saving variables
         """
         self.changed = False
+        self.state_lock = threading.RLock()  # Held while the loaded state is edited, or captured by the background saver
+        self._write_mutex = threading.Lock()  # Only one connection writes to the file at a time
+        self.saver: BackgroundSaver|None = None
+        if global_config.BACKGROUND_SAVE.value:
+            self.saver = BackgroundSaver(self._write_cached_entries, global_config.SAVE_DEBOUNCE.value,
+                                         name=f"saver {Path(shelve_filename).name}")
 
         """ Last file modification time """
         self.last_shelve_modification_time = None 
@@ -74,38 +138,142 @@ class Shelveable:
 
         return shelf
 
+    def watch_changes(self, callback: Callable[[], None]):
+        """Have the callback called (from any thread) when someone else changes the shelf. Nothing calls it
+        for plain files, whose changes are found by checking the modification time on every refresh interval"""
+
     def cleanup(self):
-        self.tasks_lock.unlock(unconditionally=True)
+        if self.saver is not None:
+            self.saver.stop()  # Writes the pending changes
+
+        with self._lock_holders_mutex:
+            self._lock_holders = 0
+            self.tasks_lock.unlock()
+
+        if self._shelve_file is not None:
+            # Everything was saved already. Left open, the shelf would write its cached entries back
+            # (without the lock) whenever it is garbage collected, from whichever thread collects it
+            self._shelve_file.cache.clear()
+            with self._write_mutex:
+                self._shelve_file.close()
+            self._shelve_file = None
 
     @abstractmethod
     def hook_initialize_shelf(self, shelf: shelve.Shelf):
         raise NotImplementedError()
 
+    def hook_prepare_save(self):
+        """Called before the state is saved, while the shelf is open and the lock is held"""
+
+    def hook_state_captured(self):
+        """Called once the state that is being saved was captured"""
+
+    def hook_state_written(self):
+        """Called once the saved state is in the file"""
+
+    def hook_state_published(self):
+        """Called after hook_state_written without the state lock, for slow work on what hook_state_written captured"""
+
+    @tracer.traced(category="storage")
     def _write_to_shelve_file_nolock(self):
         assert self._shelve_file is not None
 
+        self.hook_prepare_save()
         logging.info("Saving file...")
-        self._shelve_file.close()  # calls sync inside of it 
+        with self._write_mutex:
+            self._shelve_file.close()  # calls sync inside of it 
         self._shelve_file = None # Invalidate shelve file
+        self.hook_state_captured()
+        self.hook_state_written()
+        self.hook_state_published()
         error.clear_indication = True
 
     def _write_to_shelve_file_locked(self):
-        with self.tasks_lock:
+        with self.holding_lock():
             self._write_to_shelve_file_nolock()
 
+    @tracer.traced(category="storage")
+    def _write_cached_entries(self):
+        """Write the cached entries of the shelf, keeping them loaded (used by the saver thread). The entries are pickled
+        under the state lock, so they are consistent, and written with a connection of this thread. Returns whether the save succeeded"""
+        with self.state_lock:
+            shelf = self._shelve_file
+            if shelf is None:
+                return True  # Saved in the foreground in the meantime
+            entries = {key.encode(shelf.keyencoding): pickle.dumps(value, protocol=4) for key, value in shelf.cache.items()}
+            self.hook_state_captured()
+
+        try:
+            self.lock(timeout=None)
+        except TimeOutError:
+            logging.error("Could not take the lock to save the file in the background. Trying again soon")
+            return False
+
+        try:
+            with self._write_mutex, closing(dbm.open(str(self._shelve_filename), "w")) as db:
+                for key, value in entries.items():
+                    db[key] = value
+            self.last_shelve_modification_time = self._get_shelve_last_modification_time()
+        finally:
+            self.unlock()
+
+        with self.state_lock:
+            self.hook_state_written()
+        self.hook_state_published()  # Waits for other processes, so the UI must not be kept waiting on the state lock
+        error.clear_indication = True
+        return True
+
+    def _discard_loaded_shelf(self):
+        """Close the shelf without writing the changes that were made to it"""
+        if self._shelve_file is None:
+            return
+        with self._write_mutex:
+            self._shelve_file.cache.clear()
+            self._shelve_file.close()
+        self._shelve_file = None
+
+    def write_loaded_state_nolock(self):
+        """Save without reading the file back afterwards (unlike save_if_needed_nolock)"""
+        assert self._shelve_file is not None
+        self.hook_prepare_save()
+        self._write_cached_entries()
+        self.changed = False
+
+    def reload_nolock(self):
+        """Drop the loaded state (and whatever wasn't saved) and load the file again"""
+        self._discard_loaded_shelf()
+        self.reopen_shelve_nolock()
+
     def reopen_shelve_nolock(self):
         # Re-initialize shelve file
         self._shelve_file = self._initialize_shelve()
         self.last_shelve_modification_time = self._get_shelve_last_modification_time()
 
+    def read_shelve_key_readonly(self, key: str, default: Any = None):
+        """Read a single key without loading the shelf for writing (and without modifying the file)"""
+        try:
+            with shelve.open(self._shelve_filename, flag="r", protocol=4) as shelf:
+                return shelf.get(key, default)
+        except dbm.error:
+            return default
+
+    def load_shelve_if_needed_nolock(self):
+        """Make sure the full shelf is loaded before it is edited"""
+        if self._shelve_file is None:
+            self.reopen_shelve_nolock()
+
+    @tracer.traced(category="storage")
     def reopen_shelve_locked(self,stdscr: curses.window, screen: Screen):
-        with try_to_lock_auto_unlock(stdscr, screen, self) as locked:
+        with try_to_lock_auto_unlock(stdscr, screen, self, load_shelve=False) as locked:
             if locked:
                 self.reopen_shelve_nolock()
 
             return locked
 
     def reopen_shelve_if_needed_locked(self,stdscr: curses.window, screen: Screen):
+        if self.saver is not None and self.saver.is_busy:
+            return False  # Our own changes are on their way to the file, reloading now would drop them
+
         if self.has_shelve_file_changed():
             try:
                 if self.reopen_shelve_locked(stdscr, screen):
@@ -153,11 +321,15 @@ class Shelveable:
         return self.tasks_lock.state == LockState.ours
 
     def force_acquire_lock(self):
-        try:
-            self.tasks_lock.lock(timeout=1)
-        except TimeOutError:
-            self.tasks_lock._break()
-            self.tasks_lock.lock()  # Use default timeout
+        with self._lock_holders_mutex:
+            try:
+                self.tasks_lock.lock(timeout=1)
+            except TimeOutError:
+                if not self.tasks_lock.break_lock():
+                    return False
+                self.tasks_lock.lock()  # Use default timeout
+            self._lock_holders += 1
+            return True
 
     def try_lock_default_timeout(self):
         try:
@@ -167,55 +339,123 @@ class Shelveable:
             return False 
 
     def lock(self, timeout: int|None):
-        return self.tasks_lock.lock(timeout)
+        with self._lock_holders_mutex:
+            if not self.our_lock:
+                self.tasks_lock.lock(timeout)
+            self._lock_holders += 1
 
     def unlock(self):
-        return self.tasks_lock.unlock(unconditionally=True)
+        with self._lock_holders_mutex:
+            self._lock_holders = max(0, self._lock_holders - 1)
+            if self._lock_holders == 0:
+                self.tasks_lock.unlock()
+
+    @contextmanager
+    def holding_lock(self):
+        self.lock(timeout=None)
+        try:
+            yield
+        finally:
+            self.unlock()
 
     def refresh_lock(self):
         assert self.our_lock
-        self.tasks_lock.refresh(unconditionally=True)
+        self.tasks_lock.refresh()
+
+    def _refresh_held_lock(self):
+        """Refresh the lock from the heartbeat thread. Returns False if someone else took it"""
+        with self._lock_holders_mutex:
+            if self._lock_holders == 0:
+                return True  # Released in the meantime, nothing to keep alive
+            if not self.our_lock:
+                return False
+            self.tasks_lock.refresh()
+            return True
 
     def save_if_needed_nolock(self):
         if not self.changed:
             return 
 
-        self._save_changes_and_reopen_shelve_nolock()
+        if self.saver is not None:
+            assert self._shelve_file is not None
+            self.hook_prepare_save()
+            self.saver.request_save()
+        else:
+            self._save_changes_and_reopen_shelve_nolock()
         self.changed = False
 
     def save_if_needed_locked(self):
         if not self.changed:
             return 
 
-        with self.tasks_lock:
+        with self.holding_lock():
             self.save_if_needed_nolock()    
 
 
 @contextmanager
-def try_to_lock_auto_unlock(stdscr: curses.window, screen: Screen, shelvable: Shelveable):
+def try_to_lock_auto_unlock(stdscr: curses.window, screen: Screen, shelvable: Shelveable, load_shelve: bool = True):
     locked = try_to_lock(stdscr, screen, shelvable)
-        
+    if not locked:
+        yield False
+        return
+
+    screen.held_leases.append(shelvable.heartbeat)  # Prompts keep the lock alive while it's held
     try:
-        yield locked
+        with shelvable.state_lock:
+            if load_shelve:
+                shelvable.load_shelve_if_needed_nolock()
+            yield True
     
     finally:
-        if locked:
-            shelvable.unlock()
+        screen.held_leases.remove(shelvable.heartbeat)
+        shelvable.unlock()
 
+@tracer.traced(category="lock")
 def try_to_lock(stdscr: curses.window, screen: Screen, shelvable: Shelveable):
+    if shelvable.is_remote:
+        logging.error("This can't be done while the workspace is served by 'calcuresu serve'")
+        return False
 
     if shelvable.our_lock:
         shelvable.refresh_lock()
-        return True 
 
+    # When the lock is already ours (the background saver holds it), this only counts one more holder
     if shelvable.try_lock_default_timeout():
         return True
     if ask_confirmation(stdscr, screen, "Another user is currently editing. Are you sure you want to forcefully take the lock? (their lock has a timeout)"):
-        shelvable.force_acquire_lock()
-        return True
+        return shelvable.force_acquire_lock()
     
     return False 
 
+@contextmanager
+def try_to_edit(stdscr: curses.window, screen: Screen, user_tasks: "Tasks"):
+    """Run an edit of the tasks (prompts included) and save it. The lock is held for the whole edit,
+    unless optimistic edits are enabled - then it is only taken at the end, to merge the edit into the file"""
+    if not (global_config.OPTIMISTIC_EDITS.value or user_tasks.is_remote):
+        with try_to_lock_auto_unlock(stdscr, screen, user_tasks) as locked:
+            yield locked
+            if locked:
+                user_tasks.save_if_needed_nolock()
+        return
+
+    with user_tasks.state_lock:
+        user_tasks.begin_optimistic_edit()
+        try:
+            yield True
+        except BaseException:
+            user_tasks.discard_optimistic_edit()  # Like the locked edits, an edit that failed half way isn't saved
+            raise
+    user_tasks.commit_optimistic_edit(stdscr, screen)
+
+
+class PreloadedTree:
+    """Task tree of a workspace that was read in the background, before the workspace was opened"""
+
+    def __init__(self, generation: int, task_tree: List[Task], size: int):
+        self.generation = generation
+        self.task_tree = task_tree
+        self.size = size  # Estimated bytes in memory
+
 
 class Tasks(Shelveable):
     """List of tasks created by the user"""
@@ -224,13 +464,564 @@ class Tasks(Shelveable):
         super().__init__(filename, lock_filename)
         self._user_display_filter: TaskFilter|None = None
 
+        """
+        Read-only snapshot, used until the shelf itself is loaded
+        """
+        self._snapshot_filename = snapshot_filename_for(filename)
+        self.snapshot: Snapshot|None = None
+
+        """
+        Archive cold segment - fully archived subtrees are moved out of the task tree when saving,
+        and are only loaded when the archive is viewed (or restored from)
+        """
+        self.archive_index: dict = {"chunks": [], "next_chunk": 0, "max_id": 0}
+        self.archive_segment: List[Task]|None = None
+        self._archive_segment_ordered: List[Task] = []
+        self._archive_segment_by_id: dict[int, Task] = {}
+        self._archive_segment_root_of: dict[int, Task] = {}
+        self._archive_segment_changed = False
+
+        """
+        Yearly rollups - archived subtrees older than the retention period live in compressed files
+        next to the workspace, and are only read when the archive screen asks for their year
+        """
+        self.rollups: dict[int, List[Task]] = {}
+        self._rollup_notes: dict[int, dict[int, str]] = {}
+        self._rollup_ordered: List[Task] = []
+        self._rollup_by_id: dict[int, Task] = {}
+        self._rollup_root_of: dict[int, tuple[int, Task]] = {}
+        self._rollups_changed: set[int] = set()
+        self._force_retention = False
+
+        """
+        Optimistic edits - made without the lock, then merged into the latest version of the file when saving
+        """
+        self._edit_base: RevisionBase|None = None
+        self._pending_notes: dict[int, str|None] = {}  # Notes edited since the edit started (None = deleted)
+
+        """
+        Workspace manifest - statistics of the workspace, stored in the list of workspaces after every save
+        """
+        self.registry: Workspaces|None = None
+
+        """
+        Preloaded tree - used instead of unpickling the tree again when the shelf is opened, unless it was saved since
+        """
+        self.preloaded: PreloadedTree|None = None
+
+        """
+        Backups - taken by another process after a save, once backup_interval minutes passed since the last one
+        """
+        self._last_backup_time: float|None = None  # Read from the backup folder the first time
+        self._backup_process: multiprocessing.process.BaseProcess|None = None
+        self._written_manifest: WorkspaceManifest|None = None  # Built under the state lock, stored after it's released
+        self._publish_mutex = threading.Lock()  # A foreground save may publish while the saver thread does
+
+        """
+        Undo history - the operations that revert the saved edits, an action per save
+        """
+        self.history = UndoHistory(global_config.UNDO_MEMORY.value * 1024 * 1024)
+
+        """
+        Subtree aggregates - totals of the descendants of collapsed tasks, dropped along the ancestors of a changed task
+        """
+        self.aggregates = SubtreeAggregates()
+
+    def initialize(self, stdscr: curses.window, screen: Screen):
+        if global_config.WORKSPACE_SNAPSHOTS.value and self._open_snapshot_if_fresh():
+            return True
+
+        return super().initialize(stdscr, screen)
+
+    def reopen_shelve_locked(self, stdscr: curses.window, screen: Screen):
+        if self.snapshot is not None and self._open_snapshot_if_fresh():
+            # Nothing was edited since we opened the snapshot, so there is no need for the full shelf
+            return True
+
+        return super().reopen_shelve_locked(stdscr, screen)
+
+    def _open_snapshot_if_fresh(self):
+        generation = self.read_shelve_key_readonly("generation", default=None)
+        if generation is None:
+            return False
+
+        snapshot = Snapshot.open_if_fresh(self._snapshot_filename, generation)
+        if snapshot is None:
+            return False
+
+        self._close_snapshot()
+        self.snapshot = snapshot
+        self.generation = generation
+        self.task_tree = []
+        self.root_task = RootTask(self.task_tree)
+        self.archive_index = self.read_shelve_key_readonly(ARCHIVE_INDEX_KEY, default=self.archive_index)
+        self._unload_archive_segment()
+        self.last_shelve_modification_time = self._get_shelve_last_modification_time()
+        return True
+
+    def _close_snapshot(self):
+        if self.snapshot is not None:
+            self.snapshot.close()
+            self.snapshot = None
+
+    def hook_prepare_save(self):
+        assert self._shelve_file is not None
+
+        detached = self._detach_archived_subtrees()
+        if self._is_retention_due():
+            detached = self._apply_archive_retention(detached)
+        self._store_archive_segment(detached)
+
+        # Lets snapshots (and anyone else reading the shelf) know which version of the tree they have.
+        # It goes through the writeback cache, so it reaches the file together with the tree
+        aggregates_are_current = self.aggregates.generation == self.generation
+        self.generation += 1
+        self._shelve_file.cache["generation"] = self.generation
+        if aggregates_are_current:
+            self.aggregates.generation = self.generation  # They already count our own changes
+
+    def hook_state_captured(self):
+        if global_config.WORKSPACE_SNAPSHOTS.value:
+            try:
+                write_snapshot(self._snapshot_filename, self.root_task, self.generation)
+            except OSError as e:
+                logging.error(f"Could not write workspace snapshot: {e}")
+
+    def hook_state_written(self):
+        self._write_changed_rollups()
+        if self.registry is not None:
+            self._written_manifest = self.build_manifest()
+
+    def hook_state_published(self):
+        with self._publish_mutex:
+            manifest, self._written_manifest = self._written_manifest, None
+            if manifest is not None:
+                self._store_manifest(manifest)
+            self._start_backup_if_due()
+
+    def _start_backup_if_due(self):
+        interval = global_config.BACKUP_INTERVAL.value * 60
+        if interval <= 0:
+            return
+
+        if self._backup_process is not None:
+            if self._backup_process.is_alive():
+                return
+            if self._backup_process.exitcode != 0:
+                logging.error(f"Could not back up the workspace. Run 'calcuresu backup {self._shelve_filename}' to see why")
+            self._backup_process = None
+
+        if self._last_backup_time is None:
+            self._last_backup_time = BackupStore(self._shelve_filename).last_backup_time() or 0
+        if time.time() - self._last_backup_time < interval:
+            return
+
+        self._last_backup_time = time.time()
+        self._backup_process = start_backup(self._shelve_filename, global_config.BACKUP_KEEP.value)
+
+    def restore_nolock(self, entries: dict[str, Any]):
+        """Replace everything in the workspace with the given keys (e.g. a backup) and save it"""
+        self.load_shelve_if_needed_nolock()
+        assert self._shelve_file is not None
+
+        # Snapshots and manifests of the current version must not pass for the restored one
+        entries["generation"] = max(self.generation, entries.get("generation", 0))
+        for key in list(self._shelve_file.keys()):
+            if key not in entries:
+                del self._shelve_file[key]
+        for key, value in entries.items():
+            self._shelve_file[key] = value
+        with self._write_mutex:
+            self._shelve_file.sync()
+
+        self.reload_nolock()
+        self.aggregates.clear()
+        self.changed = True
+        self.write_loaded_state_nolock()
+
+    def build_manifest(self):
+        status_counts: dict[int, int] = {}
+        deadline_index: List[IndexedDeadline] = []
+        timer_index: List[IndexedTimer] = []
+        stack = list(self.root_task.children)
+        while stack:
+            task = stack.pop()
+            stack.extend(task.children)
+            if task.is_archived:
+                continue
+
+            status_counts[task.status.value] = status_counts.get(task.status.value, 0) + 1
+            if task.timer.is_counting:
+                timer_index.append(IndexedTimer(task.item_id, task.name, Timer(list(task.timer.stamps))))
+            if task.deadline is not None and task.status != Status.DONE:
+                deadline_index.append(IndexedDeadline(task.item_id, task.name, task.deadline, task.status))
+        next_deadline = min((indexed.deadline for indexed in deadline_index), default=None)
+
+        try:
+            user = getpass.getuser()
+        except (OSError, KeyError):
+            user = "unknown"
+
+        return WorkspaceManifest(str(self._shelve_filename), status_counts, len(timer_index), next_deadline,
+                                 os.stat(self._shelve_filename).st_size, f"{user}@{self.tasks_lock.hostname}",
+                                 datetime.now(), self.generation, deadline_index, timer_index)
+
+    def _store_manifest(self, manifest: WorkspaceManifest|None = None):
+        if self.registry is None:
+            return
+        try:
+            self.registry.store_manifest(manifest or self.build_manifest())
+        except (OSError, dbm.error) as e:
+            logging.error(f"Could not update the statistics of the workspace: {e}")
+
     def hook_initialize_shelf(self, shelf: shelve.Shelf):
+        self._close_snapshot()
+        self.generation: int = shelf.get("generation", 0)
+
         if "task_tree" not in shelf:
             shelf["task_tree"] = []
-        
-        self.task_tree: List[Task] = shelf["task_tree"]
+
+        preloaded, self.preloaded = self.preloaded, None
+        if preloaded is not None and preloaded.generation == self.generation:
+            shelf.cache["task_tree"] = preloaded.task_tree
+
+        # Unpickling allocates a lot of objects, which would otherwise trigger many useless
+        # garbage collections while the tree is being built
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            self.task_tree: List[Task] = shelf["task_tree"]
+        finally:
+            if gc_was_enabled:
+                gc.enable()
         self.root_task = RootTask(self.task_tree)
 
+        self.archive_index = shelf.get(ARCHIVE_INDEX_KEY, self.archive_index)
+        self._unload_archive_segment()
+
+        if shelf.get("notes_version", 0) < NOTES_VERSION:
+            self._move_inline_notes_to_store(shelf)
+
+    def _move_inline_notes_to_store(self, shelf: shelve.Shelf):
+        """Tasks pickled before notes were split out carry them inline"""
+        for task in self.all_ordered_tasks:
+            if task.legacy_extra_info is not None:
+                write_shelf_key_nocache(shelf, note_key(task.item_id), task.legacy_extra_info)
+                task.legacy_extra_info = None
+
+        shelf["notes_version"] = NOTES_VERSION
+
+    def _detach_archived_subtrees(self) -> List[Task]:
+        """Take the fully archived subtrees (archived tasks with only archived descendants) out of the task tree.
+        Archived tasks that still have active descendants stay, so those are still displayed with their ghost parent"""
+        all_tasks = self.flatten_children_ordered(self.root_task, hide_collapsed=False, hide_archived=False)
+
+        fully_archived: set[int] = set()
+        for task in reversed(all_tasks):  # Descendants come before their ancestors
+            if task.is_archived and all(child.item_id in fully_archived for child in task.children):
+                fully_archived.add(task.item_id)
+
+        if not fully_archived:
+            return []
+
+        detached: List[Task] = []
+        for parent in [self.root_task, *all_tasks]:
+            if parent.item_id in fully_archived:
+                continue  # Moves together with its own parent
+
+            kept_children = [child for child in parent.children if child.item_id not in fully_archived]
+            if len(kept_children) != len(parent.children):
+                detached.extend(child for child in parent.children if child.item_id in fully_archived)
+                parent.children[:] = kept_children
+
+        self.archive_index["max_id"] = max(self.archive_index["max_id"], max(fully_archived))
+        return detached
+
+    def _store_archive_segment(self, detached: List[Task]):
+        """Write newly detached subtrees to a new chunk, or rewrite the whole segment if it was loaded and changed"""
+        assert self._shelve_file is not None
+
+        rewrite_segment = self.archive_segment is not None and (self._archive_segment_changed or detached)
+        if rewrite_segment:
+            assert self.archive_segment is not None
+            for chunk_key in self.archive_index["chunks"]:
+                if chunk_key in self._shelve_file:
+                    del self._shelve_file[chunk_key]
+            self.archive_index["chunks"] = []
+            detached = self.archive_segment + detached
+            self._archive_segment_changed = False
+        elif not detached:
+            return
+
+        if detached:
+            chunk_key = archive_chunk_key(self.archive_index["next_chunk"])
+            self.archive_index["next_chunk"] += 1
+            self.archive_index["chunks"].append(chunk_key)
+            write_shelf_key_nocache(self._shelve_file, chunk_key, detached)
+        self._shelve_file[ARCHIVE_INDEX_KEY] = self.archive_index
+
+    def load_archive_segment(self):
+        """Load the archived subtrees that were moved out of the task tree"""
+        if self.archive_segment is not None:
+            return
+
+        roots: List[Task] = []
+        with self._shelf_reader() as shelf:
+            if shelf is not None:
+                for chunk_key in self.archive_index["chunks"]:
+                    roots.extend(read_shelf_key_nocache(shelf, chunk_key, []))
+
+        by_id: dict[int, Task] = {}
+        for root in roots:
+            by_id[root.item_id] = root
+            for task in self.flatten_children_ordered(root, hide_collapsed=False, hide_archived=False):
+                by_id[task.item_id] = task
+
+        # A subtree may have been detached before its parent was archived too - put it back under it
+        self.archive_segment = []
+        for root in roots:
+            parent = by_id.get(root.parent_id)
+            if parent is not None:
+                parent.children.append(root)
+                self._archive_segment_changed = True
+            else:
+                self.archive_segment.append(root)
+
+        # The parent might have been deleted after the subtree was detached
+        if self.snapshot is None:
+            is_in_task_tree = {task.item_id for task in self.all_ordered_tasks}.__contains__
+        else:
+            is_in_task_tree = self._is_in_task_tree
+        for root in self.archive_segment:
+            if root.parent_id != 0 and not is_in_task_tree(root.parent_id):
+                root.parent_id = 0
+                self._archive_segment_changed = True
+
+        self._archive_segment_by_id = by_id
+        self._index_archive_segment()
+
+    def _index_archive_segment(self):
+        assert self.archive_segment is not None
+
+        self._archive_segment_ordered = []
+        self._archive_segment_root_of = {}
+        for root in self.archive_segment:
+            subtree = [root, *self.flatten_children_ordered(root, hide_collapsed=False, hide_archived=False)]
+            self._archive_segment_ordered.extend(subtree)
+            for task in subtree:
+                self._archive_segment_root_of[task.item_id] = root
+
+    def _unload_archive_segment(self):
+        self.archive_segment = None
+        self._archive_segment_ordered = []
+        self._archive_segment_by_id = {}
+        self._archive_segment_root_of = {}
+        self._archive_segment_changed = False
+
+    def _reattach_archived_subtree(self, root: Task):
+        """Move a subtree of the cold segment back to the task tree"""
+        assert self.archive_segment is not None
+
+        self.archive_segment.remove(root)
+        for task in [root, *self.flatten_children_ordered(root, hide_collapsed=False, hide_archived=False)]:
+            self._archive_segment_by_id.pop(task.item_id, None)
+        self._index_archive_segment()
+        self._archive_segment_changed = True
+
+        if not self._is_in_task_tree(root.parent_id):
+            root.parent_id = 0
+        parent = self.get_task_by_id(root.parent_id)
+        parent.children.append(root)
+        self.aggregates.task_attached(root, parent)
+
+    def _is_in_task_tree(self, task_id: int):
+        if task_id == 0:
+            return True
+
+        if self.snapshot is not None:
+            try:
+                self.snapshot.row_of_id(task_id)
+                return True
+            except ValueError:
+                return False
+
+        return any(task.item_id == task_id for task in self.all_ordered_tasks)
+
+    def _is_retention_due(self):
+        assert self._shelve_file is not None
+
+        if self._force_retention:
+            return True
+        if global_config.ARCHIVE_RETENTION_DAYS.value <= 0:
+            return False
+
+        last_retention: datetime|None = self._shelve_file.get("last_archive_retention")
+        interval = timedelta(hours=global_config.ARCHIVE_RETENTION_INTERVAL.value)
+        return last_retention is None or datetime.now() - last_retention >= interval
+
+    def _apply_archive_retention(self, detached: List[Task]) -> List[Task]:
+        """Move the archived subtrees that were last archived before the retention period to their yearly rollup.
+        Returns the newly detached subtrees that stay in the cold segment"""
+        assert self._shelve_file is not None
+
+        self._force_retention = False
+        now = datetime.now()
+        self._shelve_file["last_archive_retention"] = now
+        if global_config.ARCHIVE_RETENTION_DAYS.value <= 0:
+            return detached
+        cutoff = now - timedelta(days=global_config.ARCHIVE_RETENTION_DAYS.value)
+
+        self.load_archive_segment()
+        assert self.archive_segment is not None
+
+        expired_by_year: dict[int, List[Task]] = {}
+        notes_by_year: dict[int, dict[int, str]] = {}
+        expired_tasks: List[Task] = []
+        for root in self.archive_segment + detached:
+            subtree = [root, *self.flatten_children_ordered(root, hide_collapsed=False, hide_archived=False)]
+            last_archived = max(task.archive_date for task in subtree if task.archive_date is not None)
+            if last_archived >= cutoff:
+                continue
+
+            expired_by_year.setdefault(last_archived.year, []).append(root)
+            year_notes = notes_by_year.setdefault(last_archived.year, {})
+            for task in subtree:
+                if task.has_extra_info:
+                    year_notes[task.item_id] = read_shelf_key_nocache(self._shelve_file, note_key(task.item_id), "")
+            expired_tasks.extend(subtree)
+
+        if not expired_by_year:
+            return detached
+
+        # The rollups are written first - if the workspace isn't saved afterwards, the tasks are just in both places
+        try:
+            for year, roots in expired_by_year.items():
+                append_to_rollup(rollup_filename_for(self._shelve_filename, year), roots, notes_by_year[year])
+        except OSError as e:
+            logging.error(f"Could not write archive rollup: {e}")
+            return detached
+
+        expired_ids = {task.item_id for task in expired_tasks}
+        self._delete_notes(expired_tasks)
+        self.archive_segment[:] = [root for root in self.archive_segment if root.item_id not in expired_ids]
+        for task_id in expired_ids:
+            self._archive_segment_by_id.pop(task_id, None)
+        self._index_archive_segment()
+        self._archive_segment_changed = True
+        logging.info(f"Moved {len(expired_tasks)} archived tasks to the yearly rollups")
+
+        for year in expired_by_year:
+            if year in self.rollups:
+                self.load_rollup(year)  # Show the moved tasks if the year is being viewed
+
+        return [root for root in detached if root.item_id not in expired_ids]
+
+    def rollup_years(self):
+        """Years that have a rollup file"""
+        return list(rollup_filenames_for(self._shelve_filename))
+
+    def load_rollup(self, year: int):
+        """Read a yearly rollup, so its tasks are displayed in the archive"""
+        try:
+            roots, notes = read_rollup(rollup_filename_for(self._shelve_filename, year))
+        except (OSError, EOFError, ValueError, pickle.UnpicklingError) as e:
+            logging.error(f"Could not read the archive rollup of {year}: {e}")
+            return
+
+        self.rollups[year] = roots
+        self._rollup_notes[year] = notes
+        self._rollups_changed.discard(year)
+        self._index_rollups()
+
+    def unload_rollups(self):
+        self.rollups = {}
+        self._rollup_notes = {}
+        self._rollups_changed = set()
+        self._index_rollups()
+
+    def _index_rollups(self):
+        self._rollup_ordered = []
+        self._rollup_by_id = {}
+        self._rollup_root_of = {}
+        for year, roots in sorted(self.rollups.items()):
+            for root in roots:
+                subtree = [root, *self.flatten_children_ordered(root, hide_collapsed=False, hide_archived=False)]
+                self._rollup_ordered.extend(subtree)
+                for task in subtree:
+                    self._rollup_by_id[task.item_id] = task
+                    self._rollup_root_of[task.item_id] = (year, root)
+
+        if not self.rollups:
+            return
+
+        # The parent may be in a rollup that isn't loaded, or may not exist anymore
+        self.load_archive_segment()
+        if self.snapshot is None:
+            is_in_task_tree = {task.item_id for task in self.all_ordered_tasks}.__contains__
+        else:
+            is_in_task_tree = self._is_in_task_tree
+        for roots in self.rollups.values():
+            for root in roots:
+                if root.parent_id == 0 or root.parent_id in self._rollup_by_id or root.parent_id in self._archive_segment_by_id:
+                    continue
+                if not is_in_task_tree(root.parent_id):
+                    root.parent_id = 0
+
+    def _restore_rollup_subtree(self, year: int, root: Task):
+        """Move a subtree of a yearly rollup back to the task tree (with its notes)"""
+        assert self._shelve_file is not None
+
+        self.rollups[year].remove(root)
+        year_notes = self._rollup_notes[year]
+        for task in [root, *self.flatten_children_ordered(root, hide_collapsed=False, hide_archived=False)]:
+            note = year_notes.pop(task.item_id, None)
+            if note is not None:
+                write_shelf_key_nocache(self._shelve_file, note_key(task.item_id), note)
+        self._rollups_changed.add(year)
+        self._index_rollups()
+
+        if not self._is_in_task_tree(root.parent_id):
+            root.parent_id = 0
+        parent = self.get_task_by_id(root.parent_id)
+        parent.children.append(root)
+        self.aggregates.task_attached(root, parent)
+
+    def _write_changed_rollups(self):
+        """Rewrite the rollups that tasks were restored from. Done after the workspace is saved,
+        so a failure leaves the task in both places instead of losing it"""
+        for year in self._rollups_changed:
+            try:
+                write_rollup(rollup_filename_for(self._shelve_filename, year), self.rollups[year], self._rollup_notes[year])
+            except OSError as e:
+                logging.error(f"Could not write the archive rollup of {year}: {e}")
+        self._rollups_changed = set()
+
+    def compact_nolock(self):
+        """Apply the retention policy now, rewrite the archive segment as a single chunk and vacuum the database.
+        Returns the size of the database file before and after"""
+        self.load_shelve_if_needed_nolock()
+        self.load_archive_segment()
+        self._archive_segment_changed = True
+        self._force_retention = True
+
+        size_before = os.stat(self._shelve_filename).st_size
+        self._write_to_shelve_file_nolock()
+        self._vacuum_shelve_file()
+        self._store_manifest()  # With the size after vacuuming
+        self.reopen_shelve_nolock()
+        self.changed = False
+
+        return size_before, os.stat(self._shelve_filename).st_size
+
+    def _vacuum_shelve_file(self):
+        """Give the pages of deleted keys back to the file system"""
+        if dbm.whichdb(str(self._shelve_filename)) != "dbm.sqlite3":
+            logging.warning("Only sqlite workspaces can be vacuumed")
+            return
+
+        with self._write_mutex, closing(sqlite3.connect(self._shelve_filename)) as connection:
+            connection.execute("VACUUM")
+
     @property
     def filter(self):
         return self._user_display_filter
@@ -251,39 +1042,187 @@ class Tasks(Shelveable):
         return cls(workspace.workspace_path, workspace.workspace_lock)
 
     def restore_item_from_archive_with_children(self, task: Task, restore_children: bool):
-        task.archive_date = None
+        cold_root = self._archive_segment_root_of.get(task.item_id)
+        if cold_root is not None:
+            self._reattach_archived_subtree(cold_root)
+
+        rollup_root = self._rollup_root_of.get(task.item_id)
+        if rollup_root is not None:
+            self._restore_rollup_subtree(*rollup_root)
+
+        self.set_task_field(task, "archive_date", None)
 
         if restore_children:
+            # Archived subtrees of the restored ones may have been moved to the cold segment
+            self.load_archive_segment()
+            assert self.archive_segment is not None
+            children = self.flatten_children_ordered(task, hide_collapsed=True, hide_archived=False)
+            restored_ids = {task.item_id, *(child_task.item_id for child_task in children)}
+            for cold_root in [root for root in self.archive_segment if root.parent_id in restored_ids]:
+                self._reattach_archived_subtree(cold_root)
+
             children = self.flatten_children_ordered(task, hide_collapsed=True, hide_archived=False)
             for child_task in children:
                 if child_task.is_archived:
-                    child_task.archive_date = None
+                    self.set_task_field(child_task, "archive_date", None)
         self.changed = True
 
     def delete_all_items(self):
+        self.load_archive_segment()
+        assert self.archive_segment is not None
+        # Undone from the last one: the cold subtrees go back under their parents, after the tree is back
+        for cold_root in self.archive_segment:
+            self.history.record(InsertTask(cold_root, cold_root.parent_id, None,
+                                           self._notes_for_history([cold_root, *self.flatten_children_ordered(cold_root, hide_archived=False)]), None))
+        for root in self.task_tree:
+            self.history.record(InsertTask(root, 0, 0, self._notes_for_history([root, *self.flatten_children_ordered(root, hide_archived=False)]), None))
+        self._delete_notes(self.all_ordered_tasks)
+        self._delete_notes(self._archive_segment_ordered)
         self.task_tree.clear()
+        self.archive_segment = []
+        self._index_archive_segment()
+        self._archive_segment_changed = True
         self.changed = True
 
     @property
     def all_ordered_tasks(self):
+        if self.snapshot is not None:
+            return self.snapshot.all_tasks
         return self.flatten_children_ordered(self.root_task, hide_collapsed=False, hide_archived=False)
 
     @property
     def viewed_ordered_tasks(self):
+        if self.snapshot is not None:
+            if self.has_filter:
+                return self._filter_tasks(self.snapshot.unarchived_tasks())
+            return self.snapshot.journal_tasks
+
         if self.has_filter:
             # We want to see collapsed children here
             all_tasks = self.flatten_children_ordered(self.root_task, hide_collapsed=False, hide_archived=True)
-            return [task for task in all_tasks if self._user_display_filter in task]
+            return self._filter_tasks(all_tasks)
         else:
             return self.flatten_children_ordered(self.root_task, hide_collapsed=True, hide_archived=True)
     
     @property
     def viewed_archived_ordered_tasks(self):
-        archived_tasks = [task for task in self.all_ordered_tasks if task.is_archived]
+        self.load_archive_segment()
+
+        if self.snapshot is not None:
+            archived_tasks = self.snapshot.archived_tasks
+            if self._archive_segment_ordered or self._rollup_ordered:
+                archived_tasks = [*archived_tasks, *self._archive_segment_ordered, *self._rollup_ordered]
+        else:
+            archived_tasks = [task for task in self.all_ordered_tasks if task.is_archived]
+            archived_tasks.extend(self._archive_segment_ordered)
+            archived_tasks.extend(self._rollup_ordered)
         if self.has_filter:
-            return [task for task in archived_tasks if self._user_display_filter in task]
+            return self._filter_tasks(archived_tasks)
         else:
             return archived_tasks
+
+    def _filter_tasks(self, tasks):
+        """Keep only the tasks that match the user's filter"""
+        user_filter = self._user_display_filter
+        assert user_filter is not None
+
+        if user_filter.filter_type != Filters.EXTRA_INFO:
+            return [task for task in tasks if user_filter in task]
+
+        # Notes are only loaded here (and only for tasks that have one)
+        with self._note_reader(tasks) as read_note:
+            return [task for task in tasks if re.match(user_filter.filter_content, read_note(task)) is not None]
+
+    @contextmanager
+    def _shelf_reader(self):
+        """Yield the shelf to read single keys from (None if it can't be opened).
+        When the workspace was opened from a snapshot, the shelf is opened read-only instead of being loaded"""
+        if self._shelve_file is not None:
+            yield self._shelve_file
+            return
+
+        try:
+            shelf = shelve.open(self._shelve_filename, flag="r", protocol=4)
+        except dbm.error:
+            yield None
+            return
+
+        with shelf:
+            yield shelf
+
+    @contextmanager
+    def _note_reader(self, tasks: Iterable[Task] = ()):
+        """Yield a function that loads the note of a task. tasks are the ones that will be read, for readers
+        that can load many notes at once"""
+        with self._shelf_reader() as shelf:
+            def read_note(task: Task) -> str:
+                if task.item_id in self._pending_notes:
+                    return self._pending_notes[task.item_id] or ""
+                if task.item_id in self._rollup_root_of:
+                    year, _ = self._rollup_root_of[task.item_id]
+                    return self._rollup_notes[year].get(task.item_id, "")
+                if shelf is None or not task.has_extra_info:
+                    return ""
+                return read_shelf_key_nocache(shelf, note_key(task.item_id), "")
+
+            yield read_note
+
+    def get_extra_info(self, task: Task) -> str:
+        """Load the note of the task"""
+        with self._note_reader() as read_note:
+            return read_note(task)
+
+    def set_extra_info(self, task: Task, extra_info: str):
+        """Store the note of the task. Empty notes are removed from the store"""
+        if task.item_id in self._rollup_by_id:
+            logging.error("Tasks in a yearly rollup are read-only. Restore the task to edit its extra info")
+            return
+
+        if self.history.recording:
+            self.history.record(SetNote(task.item_id, self.get_extra_info(task)))
+
+        if self._edit_base is not None:
+            # Written when the edit is merged
+            self._pending_notes[task.item_id] = extra_info if extra_info.strip() else None
+            task.extra_info_length = len(extra_info) if extra_info.strip() else 0
+            self.changed = True
+            return
+
+        assert self._shelve_file is not None
+        key = note_key(task.item_id)
+        if extra_info.strip():
+            write_shelf_key_nocache(self._shelve_file, key, extra_info)
+            task.extra_info_length = len(extra_info)
+        else:
+            if key in self._shelve_file:
+                del self._shelve_file[key]
+            task.extra_info_length = 0
+        self.changed = True
+
+    def _delete_notes(self, tasks: List[Task]):
+        for task in tasks:
+            if task.has_extra_info:
+                if self._edit_base is not None:
+                    self._pending_notes[task.item_id] = None
+                    continue
+
+                assert self._shelve_file is not None
+                key = note_key(task.item_id)
+                if key in self._shelve_file:
+                    del self._shelve_file[key]
+
+    def _notes_for_history(self, tasks: List[Task]):
+        """The notes of the tasks that are about to be deleted, so the deletion can be undone"""
+        if not self.history.recording:
+            return {}
+        with self._note_reader(tasks) as read_note:
+            return {task.item_id: read_note(task) for task in tasks if task.has_extra_info}
+
+    def _restore_notes(self, notes: dict[int, str]):
+        if self._edit_base is not None:
+            self._pending_notes.update(notes)
+        else:
+            self._store_notes(dict(notes))
     
     def is_valid_number(self, number: int):
         """Check if input is valid and corresponds to an item"""
@@ -295,35 +1234,52 @@ class Tasks(Shelveable):
 
     def change_item_importance(self, task: Task, new_importance: Importance):
         """Change task importance"""
-        task.importance = new_importance
-        self.changed = True
+        self.set_task_field(task, "importance", new_importance)
 
     def change_item_status(self, task: Task, new_status):
         """Change task status"""
-        task.status = new_status
-        self.changed = True
+        self.set_task_field(task, "status", new_status)
 
     def toggle_task_collapse(self, task: Task):
         """Toggle the collapse for the task"""
-        task.collapse = not task.collapse
-        self.changed = True
+        self.set_task_field(task, "collapse", not task.collapse)
 
     def toggle_item_privacy(self, task):
         """Toggle the privacy for the item with provided id"""
-        task.privacy = not task.privacy
-        self.changed = True
+        self.set_task_field(task, "privacy", not task.privacy)
 
     def _archive_task(self, task: Task):
-        task.archive_date = datetime.now()
-        self.changed = True
+        self.set_task_field(task, "archive_date", datetime.now())
 
     def _unarchive_task(self, task: Task):
-        task.archive_date = None
+        self.set_task_field(task, "archive_date", None)
+
+    def set_task_field(self, task: Task, field: str, value: Any):
+        """Change a field of a task ("stamps" for the stamps of its timer), so the change can be undone"""
+        if field == "archive_date" and value is None:
+            cold_root = self._archive_segment_root_of.get(task.item_id)
+            if cold_root is not None:
+                self._reattach_archived_subtree(cold_root)
+
+        if field == "stamps":
+            self.history.record_field(field, task.item_id, task.timer.stamps)
+            task.timer.stamps = value
+        else:
+            self.history.record_field(field, task.item_id, getattr(task, field))
+            setattr(task, field, value)
+        if field in AGGREGATED_FIELDS:
+            self.aggregates.task_changed(task)
         self.changed = True
 
     def archive_task(self, task_id: int, archive_children: bool):
         task_to_archive = self.get_task_by_id(task_id)
         assert isinstance(task_to_archive, Task), "Cannot archive root task"
+        self._archive_task_with_children(task_to_archive, self.get_task_by_id(task_to_archive.parent_id), archive_children)
+
+    def _archive_task_with_children(self, task_to_archive: Task, parent_task: Task|RootTask, archive_children: bool):
+        if self.history.recording and not task_to_archive.is_archived:
+            # Saving moves fully archived subtrees to the cold segment, and restoring them puts them last
+            self.history.record(MoveTask(task_to_archive.item_id, parent_task.item_id, parent_task.children.index(task_to_archive)))
 
         if archive_children:
             tasks_to_archive = self.flatten_children_ordered(task_to_archive, hide_collapsed=False, hide_archived=False)
@@ -341,33 +1297,124 @@ class Tasks(Shelveable):
 
         task_to_remove = self.get_task_by_id(task_id)
         assert isinstance(task_to_remove, Task), "Cannot delete root task"
+        self._delete_task(task_to_remove, self.get_task_by_id(task_to_remove.parent_id), delete_children)
+
+    def _delete_task(self, task_to_remove: Task, parent_task: Task|RootTask, delete_children: bool):
+        position = self._delete_task_from_parents(task_to_remove, strict=True, parent_task=parent_task)
+        if delete_children:
+            removed_tasks = [task_to_remove, *self.flatten_children_ordered(task_to_remove, hide_collapsed=False, hide_archived=False)]
+            adopted_ids = None
+        else:
+            removed_tasks = [task_to_remove]
+            adopted_ids = [child_task.item_id for child_task in task_to_remove.children]
+        self.history.record(InsertTask(task_to_remove, task_to_remove.parent_id, position,
+                                       self._notes_for_history(removed_tasks), adopted_ids))
 
-        self._delete_task_from_parents(task_to_remove, strict=True)        
+        # Archived subtrees in the cold segment that were under this task
+        for cold_root in self.archive_segment or []:
+            if cold_root.parent_id == task_to_remove.item_id:
+                cold_root.parent_id = task_to_remove.parent_id
+                self._archive_segment_changed = True
+
+        self._delete_notes(removed_tasks)
 
         for child_task in task_to_remove.children:
             if not delete_children:
-                self.update_parent(child_task, task_to_remove.parent_id, delete_from_parent=False)
+                self._attach_to_parent(child_task, parent_task)
             elif delete_children:
                 # No need to do anything here, because the parent's reference will go with the children
                 pass
-        
+        if not delete_children:
+            task_to_remove.children = []  # Kept by the undo history, which gives the children back to it
+
         self.changed = True
     
+    # Batched operations - the whole selection is changed under one lock and saved once
+
+    def change_items_status(self, tasks: List[Task], new_status: Status):
+        for task in tasks:
+            self.change_item_status(task, new_status)
+
+    def change_items_importance(self, tasks: List[Task], new_importance: Importance):
+        for task in tasks:
+            self.change_item_importance(task, new_importance)
+
+    def toggle_items_privacy(self, tasks: List[Task]):
+        for task in tasks:
+            self.toggle_item_privacy(task)
+
+    def toggle_tasks_collapse(self, tasks: List[Task]):
+        for task in tasks:
+            self.toggle_task_collapse(task)
+
+    def change_deadlines(self, tasks: List[Task], deadline_date: date|None):
+        for task in tasks:
+            self.change_deadline(task, deadline_date)
+
+    def reset_timers_for_tasks(self, tasks: List[Task]):
+        for task in tasks:
+            self.reset_timer_for_task(task)
+
+    def archive_tasks(self, tasks: List[Task], archive_children: bool):
+        tasks_by_id = self._tasks_by_id()
+        for task in tasks:
+            self._archive_task_with_children(task, tasks_by_id.get(task.parent_id) or self.get_task_by_id(task.parent_id),
+                                             archive_children)
+
+    def delete_tasks(self, tasks: List[Task], delete_children: bool):
+        if delete_children:
+            # Tasks under another selected task go away together with it
+            descendant_ids = {descendant.item_id for task in tasks
+                              for descendant in self.flatten_children_ordered(task, hide_collapsed=False, hide_archived=False)}
+            tasks = [task for task in tasks if task.item_id not in descendant_ids]
+
+        tasks_by_id = self._tasks_by_id()
+        for task in tasks:
+            self._delete_task(task, tasks_by_id.get(task.parent_id) or self.get_task_by_id(task.parent_id), delete_children)
+
+    def _tasks_by_id(self) -> dict[int, Task|RootTask]:
+        """The tasks of the tree by id, so a batch finds the parents of its tasks with a single walk of the tree
+        instead of one per task. Tasks of the cold segment and rollups are left to get_task_by_id"""
+        if self.snapshot is not None:
+            return {}  # get_task_by_id is already a binary search
+        tasks_by_id: dict[int, Task|RootTask] = {task.item_id: task for task in self.all_ordered_tasks}
+        tasks_by_id[0] = self.root_task
+        return tasks_by_id
+
     def rename_task(self, task: Task, new_name):
-        task.name = new_name
-        self.changed = True
+        self.set_task_field(task, "name", new_name)
 
-    def _delete_task_from_parents(self, task: Task, strict: bool = False):
-        parent_task = self.get_task_by_id(task.parent_id)
+    def _delete_task_from_parents(self, task: Task, strict: bool = False, parent_task: Task|RootTask|None = None):
+        """Returns the position the task had among the children of its parent"""
+        if parent_task is None:
+            parent_task = self.get_task_by_id(task.parent_id)
     
         if strict:
             assert task in parent_task.children, "Cannot find task in parent"
 
+        position = None
         if task in parent_task.children:
-            parent_task.children.remove(task)
+            self.aggregates.task_detached(task)
+            position = parent_task.children.index(task)
+            del parent_task.children[position]
         self.changed = True
+        return position
+
+    def subtree_aggregate(self, task: Task) -> SubtreeAggregate:
+        """Totals of the descendants of a task of the journal"""
+        if self.aggregates.generation != self.generation:
+            self.aggregates.clear(self.generation)  # Someone else saved, or we have a different version loaded
+
+        if self.snapshot is not None and task.item_id not in self._archive_segment_by_id \
+                and task.item_id not in self._rollup_by_id:
+            return self.aggregates.get_from_snapshot(self.snapshot, task)
+        return self.aggregates.get(task)
 
     def get_indent_count(self, task):
+        if self.snapshot is not None and task.item_id != 0 \
+                and task.item_id not in self._archive_segment_by_id and task.item_id not in self._rollup_by_id:
+            return self.snapshot.depth_of_row(self.snapshot.row_of_id(task.item_id)) + 1
+
         indent = 0
         while task.item_id != 0:
             indent += 1
@@ -379,6 +1426,15 @@ class Tasks(Shelveable):
         if task_id == 0:
             return self.root_task
 
+        if task_id in self._archive_segment_by_id:
+            return self._archive_segment_by_id[task_id]
+
+        if task_id in self._rollup_by_id:
+            return self._rollup_by_id[task_id]
+
+        if self.snapshot is not None:
+            return self.snapshot.materialize(self.snapshot.row_of_id(task_id))
+
         for task in self.all_ordered_tasks:
             if task.item_id == task_id:
                 return task 
@@ -386,20 +1442,69 @@ class Tasks(Shelveable):
 
     def update_parent(self, item: Task, new_parent_id: int, delete_from_parent: bool):
         if delete_from_parent:
-            self._delete_task_from_parents(item, strict=True)
+            position = self._delete_task_from_parents(item, strict=True)
+            self.history.record(MoveTask(item.item_id, item.parent_id, position))
 
-        item.parent_id = new_parent_id
-        parent_task = self.get_task_by_id(item.parent_id)
+        self._attach_to_parent(item, self.get_task_by_id(new_parent_id))
+
+    def _attach_to_parent(self, item: Task, parent_task: Task|RootTask):
+        item.parent_id = parent_task.item_id
         parent_task.children.append(item)
+        self.aggregates.task_attached(item, parent_task)
+        self.changed = True
+
+    def place_task(self, task: Task, current_parent: Task|RootTask, new_parent: Task|RootTask, position: int):
+        """Move a task to a position among the children of a parent (used by the undo history)"""
+        if task.item_id in self._archive_segment_by_id:
+            return  # Still in the cold segment, so it has no place in the tree
+
+        old_position = current_parent.children.index(task)
+        self.history.record(MoveTask(task.item_id, current_parent.item_id, old_position))
+        self.aggregates.task_detached(task)
+        del current_parent.children[old_position]
+        new_parent.children.insert(position, task)
+        task.parent_id = new_parent.item_id
+        self.aggregates.task_attached(task, new_parent)
+        self.changed = True
+
+    def insert_task(self, task: Task, parent: Task|RootTask, position: int|None, notes: dict[int, str], adopted: List[Task]|None):
+        """Put a deleted task back (used by the undo history). Without adopted children, its subtree comes back with it"""
+        self.history.record(RemoveTask(task.item_id, with_children=adopted is None))
+        task.parent_id = parent.item_id
+        parent.children.insert(len(parent.children) if position is None else position, task)
+        self.aggregates.task_attached(task, parent)
+        for child_task in adopted or []:
+            self.aggregates.task_detached(child_task)  # Already taken out of the parent it was moved to
+            child_task.parent_id = task.item_id
+            task.children.append(child_task)
+            self.aggregates.task_attached(child_task, task)
+        self._restore_notes(notes)
         self.changed = True
 
     def add_item(self, item: Task):
         parent_task = self.get_task_by_id(item.parent_id)
         parent_task.children.append(item)
+        self.aggregates.task_attached(item, parent_task)
+        self.history.record(RemoveTask(item.item_id, with_children=True))
+        self.changed = True
+
+    def add_subtrees(self, roots: List[Task], notes: dict[int, str]):
+        """Add whole subtrees at the root of the journal in one step (e.g. an import). Their ids must be
+        free, i.e. allocated from generate_id() on"""
+        assert self._shelve_file is not None
+        for root in roots:
+            root.parent_id = 0
+            self.history.record(RemoveTask(root.item_id, with_children=True))
+        self.task_tree.extend(roots)
+        for item_id, note in notes.items():
+            write_shelf_key_nocache(self._shelve_file, note_key(item_id), note)
         self.changed = True
 
     @property
     def has_active_timer(self):
+        if self.snapshot is not None:
+            return self.snapshot.running_timers > 0
+
         for item in self.all_ordered_tasks:
             if item.timer.is_counting:
                 return True
@@ -413,40 +1518,42 @@ class Tasks(Shelveable):
 
     def edit_and_display_extra_info(self, task: Task, stdscr: window):
         move_cursor_to_x_y(0, 0)
-        task.extra_info = prompt_toolkit.prompt(multiline=True, wrap_lines=True, default=task.extra_info, bottom_toolbar="Use ALTp+Enter to save the note")
+        holding_lock = self._edit_base is None  # Optimistic edits don't hold the lock while the note is edited
+        keep_lease_alive = self.heartbeat.running() if holding_lock else nullcontext()
+        with tracer.span("edit_and_display_extra_info", category="dialog"), keep_lease_alive:
+            extra_info = dialogs.prompt("note", "", multiline=True, wrap_lines=True, default=self.get_extra_info(task), bottom_toolbar="Use ALTp+Enter to save the note",
+                                        rprompt=(lambda: self.heartbeat.status) if holding_lock else None, refresh_interval=1)
         stdscr.keypad(True)
-        self.changed = True
+        self.set_extra_info(task, extra_info)
 
     def add_timestamp_for_task(self, task: Task):
         """Add a timestamp to this task"""
-        task.timer.stamps.append(int(time.time()))
-        self.changed = True
+        self.set_task_field(task, "stamps", [*task.timer.stamps, int(time.time())])
 
     def pause_all_other_timers(self, task: Task):
         """Add a timestamp to this task"""
         if task.timer.is_counting:
-            task.timer.stamps.append(int(time.time()))
+            self.set_task_field(task, "stamps", [*task.timer.stamps, int(time.time())])
         self.changed = True
 
     def reset_timer_for_task(self, task: Task):
         """Reset the timer for one of the tasks"""
-        task.timer.stamps = []
-        self.changed = True
+        self.set_task_field(task, "stamps", [])
 
     def change_deadline(self, task: Task, deadline_date: date|None):
         """Reset the timer for one of the tasks"""
-        task.deadline = deadline_date
-        self.changed = True
+        self.set_task_field(task, "deadline", deadline_date)
 
+    @tracer.traced(category="tree")
     def flatten_children_ordered(self, parent_task: Task|RootTask, hide_collapsed: bool = False, hide_archived: bool = True):
         """ This returns the task list ordered by which one will be displayed first """
         flattened_list: List[Task] = []
-        nodes_to_go_over = parent_task.children.copy()
+        nodes_to_go_over = parent_task.children[::-1]  # A stack, so the next node is popped from the end
         while nodes_to_go_over:
-            current_node = nodes_to_go_over.pop(0)
+            current_node = nodes_to_go_over.pop()
             
             if not (hide_collapsed and current_node.collapse):
-                nodes_to_go_over = current_node.children + nodes_to_go_over
+                nodes_to_go_over.extend(reversed(current_node.children))
             
             if hide_archived and current_node.is_archived:
                 continue 
@@ -485,13 +1592,18 @@ class Tasks(Shelveable):
 
         src_task_index_in_parent = src_task_parent.children.index(src_task)
         dst_task_index_in_parent = dst_task_parent.children.index(dst_task)
+        self.aggregates.task_detached(src_task)
+        self.aggregates.task_detached(dst_task)
         
         src_task_parent.children[src_task_index_in_parent] = dst_task
         dst_task_parent.children[dst_task_index_in_parent] = src_task
 
         src_task.parent_id = dst_task_parent.item_id
         dst_task.parent_id = src_task_parent.item_id
+        self.aggregates.task_attached(src_task, dst_task_parent)
+        self.aggregates.task_attached(dst_task, src_task_parent)
 
+        self.history.record(SwapTasks(src_task.item_id, dst_task.item_id))
         self.changed = True
 
     def move_task(self, src_task: Task, dest_task: Task|RootTask):
@@ -515,19 +1627,136 @@ class Tasks(Shelveable):
         
 
     def is_empty(self):
-        return len(self.all_ordered_tasks) == 0
+        if self.snapshot is not None:
+            return self.snapshot.row_count == 0
+        return not self.root_task.children
+
+    def save_if_needed_nolock(self):
+        super().save_if_needed_nolock()
+        self.history.end_action()  # What was recorded since the last save is one step of the history
+
+    def undo(self):
+        """Revert the last saved action. Called with the lock held, and saved like any other edit"""
+        self._replay(self.history.start_undo(), "Nothing to undo")
+
+    def redo(self):
+        self._replay(self.history.start_redo(), "Nothing to redo")
+
+    @tracer.traced(category="tree")
+    def _replay(self, action: Action|None, nothing_to_replay: str):
+        if action is None:
+            logging.warning(nothing_to_replay)
+            return
+
+        if self.is_outdated():
+            self.reload_nolock()  # Operations find their tasks by id, so they apply to the latest version as well
+        index = TaskIndex(self.root_task, self._find_task_outside_tree)
+        for operation in reversed(action.operations):
+            operation.apply(self, index)
+        if index.missing:
+            logging.warning(f"{index.missing} of the changed tasks were deleted or moved to a yearly rollup since, so they were left as they are")
+
+    def _find_task_outside_tree(self, item_id: int):
+        self.load_archive_segment()
+        return self._archive_segment_root_of.get(item_id)
+
+    def begin_optimistic_edit(self):
+        """Remember the revisions of the tasks, so an edit made without the lock can be merged later"""
+        self.load_shelve_if_needed_nolock()
+        self._edit_base = RevisionBase(self.root_task)
+        self._pending_notes = {}
+
+    def commit_optimistic_edit(self, stdscr: curses.window, screen: Screen):
+        """Take the lock just for merging and saving the edit made since begin_optimistic_edit"""
+        if not self.changed:
+            self._edit_base = None
+            return
+
+        if self.saver is not None and not self.saver.flush(timeout=global_config.LOCK_ACQUIRE_TIMEOUT.value):
+            logging.error("Previous changes are still being saved")
+
+        with try_to_lock_auto_unlock(stdscr, screen, self, load_shelve=False) as locked:
+            if locked:
+                self.commit_optimistic_edit_nolock()
+                return
+
+        logging.error("Could not take the lock to save your changes, so they were discarded")
+        self.discard_optimistic_edit()
+
+    def discard_optimistic_edit(self):
+        """Drop the edit made since begin_optimistic_edit, and load the file again"""
+        self.history.discard_action()
+        self._edit_base = None
+        self._pending_notes = {}
+        self._discard_loaded_shelf()
+        self.reopen_shelve_nolock()
+        self.aggregates.clear()  # Computed from the edited tasks, in the same generation
+        self.changed = False
+
+    @tracer.traced(category="storage")
+    def commit_optimistic_edit_nolock(self):
+        """Save the edit. If someone else saved the file since the edit started, the file is reloaded and the edit is
+        merged into it, skipping only the tasks that were changed there too"""
+        assert self._edit_base is not None
+        base, self._edit_base = self._edit_base, None
+        pending_notes, self._pending_notes = self._pending_notes, {}
+
+        if not self.is_outdated():
+            # Nobody saved in the meantime, so our tree is the latest one
+            for task in base.changed_tasks(self.root_task, set(pending_notes)):
+                task.revision += 1
+            self._store_notes(pending_notes)
+            self.changed = True
+        else:
+            changes = collect_changes(base, self.root_task, set(pending_notes))
+            self.reload_nolock()
+            result = self.apply_changes_nolock(changes, pending_notes)
+            if result.conflicts:
+                logging.error(f"Not saved, since another user changed them at the same time: {', '.join(result.conflicts)}")
+            if result.conflicts or result.id_changes:
+                # The operations no longer match what was saved (skipped tasks, or new tasks with other ids)
+                self.history.discard_action(keep_replayed=False)
+
+        self.save_if_needed_nolock()
+
+    def is_outdated(self):
+        """Whether someone else saved the file since it was loaded"""
+        assert self._shelve_file is not None
+        return read_shelf_key_nocache(self._shelve_file, "generation", 0) != self.generation
+
+    def apply_changes_nolock(self, changes: Changeset, notes: dict[int, str|None]) -> MergeResult:
+        """Apply an edit that was made on another copy of the tree, and store its notes (without saving)"""
+        result = apply_changes(changes, self.root_task, self.generate_id())
+        notes = {result.id_changes.get(item_id, item_id): note for item_id, note in notes.items()}
+        self._store_notes({item_id: note for item_id, note in notes.items() if item_id not in result.skipped_ids})
+        self.changed = True
+        return result
+
+    def _store_notes(self, notes: dict[int, str|None]):
+        assert self._shelve_file is not None
+        for item_id, note in notes.items():
+            key = note_key(item_id)
+            if note is not None:
+                write_shelf_key_nocache(self._shelve_file, key, note)
+            elif key in self._shelve_file:
+                del self._shelve_file[key]
 
     def generate_id(self):
-        """Generate a id for a new item. The id is generated as maximum of existing ids plus one"""
+        """Generate a id for a new item. The id is generated as maximum of existing ids plus one
+        (including the archived tasks in the cold segment)"""
+        max_id = self.archive_index["max_id"]
+        if self._archive_segment_by_id:
+            max_id = max(max_id, max(self._archive_segment_by_id))
         if self.is_empty():
-            return 1
-        return max([item.item_id for item in self.all_ordered_tasks]) + 1
+            return max_id + 1
+        return max(max_id, max([item.item_id for item in self.all_ordered_tasks])) + 1
 
 
 class Workspaces(Shelveable):
     def __init__(self, filename: Path | str, lockfile: Path | str):
         super().__init__(filename, lockfile)
         self.workspace_loaded: Workspace|None = None
+        self.manifests: dict[str, WorkspaceManifest] = {}
 
     def is_valid_number(self, number: int):
         return 0 <= number < len(self.workspaces)
@@ -539,8 +1768,12 @@ class Workspaces(Shelveable):
         if self.workspace_loaded == workspace:
             self.workspace_loaded = None
 
+        self._update_manifests_nolock(lambda manifests: manifests.pop(str(workspace.workspace_path), None))
+
         if delete_files:
-            for filepath in [f"{workspace.workspace_path}.db", workspace.workspace_lock]:
+            rollup_files = rollup_filenames_for(workspace.workspace_path).values()
+            for filepath in [f"{workspace.workspace_path}.db", workspace.workspace_lock, f"{workspace.workspace_lock}{FCNTL_LOCK_SUFFIX}",
+                             workspace.workspace_snapshot, *rollup_files]:
                 delete_path = Path(filepath)
                 try:
                     if delete_path.is_file():
@@ -559,4 +1792,30 @@ class Workspaces(Shelveable):
             shelf["workspaces"] = []
 
         self.workspaces: List[Workspace] = shelf["workspaces"]
+        # Read past the cache, so saving the list of workspaces never writes back manifests that were replaced since
+        self.manifests = read_shelf_key_nocache(shelf, MANIFESTS_KEY, {})
+
+    def store_manifest(self, manifest: WorkspaceManifest):
+        """Record the statistics of a workspace that was just saved. The manifest is only a cache,
+        so it is skipped if the list of workspaces stays locked"""
+        try:
+            self.lock(timeout=MANIFEST_LOCK_TIMEOUT)
+        except TimeOutError:
+            logging.warning("The list of workspaces is locked, so the statistics of the workspace were not updated")
+            return
+
+        try:
+            self._update_manifests_nolock(lambda manifests: manifests.__setitem__(manifest.workspace_path, manifest))
+        finally:
+            self.unlock()
+
+    def _update_manifests_nolock(self, update: Callable[[dict[str, WorkspaceManifest]], Any]):
+        """Change the manifests straight in the file, leaving the rest of the loaded shelf alone"""
+        key = MANIFESTS_KEY.encode()
+        with self._write_mutex, closing(dbm.open(str(self._shelve_filename), "c")) as db:
+            stored = db.get(key)
+            manifests = pickle.loads(stored) if stored is not None else {}
+            update(manifests)
+            db[key] = pickle.dumps(manifests, protocol=4)
+        self.manifests = manifests
         
\ No newline at end of file
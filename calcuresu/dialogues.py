@@ -1,23 +1,25 @@
 """ Module that controls interactions with the user, like questions and confirmations"""
 
+from contextlib import ExitStack, contextmanager
 import curses
 from datetime import datetime
 from email.errors import InvalidMultipartContentTransferEncodingDefect
 import logging
 from pathlib import Path
 import sys
+import time
 
-from prompt_toolkit.shortcuts import confirm
+from prompt_toolkit import PromptSession
+from prompt_toolkit.shortcuts import create_confirm_session
 
 from calcuresu.colors import Color
-from calcuresu.singletons import global_config
+from calcuresu.singletons import global_config, tracer
 from calcuresu.consts import Filters, Importance, Status
 
-import prompt_toolkit
 
 from calcuresu.screen import Screen
 from prompt_toolkit.completion import Completer, Completion, PathCompleter
-from prompt_toolkit.formatted_text import FormattedText
+from prompt_toolkit.formatted_text import FormattedText, merge_formatted_text
 
 from calcuresu.translations.en import MSG_TS_FILTER, MSG_TS_FILTER_EXTRA_INFO, MSG_TS_FILTER_NAME
 
@@ -42,8 +44,77 @@ def clear_line(stdscr, y, x=0):
     stdscr.addstr(y, x, " " * (x_max - x - 1), curses.color_pair(Color.EMPTY.value))
 
 
+@contextmanager
+def keep_leases_alive(screen: Screen):
+    """Keep refreshing the locks held by the current action while the user is in a prompt"""
+    with ExitStack() as stack:
+        for heartbeat in screen.held_leases:
+            stack.enter_context(heartbeat.running())
+        yield
 
-def input_string(stdscr: curses.window, screen: Screen, question, default="", placeholder: str|None=None, autocomplete: Completer|None=None, **kwargs):
+def lease_status(screen: Screen):
+    return " · ".join(heartbeat.status for heartbeat in screen.held_leases)
+
+
+class DialogPool:
+    """One prompt session per kind of dialog, reused for every question of that kind instead of building a new
+    application each time. Each kind keeps its own history, so the up arrow brings back earlier answers.
+    The time from asking until the dialog is drawn is traced as an "open <dialog>" span"""
+
+    # Sessions keep the options of their last question, so these are reset before every question
+    QUESTION_OPTIONS = {"placeholder": None, "bottom_toolbar": None, "rprompt": None, "refresh_interval": 0,
+                        "multiline": False, "wrap_lines": True}
+
+    def __init__(self):
+        self._sessions: dict[str, PromptSession] = {}
+        self._opening: tuple[str, int]|None = None  # Dialog that is being opened, and when it was asked for
+
+    def _session(self, dialog: str):
+        session = self._sessions.get(dialog)
+        if session is None:
+            if dialog == "confirm":
+                session = create_confirm_session("")
+            else:
+                session = PromptSession(reserve_space_for_menu=amount_of_rows_prompt_toolkit_takes)
+            session.app.after_render += self._opened
+            self._sessions[dialog] = session
+        return session
+
+    def _opened(self, _app):
+        if self._opening is not None:
+            dialog, start_ns = self._opening
+            self._opening = None
+            tracer.record(f"open {dialog}", "dialog", start_ns, time.perf_counter_ns())
+
+    def prompt(self, dialog: str, message, default="", completer: Completer|None = None, **options):
+        """Ask a question in the session of the dialog"""
+        session = self._session(dialog)
+        for option, value in {**self.QUESTION_OPTIONS, **options}.items():
+            setattr(session, option, value)
+        session.completer = completer
+        session.message = message
+
+        self._opening = (dialog, time.perf_counter_ns())
+        try:
+            return session.prompt(default=default)
+        finally:
+            self._opening = None
+
+    def confirm(self, question) -> bool:
+        session = self._session("confirm")
+        session.message = merge_formatted_text([question, " (y/n) "])
+        self._opening = ("confirm", time.perf_counter_ns())
+        try:
+            return session.prompt()
+        finally:
+            self._opening = None
+
+
+dialogs = DialogPool()
+
+
+@tracer.traced(category="dialog")
+def input_string(stdscr: curses.window, screen: Screen, question, default="", placeholder: str|None=None, autocomplete: Completer|None=None, dialog="text", **kwargs):
     """Ask user to input something and return it as a string"""
     move_cursor_to_input_position(stdscr)
 
@@ -53,8 +124,13 @@ def input_string(stdscr: curses.window, screen: Screen, question, default="", pl
         ])
     else:
         placeholder_formatted = None 
-    
-    answer = prompt_toolkit.prompt(message=question, default=default, reserve_space_for_menu=amount_of_rows_prompt_toolkit_takes, placeholder=placeholder_formatted, completer=autocomplete, **kwargs)
+
+    if screen.held_leases:
+        kwargs.setdefault("rprompt", lambda: lease_status(screen))
+        kwargs.setdefault("refresh_interval", 1)
+
+    with keep_leases_alive(screen):
+        answer = dialogs.prompt(dialog, question, default=default, placeholder=placeholder_formatted, completer=autocomplete, **kwargs)
     screen.next_need_refresh = True
     stdscr.refresh()
     stdscr.keypad(True)  # This is used for us to be able to use KEY_* again
@@ -64,12 +140,13 @@ def input_path(stdscr: curses.window, screen: Screen, question, default="", plac
     """Ask user to input something and return it as a string"""
     kwargs.pop("completer", None)  # Remove completer if we have one
     try:
-        return Path(input_string(stdscr, screen, question, default, placeholder, PathCompleter(expanduser=True)))
+        return Path(input_string(stdscr, screen, question, default, placeholder, path_completer, dialog="path"))
     finally:
         screen.next_need_refresh = True
 
 def input_integer(stdscr, screen: Screen, question, is_index=True, display_error=True, **kwargs):
     """Ask user for an integer number and check if it is an integer"""
+    kwargs.setdefault("dialog", "number")
     number = input_string(stdscr, screen, question, **kwargs)
     screen.next_need_refresh = True
     try:
@@ -82,6 +159,45 @@ def input_integer(stdscr, screen: Screen, question, is_index=True, display_error
         return None
     return number
 
+def parse_selection(selection: str, count: int):
+    """Parse a selection of item numbers like "3-40,52,60-" (1-based and inclusive, open ranges go to the edge)
+    into the sorted indexes it covers. Returns None if the selection is invalid"""
+    indexes: set[int] = set()
+    for part in selection.replace(" ", "").split(","):
+        if not part:
+            continue
+
+        start, separator, end = part.partition("-")
+        try:
+            first = int(start) if start else 1
+            last = (int(end) if end else count) if separator else first
+        except ValueError:
+            return None
+
+        if not 1 <= first <= last <= count:
+            return None
+        indexes.update(range(first - 1, last))
+
+    return sorted(indexes)
+
+def input_selection(stdscr, screen: Screen, question, count: int, marked_indexes: list[int]|None = None):
+    """Ask user for the numbers of one or more items (see parse_selection).
+    An empty answer selects the marked items, if there are any"""
+    placeholder = "e.g. 3-40,52,60-"
+    if marked_indexes:
+        placeholder = f"Leave empty for the {len(marked_indexes)} marked tasks, or {placeholder}"
+
+    answer = input_string(stdscr, screen, question, placeholder=placeholder, dialog="selection")
+    screen.next_need_refresh = True
+    if not answer.strip():
+        return marked_indexes or None
+
+    indexes = parse_selection(answer, count)
+    if not indexes:
+        logging.warning("Incorrect selection input.")
+        return None
+    return indexes
+
 def input_filter_content(stdscr, screen: Screen, filter_chosen: Filters):
     match filter_chosen:
         case Filters.NAME | Filters.EXTRA_INFO:
@@ -91,7 +207,7 @@ def input_filter_content(stdscr, screen: Screen, filter_chosen: Filters):
                 msg = MSG_TS_FILTER_EXTRA_INFO
             else:
                 raise Exception("Invalid filter chosen")
-            filter_content = input_string(stdscr, screen, msg)
+            filter_content = input_string(stdscr, screen, msg, dialog="filter text")
         case Filters.STATUS:
             filter_content = input_status(stdscr, screen)
         case Filters.IMPORTANCE:
@@ -109,7 +225,7 @@ def input_filter_field(stdscr, screen: Screen, question, **kwargs):
 
     kwargs["bottom_toolbar"] = question_str
     display_error = kwargs.pop("display_error", True)
-    number = input_integer(stdscr, screen, MSG_TS_FILTER, is_index=False, display_error=display_error, **kwargs)
+    number = input_integer(stdscr, screen, MSG_TS_FILTER, is_index=False, display_error=display_error, dialog="filter", **kwargs)
     screen.next_need_refresh = True
     if number is None:
         return None
@@ -129,7 +245,7 @@ def input_status(stdscr, screen: Screen):
         question.append(f"{status_enum.value}={status_enum.name}")
     question_str = ", ".join(question)
     question_str += " : " 
-    number = input_integer(stdscr, screen, "New task status: ",  is_index=False, bottom_toolbar=question_str)
+    number = input_integer(stdscr, screen, "New task status: ",  is_index=False, bottom_toolbar=question_str, dialog="status")
     screen.next_need_refresh = True
     try:
         return Status(number)
@@ -142,7 +258,7 @@ def input_importance(stdscr, screen: Screen):
     bottom_toolbar = "Optional - can be deferred, Low - nice to have, Medium - far future, High - near future, Critical - ASAP" 
 
     question_str = "Undecided (0), Optional (1-2), Low (3-4), Medium (5-6), High (7-8), Critical (9-10): " 
-    number = input_integer(stdscr, screen, question_str, is_index=False, bottom_toolbar=bottom_toolbar)
+    number = input_integer(stdscr, screen, question_str, is_index=False, bottom_toolbar=bottom_toolbar, dialog="importance")
     screen.next_need_refresh = True
     try:
         return Importance(number)
@@ -152,7 +268,7 @@ def input_importance(stdscr, screen: Screen):
 
 def input_date(stdscr, screen: Screen, prompt_string):
     """Ask user to input date in YYYY/MM/DD format and check if it was a valid entry"""
-    date_unformatted = input_string(stdscr, screen, prompt_string)
+    date_unformatted = input_string(stdscr, screen, prompt_string, dialog="date")
     screen.next_need_refresh = True
     try:
         return datetime.strptime(date_unformatted, r'%Y/%m/%d').date()
@@ -161,6 +277,7 @@ def input_date(stdscr, screen: Screen, prompt_string):
         return None
 
 amount_of_rows_prompt_toolkit_takes = 4
+path_completer = PathCompleter(expanduser=True)
 
 def move_cursor_to_x_y(x: int, y: int):
     sys.stdout.write(f'\033[{x};{y}H')
@@ -177,13 +294,15 @@ def move_cursor_to_input_position(stdscr: curses.window):
     #   and to the first character
     move_cursor_to_x_y(rows - amount_of_rows_prompt_toolkit_takes - extra_space, 0)
 
+@tracer.traced(category="dialog")
 def ask_confirmation(stdscr: curses.window, screen: Screen, question):
     """Ask user confirmation for an action"""
 
     move_cursor_to_input_position(stdscr)
     screen.next_need_refresh = True
     try:
-        return confirm(message=question)
+        with keep_leases_alive(screen):
+            return dialogs.confirm(question)
     finally:
         stdscr.keypad(True)  # This is used for us to be able to use KEY_* again
 
@@ -0,0 +1,78 @@
+"""Module with the event loop that the main loop sleeps in until there is something to react to"""
+
+import asyncio
+import curses
+from enum import Enum
+import os
+import signal
+import sys
+
+
+class Event(Enum):
+    INPUT = 0
+    RESIZE = 1
+    TIMEOUT = 2
+    FILE_CHANGED = 3
+    SEARCH_RESULTS = 4
+
+
+class EventLoop:
+    """Waits for key presses, terminal resizes, deadlines and changes of the loaded workspaces, so an idle
+    session doesn't use the CPU. The asyncio loop only runs while the main loop waits, which leaves the
+    prompts free to run their own"""
+
+    def __init__(self, input_fd: int):
+        self._loop = asyncio.new_event_loop()
+        self._events: set[Event] = set()
+        self._wakeup: asyncio.Future | None = None
+        self._loop.add_reader(input_fd, self._set, Event.INPUT)
+
+    def _set(self, event: Event):
+        self._events.add(event)
+        if self._wakeup is not None and not self._wakeup.done():
+            self._wakeup.set_result(None)
+
+    def _check_size(self):
+        """Tell curses about a new terminal size. Checked on every wait too, since the prompts handle
+        the resizes that happen while they are open themselves"""
+        try:
+            columns, lines = os.get_terminal_size(sys.__stdout__.fileno())
+        except (OSError, ValueError):
+            return
+        if lines > 0 and columns > 0 and (lines, columns) != (curses.LINES, curses.COLS):
+            curses.resizeterm(lines, columns)
+            self._set(Event.RESIZE)
+
+    def notify(self, event: Event):
+        """Wake the main loop up from any thread"""
+        if not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._set, event)
+
+    def notify_file_changed(self):
+        self.notify(Event.FILE_CHANGED)
+
+    def notify_search_results(self):
+        self.notify(Event.SEARCH_RESULTS)
+
+    def wait(self, timeout: float | None = None) -> set[Event]:
+        """Sleep until something happens, or until the timeout (in seconds) passes"""
+        self._check_size()
+        if not self._events:
+            if hasattr(signal, "SIGWINCH"):
+                # Installed again every time, since the prompts replace the handler with their own
+                self._loop.add_signal_handler(signal.SIGWINCH, self._check_size)
+
+            self._wakeup = self._loop.create_future()
+            deadline = self._loop.call_later(timeout, self._set, Event.TIMEOUT) if timeout is not None else None
+            try:
+                self._loop.run_until_complete(self._wakeup)
+            finally:
+                if deadline is not None:
+                    deadline.cancel()
+                self._wakeup = None
+
+        events, self._events = self._events, set()
+        return events
+
+    def close(self):
+        self._loop.close()
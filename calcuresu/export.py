@@ -0,0 +1,195 @@
+"""Module that exports a workspace to JSON Lines, CSV or a Markdown outline.
+
+Tasks are streamed in display order and written one at a time, so the output is never built in memory.
+The workspace is opened read-only. When it has a fresh snapshot, rows are read from the memory-mapped
+snapshot instead of unpickling the task tree. Without one, the whole task tree is unpickled first, so the
+export needs about as much memory as opening the workspace. Archived subtrees that were moved out of the
+tree are exported last, one archive chunk at a time, followed by the yearly rollups, one year at a time.
+"""
+
+import csv
+import json
+import os
+from pathlib import Path
+import shelve
+import sys
+from typing import Iterable, Iterator, List, TextIO, Tuple
+
+from calcuresu.classes.task import Task
+from calcuresu.consts import Status
+from calcuresu.data import ARCHIVE_INDEX_KEY, note_key
+from calcuresu.rollup import read_rollup, rollup_filenames_for
+from calcuresu.snapshot import Snapshot, snapshot_filename_for
+
+
+class ExportedTask:
+    """A task on its way out, with its place in the tree"""
+
+    def __init__(self, task: Task, depth: int, note: str, detached: bool = False) -> None:
+        self.task = task
+        self.depth = depth  # Detached subtrees count from their own root
+        self.note = note
+        self.detached = detached  # Part of an archived subtree that was moved out of the task tree
+
+    @property
+    def timer_seconds(self):
+        return round(self.task.timer.total_seconds)
+
+
+def walk_tree(roots: Iterable[Task]) -> Iterator[Tuple[Task, int]]:
+    """Go over the subtrees in display order, yielding (task, depth). Only the path to the current
+    task is kept, so it doesn't copy the tree"""
+    stack = [iter(roots)]
+    while stack:
+        task = next(stack[-1], None)
+        if task is None:
+            stack.pop()
+            continue
+
+        yield task, len(stack) - 1
+        if task.children:
+            stack.append(iter(task.children))
+
+
+def iter_workspace(workspace_path: str) -> Iterator[ExportedTask]:
+    """Stream every task of a workspace, archived ones included. Without a fresh snapshot, the task tree is loaded whole"""
+    with shelve.open(workspace_path, flag="r", protocol=4) as shelf:
+        generation = shelf.get("generation", None)
+
+        def note_of(task: Task):
+            if task.legacy_extra_info is not None:
+                return task.legacy_extra_info
+            return shelf.get(note_key(task.item_id), "") if task.has_extra_info else ""
+
+        snapshot = Snapshot.open_if_fresh(snapshot_filename_for(workspace_path), generation) \
+            if generation is not None else None
+        if snapshot is not None:
+            try:
+                for row in range(snapshot.row_count):
+                    task = snapshot.read_row(row)
+                    yield ExportedTask(task, snapshot.depth_of_row(row), note_of(task))
+            finally:
+                snapshot.close()
+        else:
+            for task, depth in walk_tree(shelf.get("task_tree", [])):
+                yield ExportedTask(task, depth, note_of(task))
+
+        for chunk_key in shelf.get(ARCHIVE_INDEX_KEY, {"chunks": []})["chunks"]:
+            for task, depth in walk_tree(shelf.get(chunk_key, [])):
+                yield ExportedTask(task, depth, note_of(task), detached=True)
+
+        for filename in rollup_filenames_for(workspace_path).values():
+            roots, notes = read_rollup(filename)  # The notes of rolled up tasks are in the rollup, not in the workspace
+            for task, depth in walk_tree(roots):
+                note = task.legacy_extra_info if task.legacy_extra_info is not None else notes.get(task.item_id, "")
+                yield ExportedTask(task, depth, note, detached=True)
+            del roots, notes  # Only one year is kept in memory
+
+        if shelf.get("generation", None) != generation:
+            print(f"{workspace_path} was saved during the export, so the export may mix both versions", file=sys.stderr)
+
+
+def write_jsonl(exported_tasks: Iterable[ExportedTask], output: TextIO):
+    """One JSON object per task, in the same form as the workspace server (without the children)"""
+    for exported in exported_tasks:
+        task = exported.task
+        data = task.to_dict(with_children=False)
+        data.update({
+            "depth": exported.depth,
+            "archived": task.is_archived,
+            "timer_seconds": exported.timer_seconds,
+            "timer_running": task.timer.is_counting,
+            "note": exported.note,
+        })
+        output.write(json.dumps(data, ensure_ascii=False) + "\n")
+
+
+CSV_COLUMNS = ["id", "parent_id", "depth", "name", "status", "importance", "privacy", "collapse", "deadline",
+               "archived", "archive_date", "timer_seconds", "timer_running", "note"]
+
+
+def write_csv(exported_tasks: Iterable[ExportedTask], output: TextIO):
+    writer = csv.writer(output)
+    writer.writerow(CSV_COLUMNS)
+    for exported in exported_tasks:
+        task = exported.task
+        writer.writerow([
+            task.item_id,
+            task.parent_id,
+            exported.depth,
+            task.name,
+            task.status.name,
+            task.importance.name,
+            task.privacy,
+            task.collapse,
+            task.deadline.isoformat() if task.deadline is not None else "",
+            task.is_archived,
+            task.archive_date.isoformat(timespec="seconds") if task.archive_date is not None else "",
+            exported.timer_seconds,
+            task.timer.is_counting,
+            exported.note,
+        ])
+
+
+def write_markdown(exported_tasks: Iterable[ExportedTask], output: TextIO):
+    """A nested checklist. Archived subtrees that were moved out of the tree are listed under their own heading"""
+    in_archive = False
+    output.write("# Tasks\n\n")
+    for exported in exported_tasks:
+        task = exported.task
+        if exported.detached and not in_archive:
+            output.write("\n# Archive\n\n")
+            in_archive = True
+
+        details: List[str] = [task.status.name.lower()]
+        if task.importance.value:
+            details.append(task.importance.name.lower())
+        if task.deadline is not None:
+            details.append(f"due {task.deadline.isoformat()}")
+        if task.timer.is_started:
+            details.append(f"timer {task.timer.passed_time}{' (running)' if task.timer.is_counting else ''}")
+        if task.is_archived:
+            details.append(f"archived {task.archive_date.strftime('%Y-%m-%d') if task.archive_date else ''}".strip())
+
+        indent = "  " * exported.depth
+        checkbox = "[x]" if task.status == Status.DONE else "[ ]"
+        output.write(f"{indent}- {checkbox} {task.name} ({', '.join(details)})\n")
+        for line in exported.note.splitlines():
+            output.write(f"{indent}  > {line}\n")
+
+
+EXPORT_FORMATS = {"jsonl": write_jsonl, "csv": write_csv, "markdown": write_markdown}
+EXPORT_EXTENSIONS = {".jsonl": "jsonl", ".json": "jsonl", ".csv": "csv", ".md": "markdown"}
+
+
+def export_workspace(arguments: List[str], export_format: str|None, output_path: str|None) -> int:
+    """Export a workspace from the command line, to a file (written atomically) or to stdout"""
+    if len(arguments) != 1:
+        print("Usage: calcuresu export [--format=jsonl|csv|markdown] [--output=<file>] <workspace_path>")
+        return 1
+
+    workspace_path = arguments[0]
+    if not Path(workspace_path).is_file():
+        print(f"{workspace_path}: no such workspace")
+        return 1
+
+    if export_format is None:
+        export_format = EXPORT_EXTENSIONS.get(Path(output_path).suffix.lower(), "jsonl") if output_path else "jsonl"
+    if export_format not in EXPORT_FORMATS:
+        print(f"Unknown format '{export_format}', expected one of: {', '.join(EXPORT_FORMATS)}")
+        return 1
+    write = EXPORT_FORMATS[export_format]
+
+    if output_path is None or output_path == "-":
+        write(iter_workspace(workspace_path), sys.stdout)
+        return 0
+
+    temp_path = f"{output_path}.tmp"
+    try:
+        with open(temp_path, "w", encoding="utf-8", newline="") as output:
+            write(iter_workspace(workspace_path), output)
+        os.replace(temp_path, output_path)
+    except BaseException:
+        Path(temp_path).unlink(missing_ok=True)
+        raise
+    return 0
@@ -0,0 +1,265 @@
+"""Module that imports tasks into a workspace from JSON Lines, CSV or todo.txt files.
+
+The whole file is read into detached subtrees first, so a broken line aborts the import before anything
+is written. The new tasks then get one block of ids, and are attached to the workspace with a single
+lock and a single save. Parents are linked through a map of the ids used in the file, so the cost is
+linear in the number of imported tasks.
+"""
+
+import csv
+from datetime import date, datetime
+import json
+from pathlib import Path
+import re
+import time
+from typing import Iterator, List, TextIO, Tuple
+
+from flufl.lock import TimeOutError
+
+from calcuresu.classes.task import Task
+from calcuresu.classes.workspace import Workspace
+from calcuresu.consts import Importance, Status
+from calcuresu.data import Tasks, Workspaces
+from calcuresu.singletons import global_config
+
+
+class ImportedRecord:
+    """A task read from the file, before it gets its id"""
+
+    def __init__(self, line_number: int, task: Task, source_id: str|None, source_parent_id: str|None, note: str) -> None:
+        self.line_number = line_number
+        self.task = task
+        self.source_id = source_id  # Ids of the file, only used to find the parents
+        self.source_parent_id = source_parent_id
+        self.note = note
+
+
+def _parse_enum(enum_type, value, default):
+    if value in [None, ""]:
+        return default
+    try:
+        if isinstance(value, int) or (isinstance(value, str) and value.isdigit()):
+            return enum_type(int(value))
+        return enum_type[str(value).upper()]
+    except KeyError:
+        raise ValueError(f"unknown {enum_type.__name__.lower()} '{value}'")
+
+
+def _parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ["true", "1", "yes", "x"]
+
+
+def _parse_deadline(value):
+    if value in [None, "", 0]:
+        return None
+    if isinstance(value, int):
+        return date.fromordinal(value)  # As written by the JSON Lines export
+    return date.fromisoformat(value)
+
+
+def _parse_archive_date(value):
+    if value in [None, "", 0]:
+        return None
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value)
+    return datetime.fromisoformat(value)
+
+
+def _stamps_for_seconds(seconds):
+    """A paused timer that ran for the given time (CSV only has the total)"""
+    if not seconds:
+        return []
+    now = int(time.time())
+    return [now - int(float(seconds)), now]
+
+
+def _build_task(data: dict, stamps: list) -> Task:
+    task = Task(0, str(data["name"]), _parse_enum(Status, data.get("status"), Status.NOT_STARTED), stamps,
+                _parse_bool(data.get("privacy", False)), parent_id=0,
+                importance=_parse_enum(Importance, data.get("importance"), Importance.UNDECIDED),
+                collapse=_parse_bool(data.get("collapse", False)))
+    task.deadline = _parse_deadline(data.get("deadline"))
+    task.archive_date = _parse_archive_date(data.get("archive_date"))
+    return task
+
+
+def _optional_id(value):
+    return None if value in [None, "", 0, "0"] else str(value)
+
+
+def read_jsonl(input_file: TextIO) -> Iterator[ImportedRecord]:
+    """One object per line, as written by `calcuresu export`. Only "name" is required. Objects may also
+    nest their subtasks under "children" (like the workspace server sends them)"""
+    for line_number, line in enumerate(input_file, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield from _records_from_object(line_number, json.loads(line), None)
+        except (ValueError, TypeError) as e:
+            raise ValueError(f"line {line_number}: {e}") from e
+        except KeyError as e:
+            raise ValueError(f"line {line_number}: missing {e}") from e
+
+
+def _records_from_object(line_number: int, data: dict, parent_source_id: str|None) -> Iterator[ImportedRecord]:
+    stack = [(data, parent_source_id)]
+    while stack:
+        data, parent_source_id = stack.pop()
+        task = _build_task(data, [float(stamp) for stamp in data.get("stamps", [])]
+                           or _stamps_for_seconds(data.get("timer_seconds")))
+        source_id = _optional_id(data.get("id"))
+        if source_id is None and data.get("children"):
+            source_id = f"line {line_number} #{id(data)}"  # The children still need to find it
+        yield ImportedRecord(line_number, task, source_id,
+                             parent_source_id if parent_source_id is not None else _optional_id(data.get("parent_id")),
+                             data.get("note") or "")
+        stack.extend((child, source_id) for child in reversed(data.get("children", [])))
+
+
+def read_csv(input_file: TextIO) -> Iterator[ImportedRecord]:
+    """A header line and one task per row, with the columns of `calcuresu export` (only "name" is required)"""
+    reader = csv.DictReader(input_file)
+    if reader.fieldnames is None or "name" not in reader.fieldnames:
+        raise ValueError("line 1: the header has no 'name' column")
+
+    for row in reader:
+        try:
+            yield ImportedRecord(reader.line_num, _build_task(row, _stamps_for_seconds(row.get("timer_seconds"))),
+                                 _optional_id(row.get("id")), _optional_id(row.get("parent_id")), row.get("note") or "")
+        except ValueError as e:
+            raise ValueError(f"line {reader.line_num}: {e}") from e
+
+
+# (A) is the most important priority of todo.txt
+TODO_TXT_IMPORTANCE = {"A": Importance.CRITICAL_1, "B": Importance.HIGH_1, "C": Importance.MEDIUM_1, "D": Importance.LOW_1}
+TODO_TXT_REGEX = re.compile(r"^(?P<done>x )?(?:\((?P<priority>[A-Z])\) )?(?:(?:\d{4}-\d{2}-\d{2}) ){0,2}(?P<text>.*)$")
+TODO_TXT_DUE_REGEX = re.compile(r"(?:^|\s)due:(\d{4}-\d{2}-\d{2})(?=\s|$)")
+TODO_TXT_PROJECT_REGEX = re.compile(r"(?:^|\s)\+(\S+)")
+
+
+def read_todotxt(input_file: TextIO) -> Iterator[ImportedRecord]:
+    """One task per line in the todo.txt format. Tasks are grouped under a task for their first +project"""
+    projects: set[str] = set()
+    for line_number, line in enumerate(input_file, start=1):
+        line = line.strip()
+        if not line:
+            continue
+
+        match = TODO_TXT_REGEX.match(line)
+        assert match is not None  # The text group matches anything
+        text = match.group("text")
+        task = Task(0, "", Status.DONE if match.group("done") else Status.NOT_STARTED, [], False, parent_id=0,
+                    importance=TODO_TXT_IMPORTANCE.get(match.group("priority") or "",
+                                                       Importance.OPTIONAL_1 if match.group("priority") else Importance.UNDECIDED))
+
+        due = TODO_TXT_DUE_REGEX.search(text)
+        if due is not None:
+            try:
+                task.deadline = date.fromisoformat(due.group(1))
+            except ValueError as e:
+                raise ValueError(f"line {line_number}: {e}") from e
+            text = TODO_TXT_DUE_REGEX.sub("", text)
+        task.name = text.strip()
+
+        project = TODO_TXT_PROJECT_REGEX.search(text)
+        project_id = f"+{project.group(1)}" if project is not None else None
+        if project_id is not None and project_id not in projects:
+            projects.add(project_id)
+            yield ImportedRecord(line_number, Task(0, project_id, Status.NOT_STARTED, [], False, parent_id=0),
+                                 project_id, None, "")
+        yield ImportedRecord(line_number, task, None, project_id, "")
+
+
+IMPORT_FORMATS = {"jsonl": read_jsonl, "csv": read_csv, "todotxt": read_todotxt}
+IMPORT_EXTENSIONS = {".jsonl": "jsonl", ".json": "jsonl", ".csv": "csv", ".txt": "todotxt"}
+
+
+def build_subtrees(records: List[ImportedRecord], first_id: int) -> Tuple[List[Task], dict[int, str]]:
+    """Give the records the ids first_id, first_id + 1, ... and link them to their parents.
+    Records whose parent is not in the file become roots. Returns the roots and the notes by new id"""
+    by_source_id: dict[str, Task] = {}
+    for offset, record in enumerate(records):
+        record.task.item_id = first_id + offset
+        if record.source_id is not None:
+            if record.source_id in by_source_id:
+                raise ValueError(f"line {record.line_number}: the id {record.source_id} is used twice")
+            by_source_id[record.source_id] = record.task
+
+    roots: List[Task] = []
+    notes: dict[int, str] = {}
+    for record in records:
+        parent = by_source_id.get(record.source_parent_id) if record.source_parent_id is not None else None
+        if parent is None or parent is record.task:
+            roots.append(record.task)
+        else:
+            record.task.parent_id = parent.item_id
+            parent.children.append(record.task)
+
+        if record.note.strip():
+            notes[record.task.item_id] = record.note
+            record.task.extra_info_length = len(record.note)
+
+    _check_for_cycles(roots, len(records))
+    return roots, notes
+
+
+def _check_for_cycles(roots: List[Task], count: int):
+    """Parents that point at each other are never reached from a root"""
+    reached = 0
+    stack = list(roots)
+    while stack:
+        task = stack.pop()
+        reached += 1
+        stack.extend(task.children)
+    if reached != count:
+        raise ValueError(f"{count - reached} tasks are their own ancestors (their parent ids form a cycle)")
+
+
+def import_tasks(arguments: List[str], import_format: str|None) -> int:
+    """Import a file into a workspace from the command line. Either every task is imported or none"""
+    if len(arguments) != 2:
+        print("Usage: calcuresu import [--format=jsonl|csv|todotxt] <workspace_path> <file>")
+        return 1
+
+    workspace_path, input_path = arguments
+    if not Path(workspace_path).is_file():
+        print(f"{workspace_path}: no such workspace (add it in the workspace manager first)")
+        return 1
+
+    if import_format is None:
+        import_format = IMPORT_EXTENSIONS.get(Path(input_path).suffix.lower(), "jsonl")
+    if import_format not in IMPORT_FORMATS:
+        print(f"Unknown format '{import_format}', expected one of: {', '.join(IMPORT_FORMATS)}")
+        return 1
+
+    try:
+        with open(input_path, encoding="utf-8", newline="") as input_file:
+            records = list(IMPORT_FORMATS[import_format](input_file))
+    except (OSError, ValueError) as e:
+        print(f"{input_path}: {e}")
+        return 1
+
+    user_tasks = Tasks.from_workspace(Workspace(workspace_path))
+    user_tasks.registry = Workspaces(global_config.WORKSPACES_FILE.value, global_config.WORKSPACES_LOCK_FILE.value)
+    try:
+        user_tasks.lock(timeout=None)
+    except TimeOutError:
+        print(f"{workspace_path}: another user is editing it, try again later")
+        return 1
+
+    try:
+        user_tasks.load_shelve_if_needed_nolock()
+        try:
+            roots, notes = build_subtrees(records, user_tasks.generate_id())
+        except ValueError as e:
+            print(f"{input_path}: {e}")
+            return 1
+        user_tasks.add_subtrees(roots, notes)
+        user_tasks.write_loaded_state_nolock()
+    finally:
+        user_tasks.cleanup()  # Also unlocks, and drops the loaded state if the import was aborted
+
+    print(f"{workspace_path}: imported {len(records)} tasks")
+    return 0
@@ -0,0 +1,286 @@
+"""Module with the lock files that keep several processes (and computers) from editing a shelf at the same time"""
+
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import functools
+import logging
+import os
+from pathlib import Path
+import socket
+import threading
+import time
+from typing import Callable
+
+from flufl.lock import Lock, LockState, TimeOutError
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+FCNTL_LOCK_SUFFIX = ".flock"
+
+# File systems that are only used by this computer. On any other file system (network, FUSE, ...) only the
+# flufl lock is safe
+LOCAL_FILESYSTEMS = {
+    "ext2", "ext3", "ext4", "xfs", "btrfs", "bcachefs", "f2fs", "jfs", "reiserfs", "zfs", "tmpfs", "ramfs",
+    "apfs", "hfs", "hfsplus", "ufs",
+}
+
+
+class LockBackend(ABC):
+    """Interface of the lock of a shelf file"""
+
+    def __init__(self, lock_filename: Path | str, lifetime: timedelta, default_timeout: timedelta):
+        self.lock_filename = str(lock_filename)
+        self.lifetime = lifetime
+        self.default_timeout = default_timeout
+        self.hostname = socket.gethostname()
+
+    @abstractmethod
+    def lock(self, timeout: timedelta | int | None = None):
+        """Take the lock, waiting up to the timeout (the default timeout if None). Raises TimeOutError"""
+
+    @abstractmethod
+    def unlock(self):
+        """Release the lock if we hold it"""
+
+    @abstractmethod
+    def refresh(self):
+        """Push the expiration of the lock we hold forward"""
+
+    @abstractmethod
+    def break_lock(self) -> bool:
+        """Break someone else's lock. Returns False if it can't be broken"""
+
+    @property
+    @abstractmethod
+    def state(self) -> LockState:
+        pass
+
+    @property
+    @abstractmethod
+    def details(self) -> tuple[str, int, str]:
+        """Hostname and pid of the holder, and the lock file"""
+
+    @property
+    @abstractmethod
+    def expiration(self) -> datetime:
+        pass
+
+
+class FluflLockBackend(LockBackend):
+    """NFS-safe lock made of hard links. It expires after its lifetime, so a crashed holder can be broken"""
+
+    def __init__(self, lock_filename: Path | str, lifetime: timedelta, default_timeout: timedelta):
+        super().__init__(lock_filename, lifetime, default_timeout)
+        self._lock = Lock(self.lock_filename, lifetime=lifetime, default_timeout=default_timeout)
+        self.hostname = self._lock.hostname
+
+    def lock(self, timeout: timedelta | int | None = None):
+        self._lock.lock(timeout)
+
+    def unlock(self):
+        self._lock.unlock(unconditionally=True)
+
+    def refresh(self):
+        self._lock.refresh(unconditionally=True)
+
+    def break_lock(self):
+        self._lock._break()
+        return True
+
+    @property
+    def state(self):
+        return self._lock.state
+
+    @property
+    def details(self):
+        return self._lock.details
+
+    @property
+    def expiration(self):
+        return self._lock.expiration
+
+
+class FcntlLockBackend(LockBackend):
+    """flock() lock for local file systems. Taking and releasing it are single system calls, and the kernel releases it
+    when the holder dies, so it never expires. It is held by the open file description (like an OFD lock),
+    so every instance excludes the others - even inside of the same process"""
+
+    RETRY_INTERVAL = 0.01  # Seconds between attempts while someone else holds the lock
+
+    def __init__(self, lock_filename: Path | str, lifetime: timedelta, default_timeout: timedelta):
+        super().__init__(f"{lock_filename}{FCNTL_LOCK_SUFFIX}", lifetime, default_timeout)
+        self._fd: int | None = None
+        self._locked = False
+        self._owner = f"{self.hostname}|{os.getpid()}".encode()
+
+    def __del__(self):
+        if self._fd is not None:
+            os.close(self._fd)
+
+    def _file_descriptor(self):
+        if self._fd is None:
+            self._fd = os.open(self.lock_filename, os.O_RDWR | os.O_CREAT, 0o644)
+        return self._fd
+
+    def _try_lock(self, fd: int):
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            return False
+
+    def lock(self, timeout: timedelta | int | None = None):
+        if self._locked:
+            return
+
+        if timeout is None:
+            timeout = self.default_timeout
+        timeout_seconds = timeout.total_seconds() if isinstance(timeout, timedelta) else timeout
+        deadline = time.monotonic() + timeout_seconds
+
+        fd = self._file_descriptor()
+        while not self._try_lock(fd):
+            if time.monotonic() >= deadline:
+                raise TimeOutError(f"Timed out waiting for {self.lock_filename}")
+            time.sleep(self.RETRY_INTERVAL)
+
+        self._locked = True
+        os.ftruncate(fd, 0)
+        os.pwrite(fd, self._owner, 0)
+
+    def unlock(self):
+        if self._locked:
+            self._locked = False
+            fcntl.flock(self._file_descriptor(), fcntl.LOCK_UN)
+
+    def refresh(self):
+        pass  # Never expires
+
+    def break_lock(self):
+        logging.error("The lock is held by a running process and can't be broken")
+        return False
+
+    @property
+    def state(self):
+        if self._locked:
+            return LockState.ours
+
+        fd = self._file_descriptor()
+        if self._try_lock(fd):
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            return LockState.unlocked
+        return LockState.unknown  # Held by a live process, which is what flufl reports too
+
+    @property
+    def details(self):
+        hostname, _, pid = os.pread(self._file_descriptor(), 1024, 0).decode(errors="replace").partition("|")
+        return hostname, int(pid) if pid.isdigit() else 0, self.lock_filename
+
+    @property
+    def expiration(self):
+        return datetime.max  # Held until its owner releases it (or dies)
+
+
+class LeaseHeartbeat:
+    """Keeps refreshing a held lock from its own thread while the UI waits in a prompt, so a long edit
+    doesn't let the lock expire (and get broken by someone else) without a longer lifetime for every lock"""
+
+    def __init__(self, refresh: Callable[[], bool], expiration: Callable[[], datetime], interval: float,
+                 name: str = "lease heartbeat"):
+        self._refresh = refresh  # Returns False if the lock isn't ours anymore
+        self._expiration = expiration
+        self._interval = interval
+        self._name = name
+        self._mutex = threading.Lock()
+        self._users = 0
+        self._stop_event = threading.Event()
+        self._thread: threading.Thread | None = None
+        self.lost = False
+
+    @contextmanager
+    def running(self):
+        """Refresh the lock until the block ends. Blocks may be nested"""
+        with self._mutex:
+            self._users += 1
+            if self._users == 1:
+                self.lost = False
+                self._stop_event.clear()
+                self._thread = threading.Thread(target=self._run, name=self._name, daemon=True)
+                self._thread.start()
+        try:
+            yield self
+        finally:
+            with self._mutex:
+                self._users -= 1
+                thread = self._thread if self._users == 0 else None
+                if thread is not None:
+                    self._stop_event.set()
+                    self._thread = None
+            if thread is not None:
+                thread.join()
+
+    @property
+    def status(self):
+        """Short description of the lease, for the prompts"""
+        if self.lost:
+            return "lock lost"
+        expiration = self._expiration()
+        if expiration == datetime.max:
+            return "locked"
+        seconds_left = max(0, int((expiration - datetime.now()).total_seconds()))
+        return f"lock lease {seconds_left}s"
+
+    def _run(self):
+        while not self._stop_event.wait(self._interval):
+            try:
+                refreshed = self._refresh()
+            except Exception as e:
+                logging.error(f"Could not refresh the lock: {e}")
+                continue
+
+            if not refreshed:
+                self.lost = True
+                logging.warning("The lock was taken by someone else while you were editing")
+                return
+
+
+@functools.lru_cache
+def filesystem_type(directory: str):
+    """File system type of the mount that contains the directory (None if it isn't known)"""
+    try:
+        with open("/proc/self/mounts", encoding="utf-8") as f:
+            mounts = [line.split() for line in f]
+    except OSError:
+        return None
+
+    directory = os.path.realpath(directory)
+    best_mount_point, best_type = "", None
+    for fields in mounts:
+        if len(fields) < 3:
+            continue
+        mount_point = fields[1].replace("\\040", " ")
+        inside = directory == mount_point or directory.startswith(mount_point.rstrip("/") + "/")
+        if inside and len(mount_point) >= len(best_mount_point):
+            best_mount_point, best_type = mount_point, fields[2]
+    return best_type
+
+
+def create_lock_backend(lock_filename: Path | str, lifetime: timedelta, default_timeout: timedelta, backend: str = "flufl"):
+    """Create the lock of a shelf. "auto" uses the fcntl lock only when the lock file is on a known local file system"""
+    if backend == "auto":
+        fs_type = filesystem_type(str(Path(lock_filename).expanduser().parent))
+        backend = "fcntl" if fs_type in LOCAL_FILESYSTEMS else "flufl"
+
+    if backend == "fcntl":
+        if fcntl is not None:
+            return FcntlLockBackend(lock_filename, lifetime, default_timeout)
+        logging.warning("fcntl locks are not supported on this system, using the flufl lock instead")
+    elif backend != "flufl":
+        logging.warning(f"Unknown lock backend '{backend}', using the flufl lock instead")
+
+    return FluflLockBackend(lock_filename, lifetime, default_timeout)
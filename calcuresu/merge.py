@@ -0,0 +1,247 @@
+"""Module that merges edits made without the lock (optimistic edits) into the latest version of a workspace"""
+
+from typing import Iterator, List
+
+from calcuresu.classes.task import RootTask, Task
+
+# Fields of a task that an edit may change, besides the timer stamps and the children
+EDITED_FIELDS = ("parent_id", "name", "status", "privacy", "collapse", "importance", "extra_info_length",
+                 "deadline", "archive_date")
+
+
+def task_fields(task: Task):
+    """The fields of the task that an edit may change, in their JSON-friendly form"""
+    fields = task.to_dict(with_children=False)
+    del fields["id"], fields["revision"]
+    return fields
+
+
+def copy_task_fields(task: Task, source: Task):
+    for field in EDITED_FIELDS:
+        setattr(task, field, getattr(source, field))
+    task.timer.stamps = list(source.timer.stamps)
+
+
+def walk_tasks(root: RootTask) -> Iterator[tuple[Task, Task|RootTask]]:
+    """Every task under the root, with its parent (in no particular order)"""
+    stack: List[Task|RootTask] = [root]
+    while stack:
+        parent = stack.pop()
+        for child in parent.children:
+            yield child, parent
+            stack.append(child)
+
+
+class RevisionBase:
+    """The revision, fields and children of every task when an edit started"""
+
+    def __init__(self, root: RootTask):
+        self.revisions: dict[int, int] = {}
+        self.fields: dict[int, dict] = {}
+        self.children: dict[int, List[int]] = {0: [child.item_id for child in root.children]}
+        for task, _ in walk_tasks(root):
+            self.revisions[task.item_id] = task.revision
+            self.fields[task.item_id] = task_fields(task)
+            self.children[task.item_id] = [child.item_id for child in task.children]
+
+    def changed_tasks(self, root: RootTask, noted_ids: set[int]|frozenset = frozenset()):
+        """The tasks whose own fields (or notes) changed since the base was taken"""
+        return [task for task, _ in walk_tasks(root) if task.item_id in self.fields
+                and (task.item_id in noted_ids or task_fields(task) != self.fields[task.item_id])]
+
+    @property
+    def max_id(self):
+        return max(self.fields, default=0)
+
+
+class Changeset:
+    """What an edit changed relative to its base - enough to apply the edit to another version of the tree"""
+
+    def __init__(self):
+        self.changed: dict[int, tuple[int, dict, Task]] = {}  # Base revision, base fields and the edited task
+        self.deleted: dict[int, tuple[int, dict, List[int]]] = {}  # Base revision, base fields and base children
+        self.added: dict[int, Task] = {}  # New tasks (with their subtrees)
+        self.children: dict[int, tuple[List[int], List[int]]] = {}  # Base and edited children of the changed lists
+        self.max_id = 0  # Largest id the edit knew about
+
+    def to_json(self):
+        new_roots = [task for task in self.added.values() if task.parent_id not in self.added]
+        return {
+            "changed": [[item_id, revision, fields, task.to_dict(with_children=False)]
+                        for item_id, (revision, fields, task) in self.changed.items()],
+            "deleted": [[item_id, revision, fields, children] for item_id, (revision, fields, children) in self.deleted.items()],
+            "added": [task.to_dict() for task in new_roots],
+            "children": [[parent_id, base_list, local_list] for parent_id, (base_list, local_list) in self.children.items()],
+            "max_id": self.max_id,
+        }
+
+    @classmethod
+    def from_json(cls, data: dict):
+        changes = cls()
+        for item_id, revision, fields, task in data["changed"]:
+            changes.changed[item_id] = (revision, fields, Task.from_dict(task))
+        for item_id, revision, fields, children in data["deleted"]:
+            changes.deleted[item_id] = (revision, fields, children)
+        for root in data["added"]:
+            stack = [Task.from_dict(root)]
+            while stack:
+                task = stack.pop()
+                changes.added[task.item_id] = task
+                stack.extend(task.children)
+        for parent_id, base_list, local_list in data["children"]:
+            changes.children[parent_id] = (base_list, local_list)
+        changes.max_id = data["max_id"]
+        return changes
+
+
+def collect_changes(base: RevisionBase, local_root: RootTask, noted_ids: set[int]|frozenset = frozenset()) -> Changeset:
+    """Compare the edited tree with its base. Tasks in noted_ids count as changed even if only the text of their note did"""
+    changes = Changeset()
+    local_ids: set[int] = set()
+
+    local_children: dict[int, List[int]] = {0: [child.item_id for child in local_root.children]}
+    for task, _ in walk_tasks(local_root):
+        local_ids.add(task.item_id)
+        local_children[task.item_id] = [child.item_id for child in task.children]
+        if task.item_id not in base.fields:
+            changes.added[task.item_id] = task
+        elif task.item_id in noted_ids or task_fields(task) != base.fields[task.item_id]:
+            changes.changed[task.item_id] = (base.revisions[task.item_id], base.fields[task.item_id], task)
+
+    for item_id in base.fields:
+        if item_id not in local_ids:
+            changes.deleted[item_id] = (base.revisions[item_id], base.fields[item_id], base.children[item_id])
+
+    # New tasks bring their own children along
+    for parent_id, local_list in local_children.items():
+        base_list = base.children.get(parent_id, [])
+        if parent_id not in changes.added and local_list != base_list:
+            changes.children[parent_id] = (base_list, local_list)
+
+    changes.max_id = max(base.max_id, max(local_ids, default=0))
+    return changes
+
+
+class MergeResult:
+    def __init__(self):
+        self.conflicts: List[str] = []  # Names of the tasks whose edits were not applied
+        self.skipped_ids: set[int] = set()  # Ids of those tasks
+        self.id_changes: dict[int, int] = {}  # Ids of our new tasks that were taken by someone else in the meantime
+
+
+def apply_changes(changes: Changeset, disk_root: RootTask, first_free_id: int) -> MergeResult:
+    """Apply an edit to the tree that was just read from the file. A change is skipped (and reported)
+    only when the same task was changed in the file too. The new tasks of the changeset become part of the tree"""
+    result = MergeResult()
+
+    disk_by_id: dict[int, Task] = {}
+    disk_parent_of: dict[int, Task|RootTask] = {}
+    for task, parent in walk_tasks(disk_root):
+        disk_by_id[task.item_id] = task
+        disk_parent_of[task.item_id] = parent
+
+    def changed_in_file(item_id: int, revision: int, fields: dict):
+        disk_task = disk_by_id.get(item_id)
+        return disk_task is None or disk_task.revision != revision or task_fields(disk_task) != fields
+
+    def skip(item_id: int, name: str):
+        if item_id not in result.skipped_ids:
+            result.skipped_ids.add(item_id)
+            result.conflicts.append(name)
+
+    for item_id, (revision, fields, task) in changes.changed.items():
+        if changed_in_file(item_id, revision, fields):
+            skip(item_id, task.name)
+
+    for item_id, (revision, fields, base_children) in changes.deleted.items():
+        disk_task = disk_by_id.get(item_id)
+        if disk_task is None:
+            continue  # Removed on both sides
+        known_children = set(base_children)
+        if changed_in_file(item_id, revision, fields) or any(child.item_id not in known_children for child in disk_task.children):
+            skip(item_id, disk_task.name)
+
+    # Our new tasks get fresh ids if someone else used theirs in the meantime
+    added = changes.added
+    children_lists = changes.children
+    next_id = max(first_free_id, changes.max_id + 1)
+    for item_id in sorted(added):
+        if item_id < first_free_id:
+            result.id_changes[item_id] = next_id
+            next_id += 1
+    if result.id_changes:
+        renamed = result.id_changes
+        for task in [*added.values(), *(task for _, _, task in changes.changed.values())]:
+            task.item_id = renamed.get(task.item_id, task.item_id)
+            task.parent_id = renamed.get(task.parent_id, task.parent_id)
+        added = {task.item_id: task for task in added.values()}
+        children_lists = {parent_id: (base_list, [renamed.get(child_id, child_id) for child_id in local_list])
+                          for parent_id, (base_list, local_list) in children_lists.items()}
+
+    def name_of(item_id: int):
+        if item_id in added:
+            return added[item_id].name
+        if item_id in disk_by_id:
+            return disk_by_id[item_id].name
+        return changes.changed[item_id][2].name
+
+    for item_id, (revision, _, task) in changes.changed.items():
+        if item_id not in result.skipped_ids:
+            disk_task = disk_by_id[item_id]
+            copy_task_fields(disk_task, task)
+            disk_task.revision = revision + 1
+
+    for parent_id, (base_list, local_list) in children_lists.items():
+        parent = disk_root if parent_id == 0 else disk_by_id.get(parent_id)
+        if parent is None:
+            for item_id in local_list:
+                if item_id not in base_list:
+                    skip(item_id, name_of(item_id))
+            continue
+
+        base_set, local_set = set(base_list), set(local_list)
+        removed = {item_id for item_id in base_set - local_set if item_id not in result.skipped_ids}
+        kept = [child for child in parent.children if child.item_id not in removed]
+
+        # Reordered tasks (e.g. swapped) are only applied if nobody reordered them in the file
+        kept_ids = {child.item_id for child in kept}
+        base_order = [item_id for item_id in base_list if item_id in local_set and item_id in kept_ids]
+        local_order = [item_id for item_id in local_list if item_id in base_set and item_id in kept_ids]
+        if local_order != base_order:
+            order_set = set(base_order)
+            positions = [index for index, child in enumerate(kept) if child.item_id in order_set]
+            if [kept[index].item_id for index in positions] != base_order:
+                for ours, theirs in zip(local_order, base_order):
+                    if ours != theirs:
+                        skip(ours, name_of(ours))
+            else:
+                kept_by_id = {child.item_id: child for child in kept}
+                for index, item_id in zip(positions, local_order):
+                    kept[index] = kept_by_id[item_id]
+
+        # Tasks that came into this list go after the task they follow in ours
+        for position, item_id in enumerate(local_list):
+            if item_id in base_set or item_id in result.skipped_ids:
+                continue
+
+            task = disk_by_id.get(item_id)
+            if task is None:
+                if item_id not in added:
+                    continue  # Moved here, but removed from the file (reported above)
+                task = added[item_id]
+            else:
+                old_parent = disk_parent_of[item_id]
+                if old_parent is not parent:
+                    old_parent.children[:] = [child for child in old_parent.children if child.item_id != item_id]
+                kept = [child for child in kept if child.item_id != item_id]
+
+            ordered_ids = [child.item_id for child in kept]
+            predecessor = next((local_list[index] for index in range(position - 1, -1, -1) if local_list[index] in ordered_ids), None)
+            insert_at = 0 if predecessor is None else ordered_ids.index(predecessor) + 1
+            kept.insert(insert_at, task)
+            disk_parent_of[item_id] = parent
+
+        parent.children[:] = kept
+
+    return result
+
@@ -0,0 +1,440 @@
+"""Module that builds time reports (by day, by week and by subtree) from the stamps of the timers.
+
+The stamps of every timer of a workspace are gathered into flat columns of intervals. The intervals are
+cut at local midnights and summed by (task, day) with a few array operations, using NumPy when it is
+installed and the same steps in pure Python otherwise. Only the tasks with a timer, and their ancestors,
+get a row, so the subtree totals are rolled up over a small part of the tree.
+
+The closed intervals are rolled up once per generation of the workspace. Running timers are added every
+time a report is shown, so their time keeps counting without rolling up the workspace again.
+"""
+
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+import csv
+from datetime import date, datetime, time as clock_time
+import json
+import os
+from pathlib import Path
+import shelve
+import sys
+import time
+from typing import AbstractSet, Iterable, List, TextIO, Tuple
+
+try:
+    import numpy
+except ImportError:  # Optional, the reports are computed in pure Python without it
+    numpy = None
+
+from calcuresu.classes.task import Task
+from calcuresu.data import ARCHIVE_INDEX_KEY, Tasks
+from calcuresu.export import walk_tree
+from calcuresu.snapshot import FLAG_PRIVACY, Snapshot, snapshot_filename_for
+
+
+REPORT_CACHE_SIZE = 4  # Rolled up workspaces kept by TimeReports
+
+
+class TimeColumns:
+    """The tasks with a timer and their ancestors as rows (a parent always comes before its children),
+    and the intervals of their timers as flat columns"""
+
+    def __init__(self) -> None:
+        self.item_ids = array("q")
+        self.parent_rows = array("q")  # -1 for top-level tasks
+        self.depths = array("i")
+        self.names: List[str] = []
+        self.archived = array("B")
+        self.private = array("B")
+
+        self.starts = array("d")  # Closed intervals
+        self.ends = array("d")
+        self.interval_rows = array("q")
+        self.running: List[Tuple[int, float]] = []  # (row, start) of the running timers
+
+        self._row_of_id: dict[int, int] = {}
+
+    @property
+    def row_count(self):
+        return len(self.item_ids)
+
+    def _add_row(self, item_id: int, parent_row: int, depth: int, name: str, archived: bool, private: bool):
+        row = len(self.item_ids)
+        self.item_ids.append(item_id)
+        self.parent_rows.append(parent_row)
+        self.depths.append(depth)
+        self.names.append(name)
+        self.archived.append(archived)
+        self.private.append(private)
+        self._row_of_id[item_id] = row
+        return row
+
+    def _add_stamps(self, row: int, stamps):
+        for index in range(1, len(stamps), 2):
+            self.starts.append(float(stamps[index - 1]))
+            self.ends.append(float(stamps[index]))
+            self.interval_rows.append(row)
+        if len(stamps) % 2 == 1:
+            self.running.append((row, float(stamps[-1])))
+
+    def add_subtrees(self, roots: Iterable[Task], wanted_ids: AbstractSet[int] = frozenset()):
+        """Add the tasks with a timer (and the ones in wanted_ids) under the given roots, with their ancestors.
+        Roots whose parent already has a row are put under it"""
+        path: List[list] = []  # [task, row or None] of the ancestors of the current task
+        for task, depth in walk_tree(roots):
+            del path[depth:]
+            path.append([task, None])
+            if not task.timer.stamps and task.item_id not in wanted_ids:
+                continue
+
+            first = len(path) - 1
+            while first > 0 and path[first - 1][1] is None:
+                first -= 1
+            for index in range(first, len(path)):
+                ancestor = path[index][0]
+                if index > 0:
+                    parent_row = path[index - 1][1]
+                else:
+                    parent_row = self._row_of_id.get(ancestor.parent_id, -1)
+                parent_depth = self.depths[parent_row] if parent_row >= 0 else -1
+                path[index][1] = self._add_row(ancestor.item_id, parent_row, parent_depth + 1, ancestor.name,
+                                               ancestor.is_archived, ancestor.privacy)
+            self._add_stamps(path[-1][1], task.timer.stamps)
+
+    def add_snapshot(self, snapshot: Snapshot, wanted_ids: AbstractSet[int] = frozenset()):
+        """Add the rows of a snapshot that have a timer (and the ones in wanted_ids), with their ancestors.
+        Only these rows are read"""
+        stamps_count = snapshot.column("stamps_count")
+        if numpy is not None:
+            rows = numpy.flatnonzero(numpy.asarray(stamps_count)).tolist()
+        else:
+            rows = [row for row, count in enumerate(stamps_count) if count]
+        for item_id in wanted_ids:
+            try:
+                rows.append(snapshot.row_of_id(item_id))
+            except ValueError:
+                pass
+
+        parent_ids = snapshot.column("parent_id")
+        kept = set(rows)
+        pending = list(kept)
+        while pending:
+            parent_id = parent_ids[pending.pop()]
+            if parent_id == 0:
+                continue
+            try:
+                parent_row = snapshot.row_of_id(parent_id)
+            except ValueError:
+                continue
+            if parent_row not in kept:
+                kept.add(parent_row)
+                pending.append(parent_row)
+
+        item_ids = snapshot.column("item_id")
+        archive_dates = snapshot.column("archive_date")
+        flags = snapshot.column("flags")
+        stamps_offset = snapshot.column("stamps_offset")
+        stamps = snapshot.column("stamps")
+        for row in sorted(kept):  # Display order, so parents come first
+            parent_row = self._row_of_id.get(parent_ids[row], -1)
+            new_row = self._add_row(item_ids[row], parent_row, snapshot.depth_of_row(row), snapshot.name_of_row(row),
+                                    bool(archive_dates[row]), bool(flags[row] & FLAG_PRIVACY))
+            if stamps_count[row]:
+                self._add_stamps(new_row, stamps[stamps_offset[row]:stamps_offset[row] + stamps_count[row]])
+
+
+def gather_tasks(user_tasks: Tasks) -> TimeColumns:
+    """Gather the timers of an open workspace, archived subtrees that were moved out of the tree included"""
+    user_tasks.load_archive_segment()
+    assert user_tasks.archive_segment is not None
+    cold_roots = user_tasks.archive_segment
+    wanted_ids = {root.parent_id for root in cold_roots if root.parent_id != 0}
+
+    columns = TimeColumns()
+    if user_tasks.snapshot is not None:
+        columns.add_snapshot(user_tasks.snapshot, wanted_ids)
+    else:
+        columns.add_subtrees(user_tasks.root_task.children, wanted_ids)
+    columns.add_subtrees(cold_roots)
+    return columns
+
+
+def gather_workspace(workspace_path: str) -> Tuple[TimeColumns, int|None]:
+    """Gather the timers of a workspace file without the lock, like the export does. Returns them with the
+    generation they were read from"""
+    with shelve.open(workspace_path, flag="r", protocol=4) as shelf:
+        generation = shelf.get("generation", None)
+
+        # A subtree may have been moved out before its archived parent (see Tasks.load_archive_segment)
+        cold_roots: List[Task] = []
+        for chunk_key in shelf.get(ARCHIVE_INDEX_KEY, {"chunks": []})["chunks"]:
+            cold_roots.extend(shelf.get(chunk_key, []))
+        cold_by_id = {task.item_id: task for task, _ in walk_tree(cold_roots)}
+        detached_roots: List[Task] = []
+        for root in cold_roots:
+            parent = cold_by_id.get(root.parent_id)
+            if parent is not None and parent is not root:
+                parent.children.append(root)
+            else:
+                detached_roots.append(root)
+        wanted_ids = {root.parent_id for root in detached_roots if root.parent_id != 0}
+
+        columns = TimeColumns()
+        snapshot = Snapshot.open_if_fresh(snapshot_filename_for(workspace_path), generation) \
+            if generation is not None else None
+        if snapshot is not None:
+            try:
+                columns.add_snapshot(snapshot, wanted_ids)
+            finally:
+                snapshot.close()
+        else:
+            columns.add_subtrees(shelf.get("task_tree", []), wanted_ids)
+        columns.add_subtrees(detached_roots)
+
+        if shelf.get("generation", None) != generation:
+            print(f"{workspace_path} was saved during the report, so the report may mix both versions", file=sys.stderr)
+    return columns, generation
+
+
+def _midnights(first_day: int, last_day: int):
+    """Timestamps of the local midnights that start the days first_day, ..., last_day + 1 (date ordinals)"""
+    return [datetime.combine(date.fromordinal(day), clock_time()).timestamp() for day in range(first_day, last_day + 2)]
+
+
+def bucket_by_day(starts, ends, rows) -> Tuple[List[int], List[int], List[float]]:
+    """Cut the intervals at local midnights and sum them by (row, day). Returns the rows, the days (date ordinals)
+    and the seconds of the (row, day) cells with any time, sorted by row and then by day"""
+    if not starts:
+        return [], [], []
+
+    first_day = date.fromtimestamp(min(starts)).toordinal()
+    last_day = max(date.fromtimestamp(max(ends)).toordinal(), first_day)
+    midnights = _midnights(first_day, last_day)
+    if numpy is not None:
+        return _bucket_by_day_numpy(starts, ends, rows, first_day, midnights)
+
+    cells: dict[Tuple[int, int], float] = {}
+    for start, end, row in zip(starts, ends, rows):
+        index = bisect_right(midnights, start) - 1
+        while start < end:
+            piece_end = min(end, midnights[index + 1])
+            cell = (row, first_day + index)
+            cells[cell] = cells.get(cell, 0.0) + (piece_end - start)
+            start = piece_end
+            index += 1
+
+    ordered = sorted(cells)
+    return [row for row, _ in ordered], [day for _, day in ordered], [cells[cell] for cell in ordered]
+
+
+def _bucket_by_day_numpy(starts, ends, rows, first_day: int, midnights: List[float]):
+    starts = numpy.asarray(starts, dtype=numpy.float64)
+    ends = numpy.maximum(numpy.asarray(ends, dtype=numpy.float64), starts)  # Clocks may go back
+    rows = numpy.asarray(rows, dtype=numpy.int64)
+    day_count = len(midnights)
+    midnights = numpy.asarray(midnights)
+
+    # Every interval becomes a piece per day it touches
+    first = numpy.searchsorted(midnights, starts, side="right") - 1
+    last = numpy.searchsorted(midnights, ends, side="left") - 1
+    pieces = numpy.maximum(last - first + 1, 0)
+    interval = numpy.repeat(numpy.arange(len(starts)), pieces)
+    day = first[interval] + numpy.arange(len(interval)) - numpy.repeat(numpy.cumsum(pieces) - pieces, pieces)
+    seconds = numpy.minimum(ends[interval], midnights[day + 1]) - numpy.maximum(starts[interval], midnights[day])
+
+    cells, inverse = numpy.unique(rows[interval] * day_count + day, return_inverse=True)
+    totals = numpy.bincount(inverse.ravel(), weights=seconds, minlength=len(cells))
+    kept = totals > 0
+    return (cells[kept] // day_count).tolist(), (cells[kept] % day_count + first_day).tolist(), totals[kept].tolist()
+
+
+def sum_by(keys: List[int], seconds: List[float]) -> dict[int, float]:
+    if numpy is not None and keys:
+        unique_keys, inverse = numpy.unique(numpy.asarray(keys, dtype=numpy.int64), return_inverse=True)
+        return dict(zip(unique_keys.tolist(), numpy.bincount(inverse.ravel(), weights=seconds).tolist()))
+
+    totals: dict[int, float] = {}
+    for key, value in zip(keys, seconds):
+        totals[key] = totals.get(key, 0.0) + value
+    return totals
+
+
+def roll_up(own: List[float], parent_rows, depths) -> List[float]:
+    """Add the time of every row to all of its ancestors"""
+    if numpy is not None and own:
+        totals = numpy.array(own, dtype=numpy.float64)
+        parents = numpy.asarray(parent_rows, dtype=numpy.int64)
+        levels = numpy.asarray(depths, dtype=numpy.int64)
+        for depth in range(int(levels.max()), 0, -1):  # A level is complete once the levels below were added
+            level = numpy.flatnonzero((levels == depth) & (parents >= 0))
+            numpy.add.at(totals, parents[level], totals[level])
+        return totals.tolist()
+
+    totals = list(own)
+    for row in range(len(totals) - 1, -1, -1):  # Children come after their parents
+        if parent_rows[row] >= 0:
+            totals[parent_rows[row]] += totals[row]
+    return totals
+
+
+def week_of(day: int):
+    """The Monday that starts the week of a date ordinal (ordinal 1 is a Monday)"""
+    return day - (day - 1) % 7
+
+
+class TimeRollup:
+    """The closed intervals of a workspace summed by task and day, with the rollups that are built from them"""
+
+    def __init__(self, columns: TimeColumns) -> None:
+        self.columns = columns
+        self.cell_rows, self.cell_days, self.cell_seconds = bucket_by_day(columns.starts, columns.ends,
+                                                                          columns.interval_rows)
+        self.daily = sum_by(self.cell_days, self.cell_seconds)
+        own_by_row = sum_by(self.cell_rows, self.cell_seconds)
+        self.own = [own_by_row.get(row, 0.0) for row in range(columns.row_count)]
+        self.subtree = roll_up(self.own, columns.parent_rows, columns.depths)
+
+
+class TimeReport:
+    """A rollup with the time of the running timers until now"""
+
+    def __init__(self, rollup: TimeRollup, now: float) -> None:
+        self.rollup = rollup
+        self.columns = rollup.columns
+        self.now = now
+        self.daily = rollup.daily
+        self.own = rollup.own
+        self.subtree = rollup.subtree
+
+        running = self.columns.running
+        self.running_cells = bucket_by_day([start for _, start in running], [max(now, start) for _, start in running],
+                                           [row for row, _ in running])
+        if running:
+            self.daily = dict(self.daily)
+            self.own = list(self.own)
+            self.subtree = list(self.subtree)
+            for row, day, seconds in zip(*self.running_cells):
+                self.daily[day] = self.daily.get(day, 0.0) + seconds
+                self.own[row] += seconds
+                while row >= 0:
+                    self.subtree[row] += seconds
+                    row = self.columns.parent_rows[row]
+
+    @property
+    def weekly(self) -> dict[int, float]:
+        days = list(self.daily)
+        return sum_by([week_of(day) for day in days], [self.daily[day] for day in days])
+
+    def cells(self, by_week: bool = False) -> List[Tuple[int, int, float]]:
+        """(day or week, row, seconds) of every task and day (or week) with any time, in order"""
+        rows = self.rollup.cell_rows + self.running_cells[0]
+        days = self.rollup.cell_days + self.running_cells[1]
+        if by_week:
+            days = [week_of(day) for day in days]
+        day_span = max(days) + 1 if days else 1
+        totals = sum_by([day + row * day_span for row, day in zip(rows, days)],
+                        self.rollup.cell_seconds + self.running_cells[2])
+        return sorted((key % day_span, key // day_span, seconds) for key, seconds in totals.items())
+
+    def subtrees(self, max_depth: int|None = None) -> List[int]:
+        """Rows with any time (up to a depth), in display order"""
+        depths = self.columns.depths
+        return [row for row in range(self.columns.row_count)
+                if self.subtree[row] > 0 and (max_depth is None or depths[row] <= max_depth)]
+
+
+class TimeReports:
+    """Time reports of the open workspaces. A workspace is rolled up again only after it was saved
+    (when its generation changed), and the last few rollups are kept"""
+
+    def __init__(self, cache_size: int = REPORT_CACHE_SIZE) -> None:
+        self.cache_size = cache_size
+        self._rollups: OrderedDict[Tuple[str, int], TimeRollup] = OrderedDict()
+
+    def report(self, user_tasks: Tasks, now: float|None = None):
+        key = (str(user_tasks._shelve_filename), user_tasks.generation)
+        rollup = self._rollups.get(key)
+        if rollup is None:
+            rollup = TimeRollup(gather_tasks(user_tasks))
+            self._rollups[key] = rollup
+            while len(self._rollups) > self.cache_size:
+                self._rollups.popitem(last=False)
+        else:
+            self._rollups.move_to_end(key)
+        return TimeReport(rollup, time.time() if now is None else now)
+
+
+def format_seconds(seconds: float):
+    minutes = int(seconds) // 60
+    return f"{minutes // 60}:{minutes % 60:02d}"
+
+
+REPORT_PERIODS = ["daily", "weekly", "subtrees"]
+REPORT_FORMATS = ["csv", "jsonl"]
+REPORT_EXTENSIONS = {".jsonl": "jsonl", ".json": "jsonl", ".csv": "csv"}
+
+
+def report_records(report: TimeReport, period: str) -> Iterable[dict]:
+    columns = report.columns
+    if period == "subtrees":
+        for row in report.subtrees():
+            yield {"id": columns.item_ids[row], "depth": columns.depths[row], "name": columns.names[row],
+                   "archived": bool(columns.archived[row]), "own_seconds": round(report.own[row]),
+                   "subtree_seconds": round(report.subtree[row])}
+        return
+
+    for day, row, seconds in report.cells(by_week=period == "weekly"):
+        yield {"week" if period == "weekly" else "date": date.fromordinal(day).isoformat(),
+               "id": columns.item_ids[row], "name": columns.names[row], "seconds": round(seconds)}
+
+
+def write_report(records: Iterable[dict], report_format: str, output: TextIO):
+    writer = None
+    for record in records:
+        if report_format == "jsonl":
+            output.write(json.dumps(record, ensure_ascii=False) + "\n")
+            continue
+        if writer is None:
+            writer = csv.DictWriter(output, fieldnames=list(record))
+            writer.writeheader()
+        writer.writerow(record)
+
+
+def report_workspace(arguments: List[str], period: str|None, report_format: str|None, output_path: str|None) -> int:
+    """Write the time report of a workspace from the command line, to a file (written atomically) or to stdout"""
+    if len(arguments) != 1:
+        print("Usage: calcuresu report [--period=daily|weekly|subtrees] [--format=csv|jsonl] [--output=<file>] <workspace_path>")
+        return 1
+
+    workspace_path = arguments[0]
+    if not Path(workspace_path).is_file():
+        print(f"{workspace_path}: no such workspace")
+        return 1
+
+    period = period or "daily"
+    if period not in REPORT_PERIODS:
+        print(f"Unknown period '{period}', expected one of: {', '.join(REPORT_PERIODS)}")
+        return 1
+    if report_format is None:
+        report_format = REPORT_EXTENSIONS.get(Path(output_path).suffix.lower(), "csv") if output_path else "csv"
+    if report_format not in REPORT_FORMATS:
+        print(f"Unknown format '{report_format}', expected one of: {', '.join(REPORT_FORMATS)}")
+        return 1
+
+    columns, _ = gather_workspace(workspace_path)
+    report = TimeReport(TimeRollup(columns), time.time())
+
+    if output_path is None or output_path == "-":
+        write_report(report_records(report, period), report_format, sys.stdout)
+        return 0
+
+    temp_path = f"{output_path}.tmp"
+    try:
+        with open(temp_path, "w", encoding="utf-8", newline="") as output:
+            write_report(report_records(report, period), report_format, output)
+        os.replace(temp_path, output_path)
+    except BaseException:
+        Path(temp_path).unlink(missing_ok=True)
+        raise
+    return 0
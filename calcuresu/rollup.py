@@ -0,0 +1,72 @@
+"""Module that reads and writes the yearly rollup files of a workspace.
+
+Archived subtrees that are older than the retention period are moved out of the workspace into one
+compressed file per year (the year the subtree was last archived in), together with their notes.
+The files are only read when the archive screen asks for a year.
+"""
+
+import glob
+import lzma
+import os
+from pathlib import Path
+import pickle
+import re
+from typing import List, Tuple
+
+from calcuresu.classes.task import Task
+
+
+ROLLUP_VERSION = 1
+ROLLUP_SUFFIX = ".archive-"
+ROLLUP_EXTENSION = ".xz"
+
+
+def rollup_filename_for(shelve_filename: Path | str, year: int):
+    return f"{shelve_filename}{ROLLUP_SUFFIX}{year}{ROLLUP_EXTENSION}"
+
+
+def rollup_filenames_for(shelve_filename: Path | str) -> dict[int, str]:
+    """All the rollup files of a workspace, by year"""
+    pattern = f"{glob.escape(str(shelve_filename))}{ROLLUP_SUFFIX}*{ROLLUP_EXTENSION}"
+    year_regex = re.compile(re.escape(ROLLUP_SUFFIX) + r"(\d+)" + re.escape(ROLLUP_EXTENSION) + "$")
+
+    filenames = {}
+    for filename in glob.glob(pattern):
+        match = year_regex.search(filename)
+        if match is not None:
+            filenames[int(match.group(1))] = filename
+    return dict(sorted(filenames.items()))
+
+
+def read_rollup(filename: Path | str) -> Tuple[List[Task], dict[int, str]]:
+    """Read the archived subtrees and their notes from a rollup file (empty if it doesn't exist)"""
+    try:
+        with lzma.open(filename, "rb") as f:
+            content = pickle.load(f)
+    except FileNotFoundError:
+        return [], {}
+
+    if content.get("version") != ROLLUP_VERSION:
+        raise ValueError(f"{filename} is not a supported rollup file")
+    return content["tasks"], content["notes"]
+
+
+def write_rollup(filename: Path | str, tasks: List[Task], notes: dict[int, str]):
+    """Replace the rollup file atomically. An empty rollup removes the file"""
+    if not tasks:
+        Path(filename).unlink(missing_ok=True)
+        return
+
+    temp_filename = f"{filename}.tmp"
+    with lzma.open(temp_filename, "wb") as f:
+        pickle.dump({"version": ROLLUP_VERSION, "tasks": tasks, "notes": notes}, f, protocol=4)
+    os.replace(temp_filename, filename)
+
+
+def append_to_rollup(filename: Path | str, tasks: List[Task], notes: dict[int, str]):
+    """Add archived subtrees (and their notes) to the rollup file of their year.
+    A subtree that is already in the file (the workspace wasn't saved after it was rolled up) is replaced"""
+    existing_tasks, existing_notes = read_rollup(filename)
+    new_ids = {task.item_id for task in tasks}
+    existing_tasks = [task for task in existing_tasks if task.item_id not in new_ids]
+    write_rollup(filename, existing_tasks + tasks, existing_notes | notes)
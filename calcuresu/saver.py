@@ -0,0 +1,87 @@
+"""Module with the thread that saves shelf files in the background"""
+
+import logging
+import threading
+import time
+from typing import Callable
+
+
+class BackgroundSaver:
+    """Runs the save function on its own thread, once no save was requested for a whole debounce window,
+    so a burst of edits is written only once. A failed save is retried after another window"""
+
+    def __init__(self, save: Callable[[], bool], debounce: float, name: str = "saver"):
+        self._save = save
+        self._debounce = debounce
+        self._condition = threading.Condition()
+        self._pending = False
+        self._saving = False
+        self._stopped = False
+        self._last_request = 0.0
+
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    @property
+    def is_busy(self):
+        """Whether there are changes that aren't in the file yet"""
+        with self._condition:
+            return self._pending or self._saving
+
+    def request_save(self):
+        with self._condition:
+            self._pending = True
+            self._last_request = time.monotonic()
+            self._condition.notify_all()
+
+    def flush(self, timeout: float | None = None):
+        """Save the pending changes right away, and wait until they are written. Returns False on timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            self._last_request = 0.0  # Skips the rest of the debounce window
+            self._condition.notify_all()
+            while (self._pending or self._saving) and self._thread.is_alive():
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def stop(self, timeout: float | None = None):
+        """Save the pending changes right away, and stop the thread"""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        self._thread.join(timeout)
+
+    def _wait_for_quiet_window(self):
+        while not self._stopped:
+            remaining = self._last_request + self._debounce - time.monotonic()
+            if remaining <= 0:
+                return
+            self._condition.wait(remaining)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._stopped:
+                    self._condition.wait()
+                if not self._pending:
+                    return  # Stopped with nothing left to save
+
+                self._wait_for_quiet_window()
+                self._pending = False
+                self._saving = True
+
+            try:
+                saved = self._save()
+            except Exception as e:
+                logging.error(f"Background save failed: {e}")
+                saved = False
+
+            with self._condition:
+                self._saving = False
+                if not saved and not self._stopped:
+                    self._pending = True
+                    self._last_request = time.monotonic()
+                self._condition.notify_all()
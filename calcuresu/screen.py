@@ -1,5 +1,6 @@
 """Module that controls the overall state of the program screen"""
 
+from collections import deque
 import datetime
 import logging
 
@@ -14,10 +15,17 @@ class Screen:
         self._state = AppState(global_config.DEFAULT_VIEW.value)
         self.currently_drawn = self.state
         self.selection_mode = False
+        self.marked_task_ids: set[int] = set()
+        self.held_leases: list = []  # Heartbeats of the locks held by the current action, kept alive in prompts
         self.refresh_now = True
         self.reload_data = False
         self.delayed_action = False
         self.key: str|None = None
+        self.input_idle = False  # Set when no key was waiting, so the main loop can sleep until something happens
+        self.pending_keys: deque[str] = deque()  # Read while folding navigation keys, but not handled yet
+        self.movement_steps = 0  # Rows to move by for the navigation keys that were folded into screen.key
+        self.last_frame_time = 0.0
+        self.search = None  # The last search across workspaces (a WorkspaceSearch), kept while other screens are shown
         self.day = self.today.day
         self.month = self.today.month
         self.year = self.today.year
@@ -0,0 +1,206 @@
+"""Module with the search across every workspace in the list of workspaces. Each workspace is searched by a worker
+process that opens it read-only, so a search never waits for the lock (or takes it from anyone)"""
+
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import dbm
+import logging
+import multiprocessing
+import os
+from pathlib import Path
+import pickle
+import re
+import shelve
+import threading
+from typing import Callable, List
+
+from calcuresu.classes.task import Task, TaskFilter
+from calcuresu.consts import Filters, Importance, Status
+from calcuresu.data import ARCHIVE_INDEX_KEY, Workspaces, note_key
+from calcuresu.singletons import global_config
+
+
+class SearchHit:
+    """A task that matched the search"""
+
+    def __init__(self, workspace_path: str, item_id: int, name: str, status: Status, ancestors: List[str],
+                 archived: bool, exact: bool) -> None:
+        self.workspace_path = workspace_path
+        self.item_id = item_id
+        self.name = name
+        self.status = status
+        self.ancestors = ancestors  # Names of the parents, outermost first
+        self.archived = archived
+        self.exact = exact  # The whole text matched, not just its beginning
+
+    @property
+    def rank(self):
+        """Lower is better: active before archived, open before done, exact before partial matches, shallow before deep"""
+        return (self.archived, self.status == Status.DONE, not self.exact, len(self.ancestors), self.name.lower())
+
+    def describe(self):
+        path = " › ".join([*self.ancestors, self.name])
+        state = self.status.name if not self.archived else f"{self.status.name}, archived"
+        return f"{path} ({state})"
+
+
+def search_workspace(workspace_path: str, user_filter: TaskFilter) -> List[SearchHit]:
+    """Find the tasks of a single workspace that match the filter, both in the task tree and in the archive
+    cold segment. Runs in a worker process"""
+    hits: List[SearchHit] = []
+    with shelve.open(workspace_path, flag="r", protocol=4) as shelf:
+        roots: List[Task] = list(shelf.get("task_tree", []))
+        for chunk_key in shelf.get(ARCHIVE_INDEX_KEY, {"chunks": []})["chunks"]:
+            roots.extend(shelf.get(chunk_key, []))
+
+        def note_of(task: Task):
+            if task.legacy_extra_info is not None:
+                return task.legacy_extra_info
+            return shelf.get(note_key(task.item_id), "") if task.has_extra_info else ""
+
+        stack = [(root, []) for root in reversed(roots)]
+        while stack:
+            task, ancestors = stack.pop()
+            stack.extend((child, [*ancestors, task.name]) for child in reversed(task.children))
+
+            if user_filter.filter_type == Filters.EXTRA_INFO:
+                text = note_of(task)
+                matched = re.match(user_filter.filter_content, text) is not None
+            else:
+                text = task.name
+                matched = user_filter in task
+            if matched:
+                exact = user_filter.filter_type not in [Filters.NAME, Filters.EXTRA_INFO] \
+                    or re.fullmatch(user_filter.filter_content, text) is not None
+                hits.append(SearchHit(workspace_path, task.item_id, task.name, task.status, ancestors,
+                                      task.is_archived, exact))
+
+    hits.sort(key=lambda hit: hit.rank)
+    return hits
+
+
+class WorkspaceSearch:
+    """A search of many workspaces on a process pool. The hits of each workspace are merged into the ranked
+    results as soon as its worker finishes, and passed to `on_hits` (which is called from another thread)"""
+
+    def __init__(self, workspace_paths: List[str], user_filter: TaskFilter, processes: int,
+                 on_hits: Callable[[List[SearchHit]], None]|None = None) -> None:
+        self.user_filter = user_filter
+        self.workspace_paths = [str(path) for path in workspace_paths if Path(path).is_file()]
+        self.processes = max(1, min(processes or os.cpu_count() or 1, len(self.workspace_paths)))
+        self.on_hits = on_hits
+        self.hits: List[SearchHit] = []
+        self.searched = 0
+        self.failed: List[str] = []
+        self._mutex = threading.Lock()
+        self._finished = threading.Event()
+        self._pool: ProcessPoolExecutor|None = None
+
+    @property
+    def is_done(self):
+        return self._finished.is_set()
+
+    def start(self):
+        if not self.workspace_paths:
+            self._finished.set()
+            return
+
+        # Spawned instead of forked, since the UI has threads (savers, heartbeats) that a fork would copy mid-work
+        self._pool = ProcessPoolExecutor(max_workers=self.processes, mp_context=multiprocessing.get_context("spawn"))
+        for workspace_path in self.workspace_paths:
+            future = self._pool.submit(search_workspace, workspace_path, self.user_filter)
+            future.add_done_callback(lambda future, workspace_path=workspace_path: self._collect(workspace_path, future))
+
+    def _collect(self, workspace_path: str, future: Future):
+        if future.cancelled():
+            return
+        try:
+            hits = future.result()
+        except (OSError, dbm.error, pickle.UnpicklingError, EOFError, re.error, BrokenProcessPool) as e:
+            logging.warning(f"Could not search {workspace_path}: {e}")
+            hits = None
+
+        with self._mutex:
+            if hits is None:
+                self.failed.append(workspace_path)
+            else:
+                self.searched += 1
+                self.hits = sorted([*self.hits, *hits], key=lambda hit: hit.rank)
+            finished = self.searched + len(self.failed) == len(self.workspace_paths)
+        if self.on_hits is not None:
+            self.on_hits(hits or [])
+        if finished:
+            self._finished.set()
+            self.cancel()  # Nothing is left for the workers, so they don't need to wait for the next search
+
+    def wait(self):
+        self._finished.wait()
+
+    def cancel(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def results(self):
+        """The ranked hits found so far"""
+        with self._mutex:
+            return list(self.hits)
+
+
+def parse_search_filter(field: str, value: str) -> TaskFilter|None:
+    """The filter of a search given on the command line. Returns None (after saying why) if it is invalid"""
+    fields = {"name": Filters.NAME, "note": Filters.EXTRA_INFO, "status": Filters.STATUS, "importance": Filters.IMPORTANCE}
+    if field not in fields:
+        print(f"Unknown field '{field}', expected one of: {', '.join(fields)}")
+        return None
+
+    filter_type = fields[field]
+    match filter_type:
+        case Filters.NAME | Filters.EXTRA_INFO:
+            try:
+                re.compile(value)
+            except re.error as e:
+                print(f"Invalid regular expression: {e}")
+                return None
+            return TaskFilter(filter_type, value)
+        case Filters.STATUS | Filters.IMPORTANCE:
+            enum_type = Status if filter_type == Filters.STATUS else Importance
+            try:
+                return TaskFilter(filter_type, enum_type[value.upper()])
+            except KeyError:
+                print(f"Unknown {field} '{value}', expected one of: {', '.join(member.name.lower() for member in enum_type)}")
+                return None
+
+
+def search_workspaces(arguments: List[str], field: str) -> int:
+    """Search every workspace in the list of workspaces from the command line. The hits of each workspace
+    are printed (best first) as soon as it was searched"""
+    if len(arguments) != 1:
+        print("Usage: calcuresu search [--field=name|note|status|importance] <regex or value>")
+        return 1
+
+    user_filter = parse_search_filter(field, arguments[0])
+    if user_filter is None:
+        return 1
+
+    workspaces = Workspaces(global_config.WORKSPACES_FILE.value, global_config.WORKSPACES_LOCK_FILE.value)
+    workspace_paths = [workspace.workspace_path for workspace in workspaces.read_shelve_key_readonly("workspaces", [])]
+    printing = threading.Lock()
+
+    def print_hits(hits: List[SearchHit]):
+        with printing:
+            for hit in hits:
+                print(f"{hit.workspace_path}: #{hit.item_id} {hit.describe()}", flush=True)
+
+    search = WorkspaceSearch(workspace_paths, user_filter, global_config.SEARCH_PROCESSES.value, on_hits=print_hits)
+    search.start()
+    try:
+        search.wait()
+    except KeyboardInterrupt:
+        return 1
+    finally:
+        search.cancel()
+
+    found_in = {hit.workspace_path for hit in search.hits}
+    print(f"{len(search.hits)} matches in {len(found_in)} of {len(search.workspace_paths)} workspaces")
+    return 0 if not search.failed else 1
@@ -0,0 +1,270 @@
+"""Module with the workspace server (calcuresu serve): a process that keeps workspaces loaded, applies the edits
+of all of its clients one after the other, and tells the clients when a workspace changed.
+
+Clients talk JSON-RPC 2.0 over a Unix socket next to the workspace, one JSON object per line:
+    tree()                   -> {"generation", "archive_index", "tasks"}
+    notes(ids)               -> {id: note}
+    commit(changes, notes)   -> {"generation", "conflicts", "id_changes"}
+    subscribe()              -> {"generation"}, followed by "changed" notifications with the new generation
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import inspect
+import json
+import logging
+import os
+import signal
+import socket
+import time
+from pathlib import Path
+from typing import Any, Awaitable, Callable
+
+from flufl.lock import TimeOutError
+
+from calcuresu.classes.workspace import Workspace
+from calcuresu.data import Tasks, Workspaces
+from calcuresu.merge import Changeset
+from calcuresu.singletons import global_config
+
+
+SOCKET_SUFFIX = ".sock"
+LOCK_RETRY_INTERVAL = 0.1  # Seconds between tries to take the lock of the file while another user holds it
+
+# JSON-RPC error codes
+PARSE_ERROR = -32700
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+SERVER_ERROR = -32000
+
+
+def socket_path_for(workspace_path: Path|str):
+    return f"{workspace_path}{SOCKET_SUFFIX}"
+
+
+def is_socket_served(socket_path: str):
+    """Whether a server is listening on the socket (and not just left behind by one that crashed)"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        try:
+            probe.connect(socket_path)
+            return True
+        except OSError:
+            return False
+
+
+class RPCError(Exception):
+    def __init__(self, code: int, message: str):
+        super().__init__(message)
+        self.code = code
+
+
+class WorkspaceServer:
+    """Serves a single workspace. The file is still locked for every write, so users that don't go through
+    the server (and other servers) can share it safely"""
+
+    def __init__(self, workspace: Workspace):
+        self.workspace = workspace
+        self.socket_path = socket_path_for(workspace.workspace_path)
+        self.tasks = Tasks.from_workspace(workspace)
+        self.tasks.registry = Workspaces(global_config.WORKSPACES_FILE.value, global_config.WORKSPACES_LOCK_FILE.value)
+        self._subscribers: set[asyncio.StreamWriter] = set()
+        # Everything that uses the workspace runs on this thread, one call at a time, so reading and writing the file
+        # doesn't hold up the event loop. The connection of the shelf can only be used by the thread that opened it
+        self._worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"server {Path(workspace.workspace_path).name}")
+        self._lock_mutex = asyncio.Lock()  # Commits and reloads take the lock of the file one after the other
+        self._methods: dict[str, Callable[..., Awaitable[Any]]] = {
+            "tree": self.tree,
+            "notes": self.notes,
+            "commit": self.commit,
+        }
+
+    async def _run(self, function: Callable[..., Any], *args):
+        """Run a function that uses the workspace on the worker thread"""
+        return await asyncio.get_running_loop().run_in_executor(self._worker, function, *args)
+
+    async def _run_locked(self, function: Callable[..., Any], *args):
+        """Run a function on the worker thread while holding the lock of the file. While another user holds it,
+        it is tried again every LOCK_RETRY_INTERVAL seconds, and the requests of the other clients are served
+        in the meantime. Raises TimeOutError after lock_acquire_timeout seconds"""
+        async with self._lock_mutex:
+            deadline = time.monotonic() + global_config.LOCK_ACQUIRE_TIMEOUT.value
+            while not await self._run(self._try_lock):
+                if time.monotonic() >= deadline:
+                    raise TimeOutError(f"Timed out waiting for the lock of {self.workspace.workspace_path}")
+                await asyncio.sleep(LOCK_RETRY_INTERVAL)
+
+            try:
+                return await self._run(function, *args)
+            finally:
+                await self._run(self.tasks.unlock)
+
+    def _try_lock(self):
+        try:
+            self.tasks.lock(timeout=0)
+            return True
+        except TimeOutError:
+            return False
+
+    def _reload_if_outdated_nolock(self):
+        """Returns whether the workspace was loaded again"""
+        if not self.tasks.is_outdated():
+            return False
+        self.tasks.reload_nolock()
+        return True
+
+    async def serve(self):
+        if os.path.exists(self.socket_path):
+            if is_socket_served(self.socket_path):
+                raise RuntimeError(f"{self.workspace.workspace_path} is already served")
+            os.unlink(self.socket_path)  # Left behind by a server that crashed
+
+        try:
+            await self._run_locked(self.tasks.reopen_shelve_nolock)
+            server = await asyncio.start_unix_server(self._handle_client, path=self.socket_path)
+            logging.info(f"Serving {self.workspace.workspace_path} on {self.socket_path}")
+            try:
+                async with server:
+                    await asyncio.gather(server.serve_forever(), self._watch_file())
+            finally:
+                if os.path.exists(self.socket_path):
+                    os.unlink(self.socket_path)
+                await self._run(self.tasks.cleanup)
+        finally:
+            self._worker.shutdown()
+
+    async def _watch_file(self):
+        """Pick up the saves of users that don't go through the server"""
+        while True:
+            await asyncio.sleep(global_config.REFRESH_INTERVAL.value)
+            if not await self._run(self.tasks.is_outdated):
+                continue
+            try:
+                reloaded = await self._run_locked(self._reload_if_outdated_nolock)
+            except TimeOutError:
+                continue  # Tried again after the next interval
+            if reloaded:
+                await self._notify_subscribers()
+
+    async def _notify_subscribers(self):
+        notification = {"jsonrpc": "2.0", "method": "changed", "params": {"generation": self.tasks.generation}}
+        for writer in list(self._subscribers):
+            try:
+                await self._send(writer, notification)
+            except ConnectionError:
+                self._subscribers.discard(writer)
+
+    async def _send(self, writer: asyncio.StreamWriter, message: dict):
+        writer.write(json.dumps(message).encode() + b"\n")
+        await writer.drain()
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while line := await reader.readline():
+                response, changed = await self._handle_request(line, writer)
+                if response is not None:
+                    await self._send(writer, response)
+                if changed:
+                    await self._notify_subscribers()
+        except ConnectionError:
+            pass
+        finally:
+            self._subscribers.discard(writer)
+            writer.close()
+
+    async def _handle_request(self, line: bytes, writer: asyncio.StreamWriter):
+        """Returns the response (None for notifications) and whether the workspace changed"""
+        changed = False
+        request_id = None
+        try:
+            try:
+                request = json.loads(line)
+                request_id = request.get("id")
+                method, params = request["method"], request.get("params", {})
+            except (ValueError, KeyError, AttributeError):
+                raise RPCError(PARSE_ERROR, "Invalid request")
+
+            if method == "subscribe":
+                self._subscribers.add(writer)
+                result = {"generation": self.tasks.generation}
+            elif method in self._methods:
+                try:
+                    inspect.signature(self._methods[method]).bind(**params)
+                except TypeError as e:
+                    raise RPCError(INVALID_PARAMS, str(e))
+                result = await self._methods[method](**params)
+                changed = method == "commit"  # Every commit is saved
+            else:
+                raise RPCError(METHOD_NOT_FOUND, f"Unknown method '{method}'")
+            response = {"jsonrpc": "2.0", "id": request_id, "result": result}
+        except RPCError as e:
+            response = {"jsonrpc": "2.0", "id": request_id, "error": {"code": e.code, "message": str(e)}}
+        except Exception as e:
+            logging.error(f"Request failed: {e}")
+            response = {"jsonrpc": "2.0", "id": request_id, "error": {"code": SERVER_ERROR, "message": str(e)}}
+
+        return (response if request_id is not None else None), changed
+
+    async def tree(self):
+        def read_tree():
+            return {
+                "generation": self.tasks.generation,
+                "archive_index": self.tasks.archive_index,
+                "tasks": [task.to_dict() for task in self.tasks.root_task.children],
+            }
+        return await self._run(read_tree)
+
+    async def notes(self, ids: list[int]):
+        def read_notes():
+            tasks = {task.item_id: task for task in self.tasks.all_ordered_tasks}
+            return {str(item_id): self.tasks.get_extra_info(tasks[item_id]) for item_id in ids if item_id in tasks}
+        return await self._run(read_notes)
+
+    async def commit(self, changes: dict, notes: dict[str, str|None]):
+        def commit_nolock():
+            self._reload_if_outdated_nolock()
+            result = self.tasks.apply_changes_nolock(Changeset.from_json(changes),
+                                                     {int(item_id): note for item_id, note in notes.items()})
+            self.tasks.write_loaded_state_nolock()
+            return {
+                "generation": self.tasks.generation,
+                "conflicts": result.conflicts,
+                "id_changes": {str(old_id): new_id for old_id, new_id in result.id_changes.items()},
+            }
+
+        try:
+            return await self._run_locked(commit_nolock)
+        except TimeOutError:
+            raise RPCError(SERVER_ERROR, "Another user is holding the lock of the workspace")
+
+
+def serve_workspaces(workspace_paths: list[str]) -> int:
+    """Serve the given workspaces until interrupted"""
+    if not workspace_paths:
+        print("Usage: calcuresu serve <workspace> [<workspace> ...]")
+        return 1
+
+    servers = []
+    for workspace_path in workspace_paths:
+        if not Path(workspace_path).is_file():
+            print(f"{workspace_path}: no such workspace")
+            return 1
+        servers.append(WorkspaceServer(Workspace(workspace_path)))
+
+    async def serve_all():
+        serving = asyncio.gather(*(server.serve() for server in servers))
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, serving.cancel)
+        try:
+            await serving
+        except asyncio.CancelledError:
+            pass
+
+    for server in servers:
+        print(f"Serving {server.workspace.workspace_path} on {server.socket_path}")
+    try:
+        asyncio.run(serve_all())
+    except KeyboardInterrupt:
+        pass
+    except RuntimeError as e:
+        print(e)
+        return 1
+    return 0
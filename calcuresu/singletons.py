@@ -1,7 +1,9 @@
 # Initialise config:
 from calcuresu.configuration import Config
 from calcuresu.errors import Error
+from calcuresu.tracing import Tracer
 
 
 global_config = Config()
-error = Error(global_config.LOG_FILE.value)
\ No newline at end of file
+error = Error(global_config.LOG_FILE.value)
+tracer = Tracer(global_config.TRACE_FILE.value)
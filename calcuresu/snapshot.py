@@ -0,0 +1,255 @@
+"""Module that reads and writes memory-mapped columnar snapshots of a task tree.
+
+A snapshot stores every task field in a fixed-width column (one array per field) in display order,
+plus a heap for the strings and the timer stamps. Opening one only maps the file, and rows are turned
+into Task objects only when something (usually the viewport) touches them. Snapshots are read-only:
+the full shelf is loaded as soon as the user edits something.
+"""
+
+from array import array
+from bisect import bisect_left
+from datetime import date, datetime
+import mmap
+import os
+from pathlib import Path
+import struct
+from typing import Iterator, List, Tuple
+
+from calcuresu.classes.task import RootTask, Task
+from calcuresu.consts import Importance, Status
+
+
+SNAPSHOT_MAGIC = b"CLCSNAP1"
+SNAPSHOT_VERSION = 2
+
+# (section name, array typecode). The order is the order on disk.
+SNAPSHOT_SECTIONS = [
+    ("item_id", "q"),
+    ("parent_id", "q"),
+    ("depth", "i"),
+    ("status", "B"),
+    ("importance", "B"),
+    ("flags", "B"),
+    ("deadline", "i"),       # date ordinal, 0 = no deadline
+    ("archive_date", "d"),   # timestamp, 0 = not archived
+    ("name_offset", "Q"),
+    ("name_length", "I"),
+    ("extra_info_length", "I"),  # notes themselves stay in the shelf
+    ("stamps_offset", "Q"),
+    ("stamps_count", "I"),
+    ("journal_rows", "I"),   # rows of the journal screen (collapsed and archived tasks hidden)
+    ("archive_rows", "I"),   # rows of the archive screen
+    ("id_order", "I"),       # rows sorted by item id
+    ("strings", "B"),
+    ("stamps", "d"),
+]
+
+FLAG_PRIVACY = 1 << 0
+FLAG_COLLAPSE = 1 << 1
+
+# magic, version, row count, running timers, generation of the shelf this was written from
+HEADER_FORMAT = "<8sIQQQ"
+SECTION_FORMAT = "<QQ"  # offset, length in bytes
+
+
+def snapshot_filename_for(shelve_filename: Path | str):
+    return f"{shelve_filename}.snap"
+
+
+def _walk_tree(root_task: RootTask) -> Iterator[Tuple[Task, int, bool]]:
+    """Go over the tree in display order, yielding (task, depth, hidden by a collapsed ancestor)"""
+    stack = [(child, 0, False) for child in reversed(root_task.children)]
+    while stack:
+        task, depth, hidden = stack.pop()
+        yield task, depth, hidden
+
+        hide_children = hidden or task.collapse
+        stack.extend((child, depth + 1, hide_children) for child in reversed(task.children))
+
+
+def write_snapshot(filename: Path | str, root_task: RootTask, generation: int):
+    """Write a snapshot of the whole tree. The file is replaced atomically"""
+    columns = {name: array(typecode) for name, typecode in SNAPSHOT_SECTIONS}
+    strings = bytearray()
+    running_timers = 0
+
+    for row, (task, depth, hidden) in enumerate(_walk_tree(root_task)):
+        columns["item_id"].append(task.item_id)
+        columns["parent_id"].append(task.parent_id)
+        columns["depth"].append(depth)
+        columns["status"].append(task.status.value)
+        columns["importance"].append(task.importance.value)
+        columns["flags"].append((FLAG_PRIVACY if task.privacy else 0) | (FLAG_COLLAPSE if task.collapse else 0))
+        columns["deadline"].append(task.deadline.toordinal() if task.deadline is not None else 0)
+        columns["archive_date"].append(task.archive_date.timestamp() if task.archive_date is not None else 0)
+
+        encoded_name = task.name.encode("utf-8")
+        columns["name_offset"].append(len(strings))
+        columns["name_length"].append(len(encoded_name))
+        strings += encoded_name
+        columns["extra_info_length"].append(task.extra_info_length)
+
+        columns["stamps_offset"].append(len(columns["stamps"]))
+        columns["stamps_count"].append(len(task.timer.stamps))
+        columns["stamps"].extend(float(stamp) for stamp in task.timer.stamps)
+        if task.timer.is_counting:
+            running_timers += 1
+
+        if task.is_archived:
+            columns["archive_rows"].append(row)
+        elif not hidden:
+            columns["journal_rows"].append(row)
+
+    item_ids = columns["item_id"]
+    columns["id_order"] = array("I", sorted(range(len(item_ids)), key=item_ids.__getitem__))
+    columns["strings"] = array("B", strings)
+
+    header_size = struct.calcsize(HEADER_FORMAT) + struct.calcsize(SECTION_FORMAT) * len(SNAPSHOT_SECTIONS)
+    section_table = bytearray()
+    offset = header_size
+    for name, _ in SNAPSHOT_SECTIONS:
+        offset += -offset % 8  # Keep every column aligned
+        length = len(columns[name]) * columns[name].itemsize
+        section_table += struct.pack(SECTION_FORMAT, offset, length)
+        offset += length
+
+    temp_filename = f"{filename}.tmp"
+    with open(temp_filename, "wb") as f:
+        f.write(struct.pack(HEADER_FORMAT, SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(item_ids), running_timers, generation))
+        f.write(section_table)
+        for name, _ in SNAPSHOT_SECTIONS:
+            f.write(b"\0" * (-f.tell() % 8))
+            columns[name].tofile(f)
+
+    os.replace(temp_filename, filename)
+
+
+class Snapshot:
+    """Read-only, memory-mapped view of a snapshot file"""
+
+    def __init__(self, filename: Path | str):
+        with open(filename, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        header_size = struct.calcsize(HEADER_FORMAT)
+        magic, version, self.row_count, self.running_timers, self.generation = \
+            struct.unpack_from(HEADER_FORMAT, self._mmap, 0)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            self._mmap.close()
+            raise ValueError(f"{filename} is not a supported snapshot file")
+
+        self._buffer = memoryview(self._mmap)
+        self._columns = {}
+        for index, (name, typecode) in enumerate(SNAPSHOT_SECTIONS):
+            offset, length = struct.unpack_from(SECTION_FORMAT, self._mmap, header_size + index * struct.calcsize(SECTION_FORMAT))
+            self._columns[name] = self._buffer[offset:offset + length].cast(typecode)
+
+        self._materialized: dict[int, Task] = {}
+        self.all_tasks = LazyTaskList(self, range(self.row_count))
+        self.journal_tasks = LazyTaskList(self, self._columns["journal_rows"])
+        self.archived_tasks = LazyTaskList(self, self._columns["archive_rows"])
+
+    @classmethod
+    def open_if_fresh(cls, filename: Path | str, generation: int):
+        """Open the snapshot only if it was written from the current version of the shelf"""
+        try:
+            snapshot = cls(filename)
+        except (OSError, ValueError, struct.error):
+            return None
+
+        if snapshot.generation != generation:
+            snapshot.close()
+            return None
+
+        return snapshot
+
+    def close(self):
+        for column in self._columns.values():
+            column.release()
+        self._buffer.release()
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass  # Someone still holds a view, the mapping is freed with it
+
+    def _string(self, offset: int, length: int):
+        return bytes(self._columns["strings"][offset:offset + length]).decode("utf-8")
+
+    def row_of_id(self, item_id: int):
+        item_ids = self._columns["item_id"]
+        id_order = self._columns["id_order"]
+        index = bisect_left(id_order, item_id, key=item_ids.__getitem__)
+        if index == len(id_order) or item_ids[id_order[index]] != item_id:
+            raise ValueError()
+        return id_order[index]
+
+    def depth_of_row(self, row: int):
+        return self._columns["depth"][row]
+
+    def name_of_row(self, row: int):
+        return self._string(self._columns["name_offset"][row], self._columns["name_length"][row])
+
+    def column(self, name: str) -> memoryview:
+        """A whole column, without building any task. It must not be used after the snapshot is closed"""
+        return self._columns[name]
+
+    def unarchived_tasks(self):
+        """All the tasks that are not archived, including the ones hidden by collapsed parents"""
+        archive_dates = self._columns["archive_date"]
+        return LazyTaskList(self, [row for row in range(self.row_count) if not archive_dates[row]])
+
+    def materialize(self, row: int) -> Task:
+        """Build (once) the Task object of a row. Its children are not linked"""
+        task = self._materialized.get(row)
+        if task is None:
+            task = self.read_row(row)
+            self._materialized[row] = task
+        return task
+
+    def read_row(self, row: int) -> Task:
+        """Build a new Task object for a row, without keeping it. Its children are not linked"""
+        columns = self._columns
+        stamps_offset = columns["stamps_offset"][row]
+        stamps: List = list(columns["stamps"][stamps_offset:stamps_offset + columns["stamps_count"][row]])
+        flags = columns["flags"][row]
+
+        task = Task(columns["item_id"][row],
+                    self._string(columns["name_offset"][row], columns["name_length"][row]),
+                    Status(columns["status"][row]),
+                    stamps,
+                    bool(flags & FLAG_PRIVACY),
+                    parent_id=columns["parent_id"][row],
+                    importance=Importance(columns["importance"][row]),
+                    collapse=bool(flags & FLAG_COLLAPSE))
+        task.extra_info_length = columns["extra_info_length"][row]
+
+        deadline = columns["deadline"][row]
+        if deadline:
+            task.deadline = date.fromordinal(deadline)
+        archive_date = columns["archive_date"][row]
+        if archive_date:
+            task.archive_date = datetime.fromtimestamp(archive_date)
+        return task
+
+
+class LazyTaskList:
+    """List-like sequence of snapshot rows that materializes tasks only when they are accessed"""
+
+    def __init__(self, snapshot: Snapshot, rows):
+        self._snapshot = snapshot
+        self._rows = rows
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __bool__(self):
+        return len(self._rows) > 0
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return LazyTaskList(self._snapshot, self._rows[index])
+        return self._snapshot.materialize(self._rows[index])
+
+    def __iter__(self):
+        for row in self._rows:
+            yield self._snapshot.materialize(row)
@@ -0,0 +1,94 @@
+"""Module that records a timeline of the program in the chrome trace-event format"""
+
+from collections import deque
+from contextlib import contextmanager, nullcontext
+import functools
+import json
+import logging
+import os
+from pathlib import Path
+import threading
+import time
+
+
+MAX_TRACE_EVENTS = 1_000_000  # Oldest spans are dropped so long sessions don't grow without bound
+
+
+class Tracer:
+    """Opt-in recorder of duration spans.
+    The recorded spans are written as chrome trace-event JSON (open it in chrome://tracing or perfetto).
+    When no trace file is configured every hook is a no-op, and decorated functions are left untouched"""
+
+    def __init__(self, trace_file: Path | str):
+        self.trace_file = Path(trace_file).expanduser() if trace_file else None
+        self.enabled = self.trace_file is not None
+        self.events: deque[dict] = deque(maxlen=MAX_TRACE_EVENTS)
+        self._pid = os.getpid()
+        self._events_lock = threading.Lock()
+
+    def _record(self, name: str, category: str, start_ns: int, end_ns: int, args: dict):
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",  # Complete event (has a duration)
+            "ts": start_ns / 1000,
+            "dur": (end_ns - start_ns) / 1000,
+            "pid": self._pid,
+            "tid": threading.get_ident(),
+        }
+        if args:
+            event["args"] = {key: str(value) for key, value in args.items()}
+
+        with self._events_lock:
+            self.events.append(event)
+
+    @contextmanager
+    def _span(self, name: str, category: str, args: dict):
+        start_ns = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            self._record(name, category, start_ns, time.perf_counter_ns(), args)
+
+    def record(self, name: str, category: str, start_ns: int, end_ns: int, **args):
+        """Record a span whose start and end were measured elsewhere (with time.perf_counter_ns)"""
+        if self.enabled:
+            self._record(name, category, start_ns, end_ns, args)
+
+    def span(self, name: str, category: str = "calcuresu", **args):
+        """Context manager that records the time spent inside of it"""
+        if not self.enabled:
+            return nullcontext()
+
+        return self._span(name, category, args)
+
+    def traced(self, name: str | None = None, category: str = "calcuresu"):
+        """Decorator that records a span for every call of the function"""
+        def decorator(func):
+            if not self.enabled:
+                return func
+
+            span_name = name or func.__qualname__
+
+            @functools.wraps(func)
+            def inner(*args, **kwargs):
+                with self._span(span_name, category, {}):
+                    return func(*args, **kwargs)
+
+            return inner
+
+        return decorator
+
+    def flush(self):
+        """Write all the recorded spans to the trace file"""
+        if not self.enabled or self.trace_file is None:
+            return
+
+        with self._events_lock:
+            events = list(self.events)
+
+        try:
+            with open(self.trace_file, "w", encoding="utf-8") as f:
+                json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        except OSError as e:
+            logging.error(f"Could not write trace file: {e}")
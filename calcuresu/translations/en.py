@@ -34,13 +34,15 @@ KEYS_GENERAL = {
         "   ?   ": "Toggle this help",
         "   Q   ": "Reload",
         "   q   ": "Quit",
-        "  1-6  ": "Alternate between windows",
+        "  0-9  ": "Alternate between windows",
 }
 
 KEYS_ARCHIVE = {
         "   o   ": "View/Modify task's extra info",
         "   /   ": "Apply filter to archived tasks",
         "   x   ": "Restore to journal (supports children)",
+        "   y   ": "Show archived tasks of a yearly rollup",
+        "   C   ": "Compact the workspace (apply retention)",
         " PGDWN ": "Go 6 tasks down",
         " PGDUP ": "Go 6 tasks up",
         "   ↑   ": "Go 1 task up",
@@ -71,8 +73,10 @@ KEYS_JOURNAL = {
         "   s   ": "Modify status",
         "   d   ": "Mark as done",
         "   .   ": "Toggle privacy mode",
+        "  v(V) ": "Mark/unmark tasks (clear all marks)",
         "  t(T) ": "Start/Stop/(reset) timer",
         "  f(F) ": "Apply/(reset) deadline",
+        "  u(U) ": "Undo/(redo) the last change",
         " PGDWN ": "Go 6 tasks down",
         " PGDUP ": "Go 6 tasks up",
         "   ↑   ": "Go 1 task up",
@@ -125,6 +129,9 @@ MSG_TS_CHILDREN_DEL = "Delete all children too?"
 MSG_TS_CHILDREN_ARCHIVE = "Archive all children too?"
 MSG_TS_ARCHIVE = "Archive task number: "
 MSG_TS_DEL_ALL    = "Really delete all tasks?"
+MSG_TS_ROLLUP_YEAR = "Show rollup of year: "
+MSG_TS_ROLLUP_YEAR_TIP = "Available years: {years} (leave empty to hide the rollups)"
+MSG_TS_COMPACT    = "Move old archived tasks to the yearly rollups and compact the workspace?"
 MSG_TS_ARCHIVE_ALL    = "Really archive all tasks?"
 MSG_WS_DEL        = "Delete workspace number: "
 MSG_TS_EDT_ALL    = "Do you confirm this action?"
@@ -138,7 +145,13 @@ MSG_TS_IM         = "Import tasks from Calcurse?"
 MSG_TS_TW         = "Import tasks from Taskwarrior?"
 MSG_TS_NOTHING    = "Nothing planned..."
 MSG_TS_NO_WORKSPACES    = "No workspaces found. Create a new one by clicking 'a'"
+MSG_SEARCH_TITLE  = "Search all workspaces"
+MSG_SEARCH_EMPTY  = "Press '/' to search the tasks of every workspace"
+MSG_SEARCH_LOAD   = "Open the workspace of result number: "
+MSG_AGENDA_TITLE  = "Agenda of all workspaces"
+MSG_REPORT_TITLE  = "Time report of the workspace"
 MSG_TS_PRIVACY    = "Toggle privacy of task number: "
+MSG_TS_MARK       = "Mark/unmark task numbers: "
 MSG_TS_DEAD_ADD   = "Add deadline for task number: "
 MSG_TS_DEAD_DEL   = "Remove deadline of the task number: "
 MSG_TS_DEAD_DATE  = "Add deadline on (YYYY/MM/DD): "
@@ -149,8 +162,11 @@ MSG_GOTO          = "Go to date (YYYY/MM/DD): "
 MSG_GOTO_D        = "Go to date: "
 
 JOURNAL_HINT      = "Space · Switch to archive   a · Add   d · Done   s · Status   i · Importance   / · Filter  ? · All keybindings"
-ARCHIVE_HINT      = "Space · Switch to journal   x · Restore   o · Extra Info   / · Filter  ? · All keybindings"
+ARCHIVE_HINT      = "Space · Switch to journal   x · Restore   o · Extra Info   / · Filter   y · Rollups  ? · All keybindings"
 WORKSPACE_HINT      = "a · Add   l · Load   x · Delete  ? · All keybindings"
+SEARCH_HINT      = "/ · Search   l · Open the workspace of a result   ? · All keybindings"
+AGENDA_HINT      = "↑↓ · Scroll   Q · Reload   ? · All keybindings"
+REPORT_HINT      = "↑↓ · Scroll   Q · Reload   ? · All keybindings"
 
 DAYS = ["MONDAY", "TUESDAY", "WEDNESDAY", "THURSDAY", "FRIDAY", "SATURDAY", "SUNDAY"]
 DAYS_PERSIAN = ["SHANBEH", "YEKSHANBEH", "DOSHANBEH", "SESHANBEH", "CHAHARSHANBEH", "PANJSHANBEH", "JOMEH"]
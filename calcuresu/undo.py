@@ -0,0 +1,287 @@
+"""Module that keeps the undo/redo history of a workspace.
+
+An action (everything that is saved together, e.g. archiving a selection) is kept as the list of operations
+that revert it, not as a copy of the tree. Operations refer to tasks by id, since the tree is loaded again
+after every save. Applying an operation goes through the same methods of Tasks as any other edit, so it
+records its own inverse, which becomes the redo (or undo) step. Deleted subtrees are kept as they were
+detached, so undoing a deletion puts the same objects back without copying them.
+"""
+
+from collections import deque
+import logging
+from typing import TYPE_CHECKING, Any, Callable, Iterable, List
+
+from calcuresu.classes.task import RootTask, Task
+
+if TYPE_CHECKING:
+    from calcuresu.data import Tasks
+
+
+OPERATION_SIZE = 100  # Rough bytes taken by an operation, or by a task id and an old value in one
+TASK_SIZE = 400  # Rough bytes taken by a task kept in the history (see workspace_cache.estimated_size)
+
+
+class TaskIndex:
+    """Tasks by id, built once per undo instead of searching the tree for every operation"""
+
+    def __init__(self, root: RootTask, find_missing: Callable[[int], Task|None]) -> None:
+        self._by_id: dict[int, Task|RootTask] = {0: root}
+        # Gives the root of the subtree of a task that is not in the task tree (e.g. in the archive cold segment)
+        self._find_missing = find_missing
+        self.add(root.children)
+        self.missing = 0
+
+    def add(self, roots: Iterable[Task]):
+        stack = list(roots)
+        while stack:
+            task = stack.pop()
+            self._by_id[task.item_id] = task
+            stack.extend(task.children)
+
+    def get(self, item_id: int) -> Task|RootTask|None:
+        task = self._by_id.get(item_id)
+        if task is None:
+            subtree_root = self._find_missing(item_id)
+            if subtree_root is None:
+                self.missing += 1
+                return None
+            self.add([subtree_root])
+            task = self._by_id[item_id]
+        return task
+
+
+class Operation:
+    """A change to the tasks that reverts part of an action"""
+
+    size = OPERATION_SIZE
+
+    def apply(self, tasks: "Tasks", index: TaskIndex):
+        raise NotImplementedError()
+
+
+class SetFields(Operation):
+    """Give a field of several tasks back their values. "stamps" stands for the stamps of the timer"""
+
+    def __init__(self, field: str, values: dict[int, Any]) -> None:
+        self.field = field
+        self.values = values
+
+    def apply(self, tasks: "Tasks", index: TaskIndex):
+        for item_id, value in self.values.items():
+            task = index.get(item_id)
+            if isinstance(task, Task):
+                tasks.set_task_field(task, self.field, value)
+
+
+class SetNote(Operation):
+    def __init__(self, item_id: int, note: str) -> None:
+        self.item_id = item_id
+        self.note = note
+
+    @property
+    def size(self):
+        return OPERATION_SIZE + len(self.note)
+
+    def apply(self, tasks: "Tasks", index: TaskIndex):
+        task = index.get(self.item_id)
+        if isinstance(task, Task):
+            tasks.set_extra_info(task, self.note)
+
+
+class MoveTask(Operation):
+    """Put a task back at a place among the children of a parent"""
+
+    def __init__(self, item_id: int, parent_id: int, position: int) -> None:
+        self.item_id = item_id
+        self.parent_id = parent_id
+        self.position = position
+
+    def apply(self, tasks: "Tasks", index: TaskIndex):
+        task = index.get(self.item_id)
+        parent = index.get(self.parent_id)
+        current_parent = index.get(task.parent_id) if isinstance(task, Task) else None
+        if isinstance(task, Task) and parent is not None and current_parent is not None:
+            tasks.place_task(task, current_parent, parent, self.position)
+
+
+class SwapTasks(Operation):
+    """Its own inverse"""
+
+    def __init__(self, first_id: int, second_id: int) -> None:
+        self.first_id = first_id
+        self.second_id = second_id
+
+    def apply(self, tasks: "Tasks", index: TaskIndex):
+        first, second = index.get(self.first_id), index.get(self.second_id)
+        if isinstance(first, Task) and isinstance(second, Task):
+            tasks.swap_task(first, second)
+
+
+class InsertTask(Operation):
+    """Put a deleted task back (at the end of its parent when position is None). Either with its whole subtree,
+    or alone - then it takes back the children that were moved up to its parent when it was deleted (adopted_ids)"""
+
+    def __init__(self, task: Task, parent_id: int, position: int|None, notes: dict[int, str], adopted_ids: List[int]|None) -> None:
+        self.task = task
+        self.parent_id = parent_id
+        self.position = position
+        self.notes = notes
+        self.adopted_ids = adopted_ids
+
+    @property
+    def size(self):
+        task_count = 0
+        stack = [self.task]
+        while stack:
+            task = stack.pop()
+            task_count += 1
+            stack.extend(task.children)
+        return OPERATION_SIZE + TASK_SIZE * task_count + sum(len(note) for note in self.notes.values()) \
+            + OPERATION_SIZE * len(self.adopted_ids or [])
+
+    def apply(self, tasks: "Tasks", index: TaskIndex):
+        parent = index.get(self.parent_id)
+        if parent is None:
+            parent = tasks.root_task  # Its parent was deleted since, like the cold segment does with orphans
+
+        adopted: List[Task]|None = None
+        if self.adopted_ids is not None:
+            adopted = []
+            for item_id in self.adopted_ids:
+                child = index.get(item_id)
+                current_parent = index.get(child.parent_id) if isinstance(child, Task) else None
+                if isinstance(child, Task) and current_parent is not None:
+                    adopted.append(child)
+                    current_parent.children.remove(child)
+
+        tasks.insert_task(self.task, parent, self.position, self.notes, adopted)
+        index.add([self.task])
+
+
+class RemoveTask(Operation):
+    def __init__(self, item_id: int, with_children: bool) -> None:
+        self.item_id = item_id
+        self.with_children = with_children
+
+    def apply(self, tasks: "Tasks", index: TaskIndex):
+        if isinstance(index.get(self.item_id), Task):
+            tasks.delete_task(self.item_id, self.with_children)
+
+
+class Action:
+    """The operations that revert one saved edit, in the order they were recorded"""
+
+    def __init__(self) -> None:
+        self.operations: List[Operation] = []
+        self.size = 0
+
+    def add(self, operation: Operation):
+        self.operations.append(operation)
+        self.size += operation.size
+
+    def add_field(self, field: str, item_id: int, value: Any):
+        # Consecutive changes of the same field (e.g. of a whole selection) share one operation
+        last = self.operations[-1] if self.operations else None
+        if not (isinstance(last, SetFields) and last.field == field):
+            last = SetFields(field, {})
+            self.operations.append(last)
+        if item_id not in last.values:  # Undo goes back to the value from before the action
+            last.values[item_id] = value
+            self.size += OPERATION_SIZE + (len(value) if isinstance(value, str) else 0)
+
+
+class UndoHistory:
+    """Undo and redo stacks of actions, that together take at most memory_limit bytes (the oldest
+    actions are dropped first). Operations are recorded until the edit is saved, which ends the action"""
+
+    def __init__(self, memory_limit: int) -> None:
+        self.memory_limit = memory_limit
+        self._undo: deque[Action] = deque()
+        self._redo: deque[Action] = deque()
+        self._size = 0
+        self._recording = Action()
+        self._replayed: tuple[deque[Action], Action]|None = None  # The undone (or redone) action until it is saved
+
+    @property
+    def can_undo(self):
+        return bool(self._undo)
+
+    @property
+    def can_redo(self):
+        return bool(self._redo)
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def recording(self):
+        return self.memory_limit > 0
+
+    def record(self, operation: Operation):
+        if self.recording:
+            self._recording.add(operation)
+
+    def record_field(self, field: str, item_id: int, value: Any):
+        if self.recording:
+            self._recording.add_field(field, item_id, value)
+
+    def start_undo(self):
+        """Take the last action, to be applied. What it records while it is applied becomes the redo step"""
+        return self._start_replay(self._undo)
+
+    def start_redo(self):
+        return self._start_replay(self._redo)
+
+    def _start_replay(self, stack: deque[Action]):
+        if self._replayed is not None or self._recording.operations:
+            self.end_action()  # Edits are saved before the next one starts, so there is nothing pending here
+        if not stack:
+            return None
+        action = stack.pop()
+        self._size -= action.size
+        self._replayed = (stack, action)
+        return action
+
+    def end_action(self):
+        """The recorded operations were saved, so they become one step of the history"""
+        action, self._recording = self._recording, Action()
+        replayed, self._replayed = self._replayed, None
+        if not action.operations:
+            return
+
+        if replayed is None:
+            stack = self._undo
+            self._size -= sum(redone.size for redone in self._redo)
+            self._redo.clear()  # A new edit starts a new branch
+        else:
+            stack = self._redo if replayed[0] is self._undo else self._undo
+
+        if action.size > self.memory_limit:
+            logging.warning("The last change is too large to be undone, so the undo history was cleared")
+            self.clear()
+            return
+
+        stack.append(action)
+        self._size += action.size
+        self._evict()
+
+    def discard_action(self, keep_replayed: bool = True):
+        """The recorded operations can't be undone, since they were not saved (or were merged with the changes
+        of another user). An action that was being undone goes back to its stack, unless it was partly saved"""
+        self._recording = Action()
+        replayed, self._replayed = self._replayed, None
+        if replayed is not None and keep_replayed:
+            stack, action = replayed
+            stack.append(action)
+            self._size += action.size
+
+    def _evict(self):
+        while self._size > self.memory_limit:
+            stack = self._undo if self._undo else self._redo
+            self._size -= stack.popleft().size
+
+    def clear(self):
+        self._undo.clear()
+        self._redo.clear()
+        self._size = 0
@@ -0,0 +1,32 @@
+from datetime import date
+import time
+
+from calcuresu.aggregates import SubtreeAggregate
+from calcuresu.base_view import View
+from calcuresu.classes.timer import Timer
+from calcuresu.colors import Color
+from calcuresu.report import format_seconds
+
+
+class SubtreeAggregateView(View):
+    """Display the totals of the subtasks of a collapsed task"""
+
+    def __init__(self, stdscr, y, x, aggregate: SubtreeAggregate, own_timer: Timer):
+        super().__init__(stdscr, y, x)
+        self.aggregate = aggregate
+        self.own_timer = own_timer
+
+    @property
+    def text(self):
+        parts = [f"{self.aggregate.done}/{self.aggregate.count} done"]
+        seconds = self.aggregate.seconds_at(time.time())
+        if seconds > 0:
+            # The time of the whole subtree, the task's own timer included
+            parts.append(f"{format_seconds(seconds + self.own_timer.total_seconds)} tracked")
+        if self.aggregate.deadline is not None:
+            parts.append(f"next due {date.fromordinal(self.aggregate.deadline)}")
+        return f"[{', '.join(parts)}]"
+
+    def render(self):
+        color = Color.TIMER if self.aggregate.running else Color.HINTS
+        self.display_line(self.y, self.x, self.text, color)
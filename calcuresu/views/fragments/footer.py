@@ -3,7 +3,7 @@ from calcuresu.colors import Color
 from calcuresu.configuration import AppState
 from calcuresu.dialogues import clear_line
 from calcuresu.singletons import global_config
-from calcuresu.translations.en import ARCHIVE_HINT, JOURNAL_HINT, WORKSPACE_HINT
+from calcuresu.translations.en import AGENDA_HINT, ARCHIVE_HINT, JOURNAL_HINT, REPORT_HINT, SEARCH_HINT, WORKSPACE_HINT
 
 class FooterView(View):
     """Display the footer with keybinding"""
@@ -39,6 +39,12 @@ class FooterView(View):
             keybinds = ARCHIVE_HINT
         if self.screen.state == AppState.WIZARD:
             keybinds = WORKSPACE_HINT
+        elif self.screen.state == AppState.SEARCH:
+            keybinds = SEARCH_HINT
+        elif self.screen.state == AppState.AGENDA:
+            keybinds = AGENDA_HINT
+        elif self.screen.state == AppState.REPORT:
+            keybinds = REPORT_HINT
         else:
             keybinds = ""
         self.display_line(self.screen.y_max - 3, (self.screen.x_max - len(keybinds)) // 2, keybinds, Color.HINTS)
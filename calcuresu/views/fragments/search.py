@@ -0,0 +1,61 @@
+from calcuresu.base_view import View
+from calcuresu.colors import Color
+from calcuresu.data import Status
+from calcuresu.screen import Screen
+from calcuresu.search import SearchHit, WorkspaceSearch
+from calcuresu.translations.en import MSG_SEARCH_EMPTY
+
+
+STATUS_COLORS = {
+    Status.NOT_STARTED: Color.NOT_STARTED,
+    Status.WIP: Color.WIP,
+    Status.CURRENT_MISSION: Color.CURRENT_MISSION,
+    Status.WAITING: Color.WAITING,
+    Status.DONE: Color.DONE,
+}
+
+
+class SearchHitView(View):
+    """Display a single search result"""
+
+    def __init__(self, stdscr, y, x, hit: SearchHit, number: int):
+        super().__init__(stdscr, y, x)
+        self.hit = hit
+        self.number = number
+
+    def render(self):
+        number = f"{self.number}"
+        self.display_line(self.y, self.x, number, Color.ACTIVE_PANE)
+
+        workspace_indent = self.x + 6
+        workspace_path = str(self.hit.workspace_path)
+        self.display_line(self.y, workspace_indent, workspace_path, Color.WORKSPACE)
+        self.display_line(self.y, workspace_indent + len(workspace_path) + 2, self.hit.describe(), STATUS_COLORS[self.hit.status])
+
+
+class SearchResultsView(View):
+    """Display the ranked results found so far"""
+
+    def __init__(self, stdscr, y, x, search: WorkspaceSearch|None, screen: Screen):
+        super().__init__(stdscr, y, x)
+        self.search = search
+        self.screen = screen
+
+    def render(self):
+        if self.search is None:
+            self.display_line(self.y, self.x, MSG_SEARCH_EMPTY, Color.TITLE)
+            return
+
+        hits = self.search.results()
+        state = "done" if self.search.is_done else "searching..."
+        summary = f"# Matches for {self.search.user_filter}: {len(hits)}. " \
+                  f"Searched {self.search.searched}/{len(self.search.workspace_paths)} workspaces, {state}"
+        if self.search.failed:
+            summary += f" ({len(self.search.failed)} could not be read)"
+        self.display_line(self.y, self.x, summary, Color.TITLE, bold=True)
+
+        for number, hit in enumerate(hits[self.screen.offset:], start=self.screen.offset + 1):
+            self.y += 1
+            if self.y + 3 >= self.screen.y_max:
+                break
+            SearchHitView(self.stdscr, self.y, self.x, hit, number).render()
@@ -1,21 +1,25 @@
 
+from calcuresu.aggregates import SubtreeAggregate
 from calcuresu.base_view import View
 from calcuresu.classes.task import RootTask, Task
 from calcuresu.colors import Color
 from calcuresu.data import Status
 from calcuresu.singletons import global_config
+from calcuresu.views.fragments.aggregate import SubtreeAggregateView
 from calcuresu.views.fragments.deadline import TaskDeadlineView
 from calcuresu.views.fragments.timer import TimerView
 
 class TaskView(View):
     """Display a single task"""
 
-    def __init__(self, stdscr, y, x, task: Task, screen, indent: int, parent: Task|RootTask):
+    def __init__(self, stdscr, y, x, task: Task, screen, indent: int, parent: Task|RootTask,
+                 aggregate: SubtreeAggregate|None = None):
         super().__init__(stdscr, y, x)
         self.task = task
         self.screen = screen
         self.task_indent = indent
         self.parent = parent
+        self.aggregate = aggregate  # Totals of the subtasks, shown for collapsed tasks
 
     @property
     def color(self):
@@ -80,7 +84,7 @@ class TaskView(View):
                 parent_short_name = f"{parent_short_name[:10]}..."
             info_str += f" [belongs to ghost: '{parent_short_name}']"
 
-        if self.task.extra_info.strip():
+        if self.task.has_extra_info:
             info_str += f" {global_config.EXTRA_INFO_ICON.value}"
 
         if self.task.collapse:
@@ -111,3 +115,8 @@ class TaskView(View):
         timer_indentation = deadline_indentation + addition_indentation
         timer_view = TimerView(self.stdscr, self.y, timer_indentation, self.task.timer)
         timer_view.render()
+
+        if self.aggregate is not None and self.aggregate.count:
+            aggregate_indentation = timer_indentation + (len(timer_view.text) + 2 if self.task.timer.is_started else 0)
+            aggregate_view = SubtreeAggregateView(self.stdscr, self.y, aggregate_indentation, self.aggregate, self.task.timer)
+            aggregate_view.render()
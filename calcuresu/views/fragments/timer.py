@@ -18,7 +18,11 @@ class TimerView(View):
         TIMER_PAUSED_ICON = "⏯︎"
         return TIMER_RUNS_ICON if self.timer.is_counting else TIMER_PAUSED_ICON
 
+    @property
+    def text(self):
+        return f"{self.icon} {self.timer.passed_time}"
+
     def render(self):
         """Render a line with a timer and icon"""
         if self.timer.is_started:
-            self.display_line(self.y, self.x, f"{self.icon} {self.timer.passed_time}", self.color)
+            self.display_line(self.y, self.x, self.text, self.color)
@@ -1,5 +1,6 @@
 
 from calcuresu.base_view import View
+from calcuresu.classes.manifest import WorkspaceManifest
 from calcuresu.classes.task import RootTask, Task
 from calcuresu.classes.workspace import Workspace
 from calcuresu.colors import Color
@@ -13,17 +14,23 @@ from calcuresu.views.fragments.timer import TimerView
 class WorkspaceView(View):
     """Display a single workspace"""
 
-    def __init__(self, stdscr, y, x, workspace: Workspace, screen):
+    def __init__(self, stdscr, y, x, workspace: Workspace, screen, manifest: WorkspaceManifest|None = None):
         super().__init__(stdscr, y, x)
         self.workspace = workspace
         self.screen = screen
+        self.manifest = manifest
 
     def render(self):
         """Render a line with an icon, task, deadline, and timer"""
         icon_indent = self.x + 4
         self.display_line(self.y, icon_indent, global_config.TODO_ICON.value, Color.PROMPTS)
 
-        self.display_line(self.y, icon_indent, str(self.workspace.workspace_path), Color.WORKSPACE)
+        workspace_path = str(self.workspace.workspace_path)
+        self.display_line(self.y, icon_indent, workspace_path, Color.WORKSPACE)
+
+        # Statistics as of the last save, so the workspace itself isn't opened:
+        if self.manifest is not None:
+            self.display_line(self.y, icon_indent + len(workspace_path) + 2, self.manifest.summary(), Color.HINTS)
 
 class WorkspaceManagerView(View):
     """Display the entire workspace list"""
@@ -44,7 +51,8 @@ class WorkspaceManagerView(View):
             if self.y + 1 >= self.screen.y_max:
                 break
 
-            workspace_view = WorkspaceView(self.stdscr, self.y, self.x, workspace, self.screen)
+            manifest = self.workspaces.manifests.get(str(workspace.workspace_path))
+            workspace_view = WorkspaceView(self.stdscr, self.y, self.x, workspace, self.screen, manifest)
             workspace_view.render()
             if self.screen.selection_mode:
                 self.display_line(self.y, self.x, str(index + 1), Color.ACTIVE_PANE)
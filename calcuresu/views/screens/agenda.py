@@ -0,0 +1,55 @@
+from calcuresu.agenda import Agenda, describe_days_left
+from calcuresu.base_view import View
+from calcuresu.colors import Color
+from calcuresu.configuration import AppState
+from calcuresu.screen import Screen
+from calcuresu.translations.en import MSG_AGENDA_TITLE
+from calcuresu.views.fragments.header import HeaderView
+from calcuresu.views.fragments.timer import TimerView
+
+
+class AgendaScreenView(View):
+    """Running timers and upcoming deadlines of every workspace"""
+
+    def __init__(self, stdscr, y, x, screen: Screen, agenda: Agenda):
+        super().__init__(stdscr, y, x)
+        self.screen = screen
+        self.agenda = agenda
+
+    def render(self):
+        if not self.screen.need_refresh:
+            return
+
+        self.screen.currently_drawn = AppState.AGENDA
+        self.stdscr.clear()
+        self.fill_background()
+
+        header_view = HeaderView(self.stdscr, 0, 0, MSG_AGENDA_TITLE, self.screen)
+        header_view.render()
+
+        lines = [(f"# Running timers: {len(self.agenda.timers)}", None, Color.TITLE)]
+        for timer in self.agenda.timers:
+            lines.append((f"{timer.workspace_path}: {timer.indexed.name}", timer.indexed.timer, Color.WORKSPACE))
+
+        lines.append((f"# Deadlines: {len(self.agenda.deadlines)}", None, Color.TITLE))
+        for deadline in self.agenda.deadlines:
+            days_left = deadline.days_left(self.screen.today)
+            text = f"{deadline.indexed.deadline.strftime('%Y/%m/%d')} ({describe_days_left(days_left)})  " \
+                   f"{deadline.workspace_path}: {deadline.indexed.name}"
+            lines.append((text, None, Color.ERROR if days_left < 0 else Color.DEADLINES))
+
+        if self.agenda.unindexed:
+            lines.append((f"# Not indexed until they are saved again: {', '.join(self.agenda.unindexed)}", None, Color.HINTS))
+
+        y = 1
+        for text, timer, color in lines[self.screen.offset:]:
+            if y + 3 >= self.screen.y_max:
+                break
+            if timer is not None:
+                TimerView(self.stdscr, y, self.screen.x_min + 1, timer).render()
+                self.display_line(y, self.screen.x_min + 20, text, color)
+            else:
+                self.display_line(y, self.screen.x_min, text, color, bold=color == Color.TITLE)
+            y += 1
+
+        self.stdscr.refresh()
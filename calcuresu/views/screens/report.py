@@ -0,0 +1,75 @@
+from datetime import date, timedelta
+
+from calcuresu.base_view import View
+from calcuresu.colors import Color
+from calcuresu.configuration import AppState
+from calcuresu.data import Tasks
+from calcuresu.report import TimeReports, format_seconds, week_of
+from calcuresu.screen import Screen
+from calcuresu.singletons import global_config
+from calcuresu.translations.en import MSG_REPORT_TITLE
+from calcuresu.views.fragments.header import HeaderView
+
+
+REPORT_DAYS = 14
+REPORT_WEEKS = 8
+REPORT_SUBTREE_DEPTH = 2  # Deeper tasks are only in `calcuresu report`
+
+
+class ReportScreenView(View):
+    """Time tracked in the current workspace by day, by week and by subtree"""
+
+    def __init__(self, stdscr, y, x, screen: Screen, user_tasks: Tasks, reports: TimeReports):
+        super().__init__(stdscr, y, x)
+        self.screen = screen
+        self.user_tasks = user_tasks
+        self.reports = reports
+        self.has_running_timers = False
+
+    def render(self):
+        if not self.screen.need_refresh:
+            return
+
+        self.screen.currently_drawn = AppState.REPORT
+        self.stdscr.clear()
+        self.fill_background()
+
+        header_view = HeaderView(self.stdscr, 0, 0, MSG_REPORT_TITLE, self.screen)
+        header_view.render()
+
+        report = self.reports.report(self.user_tasks)
+        self.has_running_timers = bool(report.columns.running)
+        today = self.screen.today
+
+        lines = [(f"# Last {REPORT_DAYS} days", Color.TITLE)]
+        for days_ago in range(REPORT_DAYS):
+            day = today - timedelta(days=days_ago)
+            seconds = report.daily.get(day.toordinal(), 0.0)
+            lines.append((f"{day.strftime('%Y/%m/%d %a')}  {format_seconds(seconds):>7}", Color.TIMER if seconds else Color.HINTS))
+
+        weekly = report.weekly
+        this_week = week_of(today.toordinal())
+        lines.append((f"# Last {REPORT_WEEKS} weeks", Color.TITLE))
+        for weeks_ago in range(REPORT_WEEKS):
+            week = this_week - 7 * weeks_ago
+            seconds = weekly.get(week, 0.0)
+            lines.append((f"Week of {date.fromordinal(week).strftime('%Y/%m/%d')}  {format_seconds(seconds):>7}", Color.TIMER if seconds else Color.HINTS))
+
+        columns = report.columns
+        lines.append(("# Subtrees (own time / with subtasks)", Color.TITLE))
+        for row in report.subtrees(REPORT_SUBTREE_DEPTH):
+            name = columns.names[row]
+            if columns.private[row]:
+                name = global_config.PRIVACY_ICON.value * len(name)
+            text = f"{format_seconds(report.own[row]):>7} / {format_seconds(report.subtree[row]):>7}  " \
+                   f"{'  ' * columns.depths[row]}{name}"
+            lines.append((text, Color.HINTS if columns.archived[row] else Color.WORKSPACE))
+
+        y = 1
+        for text, color in lines[self.screen.offset:]:
+            if y + 3 >= self.screen.y_max:
+                break
+            self.display_line(y, self.screen.x_min, text, color, bold=color == Color.TITLE)
+            y += 1
+
+        self.stdscr.refresh()
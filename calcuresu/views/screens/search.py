@@ -0,0 +1,30 @@
+from calcuresu.base_view import View
+from calcuresu.configuration import AppState
+from calcuresu.screen import Screen
+from calcuresu.translations.en import MSG_SEARCH_TITLE
+from calcuresu.views.fragments.header import HeaderView
+from calcuresu.views.fragments.search import SearchResultsView
+
+
+class SearchScreenView(View):
+    """Search across every workspace, with the results that came in so far"""
+
+    def __init__(self, stdscr, y, x, screen: Screen):
+        super().__init__(stdscr, y, x)
+        self.screen = screen
+
+    def render(self):
+        if not self.screen.need_refresh:
+            return
+
+        self.screen.currently_drawn = AppState.SEARCH
+        self.stdscr.clear()
+        self.fill_background()
+
+        header_view = HeaderView(self.stdscr, 0, 0, MSG_SEARCH_TITLE, self.screen)
+        header_view.render()
+
+        results_view = SearchResultsView(self.stdscr, 1, self.screen.x_min, self.screen.search, self.screen)
+        results_view.render()
+
+        self.stdscr.refresh()
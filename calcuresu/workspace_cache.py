@@ -0,0 +1,177 @@
+"""Module that keeps recently used workspaces open, so switching between them doesn't load them again"""
+
+from collections import OrderedDict
+import curses
+import dbm
+import json
+import logging
+import os
+from pathlib import Path
+import pickle
+import shelve
+from sys import getsizeof
+import threading
+from typing import List
+
+from calcuresu.classes.workspace import Workspace
+from calcuresu.client import open_workspace_tasks
+from calcuresu.data import PreloadedTree, Tasks, Workspaces
+from calcuresu.screen import Screen
+from calcuresu.singletons import tracer
+
+
+def estimated_size(user_tasks: Tasks|None = None, task_tree: list|None = None):
+    """Rough size in bytes of a loaded task tree (the objects of the tasks themselves)"""
+    stack = list(task_tree if task_tree is not None else user_tasks.root_task.children)
+    size = 0
+    while stack:
+        task = stack.pop()
+        stack.extend(task.children)
+        size += getsizeof(task) + getsizeof(task.name) + getsizeof(task.children) + getsizeof(task.timer) + getsizeof(task.timer.stamps)
+    return size
+
+
+class WorkspaceCache:
+    """Open workspaces, least recently used first. A workspace is closed (which writes its pending changes
+    and releases its lock) once there are more than `capacity` open, or they take more than `memory_limit` bytes.
+    The most recently used workspaces of the previous sessions are preloaded in the background"""
+
+    def __init__(self, capacity: int, memory_limit: int, recent_file: Path):
+        self.capacity = max(1, capacity)
+        self.memory_limit = memory_limit
+        self.recent_file = recent_file
+        self._open: OrderedDict[str, tuple[Tasks, int]] = OrderedDict()  # Workspace path -> tasks and their size
+        self._preloaded: dict[str, PreloadedTree] = {}
+        self._preloaded_mutex = threading.Lock()  # Held to change either of them, or to read them from the preloader
+        self._preloader: threading.Thread|None = None
+        self._stop_preloading = threading.Event()
+
+    def open(self, stdscr: curses.window, screen: Screen, workspace: Workspace, workspaces: Workspaces) -> Tasks|None:
+        """The tasks of the workspace - from the cache, or loaded now (from a preloaded tree if there is one).
+        Returns None if the workspace couldn't be loaded"""
+        path = str(workspace.workspace_path)
+        self._remember_recent(path)
+
+        if path in self._open:
+            user_tasks, _ = self._open[path]
+            with self._preloaded_mutex:
+                self._open.move_to_end(path)
+            return user_tasks
+
+        user_tasks = open_workspace_tasks(workspace)
+        user_tasks.registry = workspaces
+        with self._preloaded_mutex:
+            preloaded = user_tasks.preloaded = self._preloaded.pop(path, None)
+        with tracer.span("open workspace", category="storage", preloaded=preloaded is not None):
+            if not user_tasks.initialize(stdscr, screen):
+                user_tasks.cleanup()
+                return None
+
+        # Measured once, since walking a large tree takes a while. The preloader measured the trees it read already
+        adopted = preloaded is not None and user_tasks.task_tree is preloaded.task_tree
+        size = preloaded.size if adopted else estimated_size(user_tasks)
+        with self._preloaded_mutex:
+            self._preloaded.pop(path, None)  # Preloaded while this one was being loaded
+            self._open[path] = (user_tasks, size)
+        self._evict()
+        return user_tasks
+
+    def _evict(self):
+        """Close the least recently used workspaces (never the one that was just opened) until the limits hold"""
+        while len(self._open) > 1 and (len(self._open) > self.capacity or self._memory_used() > self.memory_limit):
+            with self._preloaded_mutex:
+                _, (user_tasks, _) = self._open.popitem(last=False)
+            user_tasks.cleanup()
+
+    def discard(self, workspace: Workspace):
+        """Close a workspace that is about to be deleted, unless it is the one being used"""
+        path = str(workspace.workspace_path)
+        with self._preloaded_mutex:
+            self._preloaded.pop(path, None)
+            if path not in self._open or path == next(reversed(self._open)):
+                return
+            user_tasks, _ = self._open.pop(path)
+        user_tasks.cleanup()
+
+    def _memory_used(self):
+        with self._preloaded_mutex:
+            return self._memory_used_nolock()
+
+    def _memory_used_nolock(self):
+        return sum(preloaded.size for preloaded in self._preloaded.values()) + sum(size for _, size in self._open.values())
+
+    def close(self):
+        self._stop_preloading.set()
+        if self._preloader is not None:
+            self._preloader.join()
+        while self._open:
+            _, (user_tasks, _) = self._open.popitem(last=False)
+            user_tasks.cleanup()
+
+    """
+    Recently used workspaces - kept per user, next to the config file
+    """
+
+    def recent_workspaces(self) -> List[str]:
+        try:
+            with open(self.recent_file, encoding="utf-8") as f:
+                recent = json.load(f)
+        except (OSError, ValueError):
+            return []
+        return [path for path in recent if isinstance(path, str)]
+
+    def _remember_recent(self, path: str):
+        recent = [path, *(other for other in self.recent_workspaces() if other != path)][:self.capacity]
+        try:
+            with open(self.recent_file, "w", encoding="utf-8") as f:
+                json.dump(recent, f)
+        except OSError as e:
+            logging.error(f"Could not write the list of recent workspaces: {e}")
+
+    """
+    Preloading
+    """
+
+    def start_preloading(self, workspaces: Workspaces):
+        """Read the recently used workspaces (that are still in the list of workspaces) in the background"""
+        listed = {str(workspace.workspace_path) for workspace in workspaces.workspaces}
+        paths = [path for path in self.recent_workspaces() if path in listed]
+        if paths:
+            self._preloader = threading.Thread(target=self._preload, args=(paths,), name="workspace preloader", daemon=True)
+            self._preloader.start()
+
+    def _preload(self, paths: List[str]):
+        for path in paths:
+            if self._stop_preloading.is_set():
+                return
+            with self._preloaded_mutex:
+                if path in self._open:
+                    continue
+            if not os.path.isfile(path):
+                continue
+
+            try:
+                with tracer.span("preload workspace", category="storage"):
+                    preloaded = read_tree(path)
+            except (OSError, dbm.error, pickle.UnpicklingError, EOFError) as e:
+                logging.warning(f"Could not preload {path}: {e}")
+                continue
+            if preloaded is None:
+                continue
+
+            with self._preloaded_mutex:
+                if path in self._open:
+                    continue  # Opened while it was read, so this tree would never be used
+                if self._memory_used_nolock() + preloaded.size > self.memory_limit:
+                    return
+                self._preloaded[path] = preloaded
+
+
+def read_tree(path: str) -> PreloadedTree|None:
+    """Read the task tree of a workspace without locking it. Returns None if it was saved while it was read"""
+    with shelve.open(path, flag="r", protocol=4) as shelf:
+        generation = shelf.get("generation", 0)
+        task_tree = shelf.get("task_tree", [])
+        if shelf.get("generation", 0) != generation:
+            return None
+    return PreloadedTree(generation, task_tree, estimated_size(task_tree=task_tree))
@@ -24,6 +24,7 @@ setuptools.setup(
         ]
     },
     install_requires=["prompt_toolkit", "flufl.lock"],
+    extras_require={"reports": ["numpy"]},
     version=version,
     python_requires='~=3.10',
     classifiers=[